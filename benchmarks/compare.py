@@ -0,0 +1,72 @@
+"""Compare two benchmark result files.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 0.10]
+
+Prints the relative change of every metric per spider and scale (averaged over
+repeated runs) and exits with status 1 if throughput dropped, or time or memory
+grew, by more than the threshold.
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+# Metric -> True if higher is better.
+METRICS = {
+    'items_per_sec': True,
+    'requests_per_sec': True,
+    'crawl_seconds': False,
+    'wall_seconds': False,
+    'callback_cpu_seconds': False,
+    'cpu_seconds': False,
+    'peak_rss_mb': False,
+}
+
+
+def averages(path):
+    with open(path, encoding='utf-8') as f:
+        report = json.load(f)
+    runs = defaultdict(list)
+    for result in report['results']:
+        runs[(result['spider'], result['scale'])].append(result)
+    return report, {
+        key: {
+            metric: sum(result[metric] for result in results) / len(results)
+            for metric in METRICS if all(result.get(metric) is not None for result in results)
+        }
+        for key, results in runs.items()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files.')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative change that counts as a regression (default 0.10).')
+    args = parser.parse_args(argv)
+
+    baseline_report, baseline = averages(args.baseline)
+    candidate_report, candidate = averages(args.candidate)
+    print(f"baseline {baseline_report.get('commit')} vs candidate {candidate_report.get('commit')}")
+    regressions = []
+    for key in sorted(baseline.keys() & candidate.keys()):
+        spider_name, scale = key
+        print(f"\n{spider_name} @ {scale}")
+        for metric, higher_is_better in METRICS.items():
+            before, after = baseline[key].get(metric), candidate[key].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regressed = -change > args.threshold if higher_is_better else change > args.threshold
+            if regressed:
+                regressions.append(f"{spider_name} @ {scale} {metric}")
+            print(f"  {metric:22} {before:12.3f} -> {after:12.3f}  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    if regressions:
+        print(f"\n{len(regressions)} regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Throughput of a crawl shared by several workers through the MongoDB frontier.
+
+    python -m benchmarks.frontier --mongo-uri mongodb://localhost:27017/
+                                  [--workers 1,2,4] [--scale 1000] [--spider cab_minutes]
+                                  [-s NAME=VALUE ...]
+
+For each worker count, starts that many benchmark processes (see benchmarks.run) at
+once with MongoScheduler and MongoDupeFilter, all on a fresh crawl id, against one
+stand-in server. Prints the items and requests of the whole crawl, the wall time
+until the last worker finished, items/s and the speedup over the first worker
+count. The requests should not grow with the workers: every URL is fetched by
+exactly one of them.
+
+Needs a real mongod; the in-memory stand-in can't be shared between processes.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.run import ROOT, setting_pair
+from benchmarks.server import start_server
+
+FRONTIER_SETTINGS = {
+    'SCHEDULER': 'lincoln_scraper.frontier.MongoScheduler',
+    'DUPEFILTER_CLASS': 'lincoln_scraper.frontier.MongoDupeFilter',
+    'FRONTIER_COLLECTION_PREFIX': 'benchmark_frontier',
+    # The per-host limit holds across all workers; keep it out of the way so the
+    # crawl is bound by the workers themselves.
+    'CONCURRENT_REQUESTS_PER_DOMAIN': 64,
+}
+
+
+def run_workers(args, base_url, workers):
+    crawl_id = f"benchmark-{os.getpid()}-{workers}-{int(time.time())}"
+    children = []
+    started = time.perf_counter()
+    for worker in range(workers):
+        settings = dict(FRONTIER_SETTINGS, FRONTIER_CRAWL_ID=crawl_id, FRONTIER_WORKER_ID=f"{crawl_id}-{worker}")
+        settings.update(args.settings)
+        spec = {'spider': args.spider, 'base_url': base_url, 'mongo_uri': args.mongo_uri, 'settings': settings}
+        children.append(subprocess.Popen([sys.executable, '-m', 'benchmarks.run', '--single', json.dumps(spec)],
+                                         cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True))
+    results = []
+    for child in children:
+        stdout, stderr = child.communicate()
+        if child.returncode != 0:
+            sys.stderr.write(stderr)
+            raise SystemExit(f"A worker of the {workers}-worker run failed.")
+        results.append(json.loads(stdout.strip().splitlines()[-1]))
+    wall_seconds = time.perf_counter() - started
+    items = sum(result['items'] for result in results)
+    return {
+        'workers': workers,
+        'items': items,
+        'requests': sum(result['requests'] for result in results),
+        'wall_seconds': round(wall_seconds, 3),
+        'items_per_sec': round(items / wall_seconds, 1),
+        'items_per_worker': [result['items'] for result in results],
+        'errors': sum(result['errors'] for result in results),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark a crawl shared by several workers.')
+    parser.add_argument('--mongo-uri', required=True, help='The mongod holding the frontier (and the items).')
+    parser.add_argument('--workers', default='1,2,4', help='Comma-separated worker counts.')
+    parser.add_argument('--scale', type=int, default=1000, help='Number of events/documents to crawl.')
+    parser.add_argument('--spider', default='cab_minutes', help='lincoln_county or cab_minutes.')
+    parser.add_argument('-s', '--set', dest='settings', action='append', type=setting_pair, default=[],
+                        metavar='NAME=VALUE', help='Override a setting in every worker.')
+    args = parser.parse_args(argv)
+
+    server = start_server()
+    base_url = f"http://127.0.0.1:{server.server_port}/{args.scale}"
+    print(f"{'workers':>7} {'items':>7} {'requests':>9} {'wall s':>8} {'items/s':>8} {'speedup':>8}  items per worker")
+    single = None
+    for workers in [int(workers) for workers in args.workers.split(',')]:
+        result = run_workers(args, base_url, workers)
+        single = single or result['items_per_sec']
+        print(f"{workers:>7} {result['items']:>7} {result['requests']:>9} {result['wall_seconds']:>8.2f} "
+              f"{result['items_per_sec']:>8.1f} {result['items_per_sec'] / single:>7.2f}x  {result['items_per_worker']}")
+        if result['errors']:
+            print(f"  ! {result['errors']} errors logged")
+    server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
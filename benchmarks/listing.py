@@ -0,0 +1,109 @@
+"""Micro-benchmark of listing page parsing (links and dates), without any crawling.
+
+    python -m benchmarks.listing [--links 100,1000,10000] [--pages DIR] [--repeat 20]
+
+Times the shared extraction layer (lincoln_scraper.extraction) against the selector
+chain and strptime loop CabMinutesSpider used before, on stand-in listing pages with
+the given numbers of links and on every saved listing page (*.html) in --pages, e.g.
+copies of the codot.gov minutes and packets pages. For each page it prints the links
+and dated links both versions find, and the milliseconds per parse: "cold" with an
+empty date cache, "warm" with the texts already seen (as on the second listing page
+and every later run).
+"""
+import argparse
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from scrapy.http import HtmlResponse
+
+from benchmarks.server import listing_html
+from lincoln_scraper.extraction import extract_listing_links, parse_link_date
+
+LEGACY_DATE_FORMATS = ["%B %d, %Y", "%b %d, %Y", "%B %Y", "%b. %d, %Y", "%m/%d/%Y"]
+
+
+def legacy_parse(response):
+    """The listing parsing of CabMinutesSpider before the extraction layer."""
+    selectors = response.css('article div[class*="content"] p a, article div.item-list ul li a, article .field--name-body a')
+    if not selectors:
+        selectors = response.css('article a')
+        if not selectors:
+            selectors = response.css('a')
+    links, dated = 0, []
+    for selector in selectors:
+        text = selector.css('::text').get()
+        href = selector.attrib.get('href')
+        if not text or not href or href.strip() == '#':
+            continue
+        links += 1
+        date_string = text.strip().split('(')[0].strip()
+        for fmt in LEGACY_DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(date_string, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            continue
+        dated.append((parsed.strftime('%Y-%m-%d'), response.urljoin(href)))
+    return links, dated
+
+
+def current_parse(response):
+    links = extract_listing_links(response)
+    dated = []
+    for text, url, _ in links:
+        link_date = parse_link_date(text)
+        if link_date:
+            dated.append((link_date.start, url))
+    return len(links), dated
+
+
+def fresh_response(url, body):
+    # A new response per run, so nothing parsel or Scrapy caches per response carries over.
+    return HtmlResponse(url=url, body=body, encoding='utf-8')
+
+
+def time_parse(parse, url, body, repeat, clear_cache=False):
+    best = None
+    for _ in range(repeat):
+        response = fresh_response(url, body)
+        if clear_cache:
+            parse_link_date.cache_clear()
+        started = time.perf_counter()
+        result = parse(response)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, result
+
+
+def pages(args):
+    for count in [int(count) for count in args.links.split(',')]:
+        yield f"stand-in, {count} links", 'http://127.0.0.1/listing', listing_html(count * 2, False).encode()
+    if args.pages:
+        for path in sorted(Path(args.pages).glob('*.html')):
+            yield path.name, 'https://www.codot.gov/programs/aeronautics/colorado-aeronautical-board/', path.read_bytes()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark listing page parsing.')
+    parser.add_argument('--links', default='100,1000,10000', help='Comma-separated link counts of the stand-in pages.')
+    parser.add_argument('--pages', help='Directory of saved listing pages (*.html).')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per page; the fastest one counts.')
+    args = parser.parse_args(argv)
+
+    print(f"{'page':32} {'links':>7} {'dated':>7} {'legacy ms':>10} {'cold ms':>9} {'warm ms':>9} {'speedup':>8}")
+    for name, url, body in pages(args):
+        legacy_ms, (legacy_links, legacy_dated) = time_parse(legacy_parse, url, body, args.repeat)
+        cold_ms, _ = time_parse(current_parse, url, body, args.repeat, clear_cache=True)
+        warm_ms, (links, dated) = time_parse(current_parse, url, body, args.repeat)
+        print(f"{name[:32]:32} {links:>7} {len(dated):>7} {legacy_ms:>10.2f} {cold_ms:>9.2f} {warm_ms:>9.2f} {legacy_ms / warm_ms:>7.1f}x")
+        if len(dated) < len(legacy_dated):
+            print(f"  ! legacy parsing found {len(legacy_dated)} dated links, the extraction layer only {len(dated)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
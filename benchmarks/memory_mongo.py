@@ -0,0 +1,179 @@
+"""In-memory stand-in for the parts of pymongo the MongoPipeline uses.
+
+Lets the benchmarks exercise the pipeline (batching, upserts, pruning) without a
+mongod. Only the features the pipeline needs are implemented.
+"""
+import itertools
+import threading
+
+from pymongo import InsertOne, UpdateOne
+
+
+class MemoryCollection:
+    def __init__(self, name):
+        self.name = name
+        self.documents = {}
+        self.unique_key = None
+        self.unique_index = {}
+        self.indexes = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def create_index(self, keys, unique=False, name=None):
+        self.indexes[name] = {'key': keys, 'unique': unique}
+        if unique:
+            self.unique_key = [field for field, _ in keys]
+            self.unique_index = {self._key(doc): _id for _id, doc in self.documents.items()}
+        return name
+
+    def drop_index(self, name):
+        index = self.indexes.pop(name)
+        if index['unique']:
+            self.unique_key = None
+            self.unique_index = {}
+
+    def index_information(self):
+        return dict(self.indexes)
+
+    def _key(self, document):
+        return tuple(document.get(field) for field in self.unique_key)
+
+    def insert_one(self, document):
+        with self.lock:
+            self._insert(dict(document))
+
+    def _insert(self, document):
+        _id = document.setdefault('_id', next(self.ids))
+        self.documents[_id] = document
+        if self.unique_key:
+            self.unique_index[self._key(document)] = _id
+
+    def insert_many(self, documents, ordered=True):
+        with self.lock:
+            for document in documents:
+                self._insert(dict(document))
+
+    def find_one(self, query, projection=None):
+        return next(self.find(query, projection), None)
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        # Only {'$inc': ...} on a document matched by _id, returning the updated document.
+        with self.lock:
+            document = self.documents.get(query['_id'])
+            if document is None:
+                if not upsert:
+                    return None
+                document = self.documents[query['_id']] = dict(query)
+            for field, amount in update['$inc'].items():
+                document[field] = document.get(field, 0) + amount
+            return dict(document)
+
+    def bulk_write(self, operations, ordered=True):
+        result = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'writeErrors': []}
+        with self.lock:
+            for operation in operations:
+                # The operation classes keep their arguments in private attributes.
+                if isinstance(operation, InsertOne):
+                    self._insert(dict(operation._doc))
+                    result['nInserted'] += 1
+                elif isinstance(operation, UpdateOne):
+                    self._update(operation._filter, operation._doc['$set'], operation._upsert, result)
+                else:
+                    raise NotImplementedError(f"{type(operation).__name__} is not supported by the in-memory stand-in")
+        return BulkResult(result)
+
+    def _update(self, key_filter, values, upsert, result):
+        if self.unique_key and list(key_filter) == self.unique_key:
+            _id = self.unique_index.get(self._key(key_filter))
+        else:
+            _id = next((_id for _id, doc in self.documents.items() if self._matches(doc, key_filter)), None)
+        if _id is None:
+            if upsert:
+                self._insert(dict(key_filter, **values))
+                result['nUpserted'] += 1
+            return
+        result['nMatched'] += 1
+        document = self.documents[_id]
+        if any(document.get(field) != value for field, value in values.items()):
+            document.update(values)
+            result['nModified'] += 1
+
+    @staticmethod
+    def _matches(document, query):
+        for field, condition in query.items():
+            if not (isinstance(condition, dict) and condition and all(op.startswith('$') for op in condition)):
+                condition = {'$eq': condition}
+            value = document.get(field)
+            for op, operand in condition.items():
+                if op == '$eq':
+                    matched = value == operand
+                elif op == '$ne':
+                    matched = value != operand
+                elif op == '$in':
+                    matched = value in operand
+                elif op == '$nin':
+                    matched = value not in operand
+                elif op == '$exists':
+                    matched = (field in document) == bool(operand)
+                elif op == '$type' and operand == 'string':
+                    matched = isinstance(value, str)
+                else:
+                    raise NotImplementedError(f"{op} is not supported by the in-memory stand-in")
+                if not matched:
+                    return False
+        return True
+
+    def find(self, query=None, projection=None, batch_size=None):
+        with self.lock:
+            matches = [doc for doc in self.documents.values() if self._matches(doc, query or {})]
+        if projection:
+            fields = set(projection) | {'_id'}
+            matches = [{field: doc[field] for field in fields if field in doc} for doc in matches]
+        return iter(matches)
+
+    def delete_many(self, query):
+        with self.lock:
+            ids = [_id for _id, doc in self.documents.items() if self._matches(doc, query)]
+            for _id in ids:
+                document = self.documents.pop(_id)
+                if self.unique_key:
+                    self.unique_index.pop(self._key(document), None)
+        return DeleteResult(len(ids))
+
+    def count_documents(self, query):
+        return sum(1 for _ in self.find(query))
+
+
+class BulkResult:
+    def __init__(self, result):
+        self.bulk_api_result = result
+
+
+class DeleteResult:
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, MemoryCollection(name))
+
+    def drop_collection(self, name):
+        self.collections.pop(name, None)
+
+    def list_collection_names(self):
+        return list(self.collections)
+
+
+class MemoryClient:
+    def __init__(self):
+        self.databases = {}
+
+    def __getitem__(self, name):
+        return self.databases.setdefault(name, MemoryDatabase())
+
+    def close(self):
+        pass
@@ -0,0 +1,94 @@
+"""Latency of lincoln_scraper.query as the collection grows.
+
+    python -m benchmarks.query --mongo-uri mongodb://localhost:27017/
+                               [--sizes 1000,100000,1000000] [--repeat 20]
+
+Fills a scratch collection (benchmark.query_documents) with synthetic documents up
+to each size in turn, then times typical queries: the newest page of one source,
+a category within a date range, and a page deep inside the results reached with a
+keyset cursor. For each it prints the median milliseconds and, from explain(), the
+index used and the documents examined; both should stay flat as the size grows.
+
+Needs a real mongod, since the point is MongoDB's query plans.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+from lincoln_scraper.mongo import get_client, release_client
+from lincoln_scraper.query import DocumentQuery, encode_cursor
+
+SOURCES = ['cab_minutes', 'lincoln_county'] + [f"civicclerk/tenant{number}" for number in range(18)]
+CATEGORIES = ['minutes', 'agenda', 'agenda_packet', 'other']
+FIRST_DATE = date(2000, 1, 1)
+PAGE_SIZE = 100
+
+
+def fill(collection, size):
+    count = collection.estimated_document_count()
+    batch = []
+    for number in range(count, size):
+        batch.append({
+            'date': (FIRST_DATE + timedelta(days=random.randrange(9000))).isoformat(),
+            'meeting_title': f"Board Meeting {number}",
+            'category': random.choice(CATEGORIES),
+            'URL': f"https://example.org/documents/{number}",
+            'source': random.choice(SOURCES),
+            'document_key': f"url:https://example.org/documents/{number}",
+        })
+        if len(batch) == 10000:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+
+def cases(query):
+    # A cursor 50 pages into cab_minutes: where a client that kept paging would be.
+    deep = list(query.find(limit=PAGE_SIZE * 50, projection={'date': 1}, source='cab_minutes'))
+    after = encode_cursor(deep[-1]) if deep else None
+    return {
+        'newest page of a source': {'source': 'cab_minutes'},
+        'category in a date range': {'category': 'minutes', 'since': '2010-01-01', 'until': '2010-12-31'},
+        'source + category': {'source': 'lincoln_county', 'category': 'agenda'},
+        'deep keyset page': {'source': 'cab_minutes', 'after': after},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark indexed queries against a growing collection.')
+    parser.add_argument('--mongo-uri', required=True)
+    parser.add_argument('--sizes', default='1000,100000,1000000', help='Comma-separated collection sizes.')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per query; the median counts.')
+    args = parser.parse_args(argv)
+
+    random.seed(0)
+    collection = get_client(args.mongo_uri)['benchmark']['query_documents']
+    collection.drop()
+    query = DocumentQuery(args.mongo_uri, 'benchmark', 'query_documents')
+    query.open()
+    print(f"{'documents':>10}  {'query':26} {'median ms':>10} {'examined':>9}  index")
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            fill(collection, size)
+            for name, filters in cases(query).items():
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    query.page(limit=PAGE_SIZE, **filters)
+                    timings.append((time.perf_counter() - started) * 1000)
+                plan = query.explain(limit=PAGE_SIZE + 1, **filters)
+                print(f"{size:>10}  {name:26} {statistics.median(timings):>10.2f} "
+                      f"{plan['documents_examined']:>9}  {plan['index']}")
+    finally:
+        query.close()
+        collection.drop()
+        release_client(args.mongo_uri)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Offline crawl benchmarks against the local stand-in server.
+
+    python -m benchmarks.run [--scales 10,100,1000] [--spiders lincoln_county,cab_minutes]
+                             [--mongo-uri URI] [--repeat N] [-s NAME=VALUE ...]
+                             [--output results.json]
+
+Each (spider, scale) pair runs in a fresh process against benchmarks.server, with the
+items going through MongoPipeline into a real mongod (--mongo-uri) or the in-memory
+stand-in. The results are written as JSON; compare two of them with
+`python -m benchmarks.compare`.
+
+The scale is the number of CivicClerk events (two documents each) for lincoln_county
+and the number of Hyland documents for cab_minutes. Politeness settings (delays,
+AutoThrottle, one request per domain) are turned off so the numbers measure the
+crawler rather than sleeps; pass -s to put them back.
+"""
+import argparse
+import json
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SPIDERS = ('lincoln_county', 'cab_minutes')
+DEFAULT_SCALES = (10, 100, 1000)
+MEMORY_MONGO_URI = 'memory://benchmark'
+
+BENCHMARK_SETTINGS = {
+    'LOG_LEVEL': 'WARNING',
+    'TELNETCONSOLE_ENABLED': False,
+    'HTTPCACHE_ENABLED': False,
+    'CRAWL_STATE_ENABLED': False,
+    'AUTOTHROTTLE_ENABLED': False,
+    'DOWNLOAD_DELAY': 0,
+    'CONCURRENT_REQUESTS_PER_DOMAIN': 16,
+    'CONCURRENT_REQUESTS_PER_IP': 0,
+    # Measure the pipeline the way the scheduled workflow runs it.
+    'MONGO_BUFFERED_WRITES': True,
+    'MONGO_SYNC_MODE': 'upsert',
+    'MONGO_DB': 'benchmark',
+    'MONGO_COLLECTION': 'documents',
+}
+
+
+def benchmark_spider(spider_name, base_url):
+    """Subclass the project spider so it crawls the stand-in server instead of the live sites."""
+    if spider_name == 'lincoln_county':
+        from lincoln_scraper.spiders.lincoln_county_spider import LincolnCountySpider
+        return type('BenchmarkLincolnCountySpider', (LincolnCountySpider,), {
+            'tenants': [{
+                'id': 'lincolncowi', 'name': 'Lincoln County, WI', 'source': 'lincoln_county',
+                'api_base_url': f"{base_url}/v1/Events", 'portal_base_url': f"{base_url}/portal",
+            }],
+            'max_pages': 0,
+        })
+    if spider_name == 'cab_minutes':
+        from lincoln_scraper.spiders.cab_minutes import CabMinutesSpider
+        return type('BenchmarkCabMinutesSpider', (CabMinutesSpider,), {
+            'allowed_domains': ['127.0.0.1'],
+            'listing_pages': [
+                {'url': f"{base_url}/cab/minutes", 'source_type': 'minutes'},
+                {'url': f"{base_url}/cab/packets", 'source_type': 'agenda_packet'},
+            ],
+        })
+    raise ValueError(f"Unknown spider '{spider_name}'. Expected one of: {', '.join(SPIDERS)}")
+
+
+def run_single(spec):
+    """Run one benchmark in this process and return its measurements."""
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+    from lincoln_scraper.instrumentation import InstrumentationExtension
+    from lincoln_scraper.mongo import register_client
+
+    settings = get_project_settings()
+    for name, value in dict(BENCHMARK_SETTINGS, **spec['settings']).items():
+        settings.set(name, value, priority='cmdline')
+    if spec['mongo_uri']:
+        settings.set('MONGO_URI', spec['mongo_uri'], priority='cmdline')
+    else:
+        from benchmarks.memory_mongo import MemoryClient
+        register_client(MEMORY_MONGO_URI, MemoryClient())
+        settings.set('MONGO_URI', MEMORY_MONGO_URI, priority='cmdline')
+    # Callback CPU time comes from the project's own timing middleware and instrumentation.
+    settings.set('INSTRUMENTATION_ENABLED', True, priority='cmdline')
+    instrumentation_dir = tempfile.mkdtemp(prefix='benchmark-instrumentation-')
+    settings.set('INSTRUMENTATION_DIR', instrumentation_dir, priority='cmdline')
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(benchmark_spider(spec['spider'], spec['base_url']))
+    process.crawl(crawler)
+    process.start()
+    shutil.rmtree(instrumentation_dir, ignore_errors=True)
+
+    stats = crawler.stats.get_stats()
+    instrumentation = next(ext for ext in crawler.extensions.middlewares if isinstance(ext, InstrumentationExtension))
+    callback_cpu = sum(histograms['cpu'].sum for histograms in instrumentation.callbacks.values())
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    crawl_seconds = stats.get('elapsed_time_seconds') or 0
+    items = stats.get('item_scraped_count', 0)
+    requests = stats.get('downloader/request_count', 0)
+    return {
+        'finish_reason': stats.get('finish_reason'),
+        'items': items,
+        'requests': requests,
+        'crawl_seconds': round(crawl_seconds, 3),
+        'items_per_sec': round(items / crawl_seconds, 1) if crawl_seconds else None,
+        'requests_per_sec': round(requests / crawl_seconds, 1) if crawl_seconds else None,
+        'callback_cpu_seconds': round(callback_cpu, 3),
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+        'peak_rss_mb': round(usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+        'errors': stats.get('log_count/ERROR', 0),
+        'mongo_batches': stats.get('mongo/batches_written', 0),
+    }
+
+
+def setting_pair(value):
+    name, sep, setting_value = value.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"Expected NAME=VALUE, got '{value}'")
+    return name, setting_value
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the spiders against a local stand-in server.')
+    parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)),
+                        help='Comma-separated numbers of events/documents, e.g. 10,1000,100000.')
+    parser.add_argument('--spiders', default=','.join(SPIDERS), help='Comma-separated spider names.')
+    parser.add_argument('--mongo-uri', help='Write to this mongod instead of the in-memory stand-in.')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per spider and scale.')
+    parser.add_argument('-s', '--set', dest='settings', action='append', type=setting_pair, default=[],
+                        metavar='NAME=VALUE', help='Override a setting in every run.')
+    parser.add_argument('--output', help='Write the results to this file instead of stdout.')
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.single:
+        # Child process: run one benchmark and report it on the last line of stdout.
+        print(json.dumps(run_single(json.loads(args.single))))
+        return 0
+
+    from benchmarks.server import start_server
+    server = start_server()
+    results = []
+    for spider_name in args.spiders.split(','):
+        for scale in [int(scale) for scale in args.scales.split(',')]:
+            for run in range(args.repeat):
+                spec = {
+                    'spider': spider_name,
+                    'base_url': f"http://127.0.0.1:{server.server_port}/{scale}",
+                    'mongo_uri': args.mongo_uri,
+                    'settings': dict(args.settings),
+                }
+                started = time.perf_counter()
+                child = subprocess.run([sys.executable, '-m', 'benchmarks.run', '--single', json.dumps(spec)],
+                                       cwd=ROOT, capture_output=True, text=True)
+                wall_seconds = time.perf_counter() - started
+                if child.returncode != 0:
+                    sys.stderr.write(child.stderr)
+                    raise SystemExit(f"Benchmark {spider_name} at scale {scale} failed.")
+                result = {'spider': spider_name, 'scale': scale, 'run': run, 'wall_seconds': round(wall_seconds, 3)}
+                result.update(json.loads(child.stdout.strip().splitlines()[-1]))
+                results.append(result)
+                sys.stderr.write(
+                    f"{spider_name} @ {scale}: {result['items']} items in {result['crawl_seconds']}s "
+                    f"({result['items_per_sec']} items/s, {result['requests_per_sec']} req/s, "
+                    f"{result['peak_rss_mb']} MB peak RSS)\n"
+                )
+    server.shutdown()
+
+    import scrapy
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'scrapy': scrapy.__version__,
+        'mongo': 'mongod' if args.mongo_uri else 'memory',
+        'settings': dict(args.settings),
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n', encoding='utf-8')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
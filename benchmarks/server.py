@@ -0,0 +1,179 @@
+"""Local stand-in for the CivicClerk API, the codot.gov listing pages and Hyland.
+
+    python -m benchmarks.server [--port 8780]
+
+Every path starts with the scale, i.e. the number of events or documents to serve,
+so one server covers all benchmark runs:
+
+    /<scale>/v1/Events                  OData events with $top/$skip/$count paging,
+                                        @odata.nextLink and publishedFiles
+    /<scale>/cab/minutes, /<scale>/cab/packets
+                                        codot-style listing pages, half of the
+                                        documents each, linking to ...
+    /<scale>/hyland/docpop?docid=N      ... a redirect to
+    /<scale>/hyland/PdfPop.aspx?docid=N the document itself, a one-page PDF (supports
+                                        HEAD and If-None-Match)
+
+Responses are generated from the scale alone, so every run sees the same data.
+"""
+import argparse
+import json
+import threading
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+FILES_PER_EVENT = 2
+DEFAULT_PAGE_SIZE = 100
+DOCUMENT_SIZE = 64 * 1024
+FIRST_MEETING = date(2000, 1, 1)
+# Fields CivicClerk returns with every event when no $select is given.
+UNPROJECTED_FIELDS = {
+    'eventDescription': 'Regular meeting of the board. ' * 20,
+    'location': {'address1': '1110 E Main St', 'city': 'Merrill', 'state': 'WI', 'zipCode': '54452'},
+    'categoryName': 'Board',
+    'isPublished': 'Published',
+    'agendaId': 0,
+}
+
+
+def pdf_document(number):
+    """A one-page PDF naming the meeting, padded to about DOCUMENT_SIZE bytes."""
+    text = f"Minutes of the Board Meeting {number} held on {meeting_date(number):%B %d, %Y}. Road closure on Main Street."
+    content = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>',
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    body, offsets = b'%PDF-1.4\n', []
+    for index, obj in enumerate(objects, 1):
+        offsets.append(len(body))
+        body += b'%d 0 obj\n%s\nendobj\n' % (index, obj)
+    xref = len(body)
+    body += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    body += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    body += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    # Pad with a PDF comment so transfers stay about as large as real documents.
+    return body + b'%' + b'0' * max(0, DOCUMENT_SIZE - len(body) - 2) + b'\n'
+
+
+def meeting_date(number):
+    return FIRST_MEETING + timedelta(days=number % 9000)
+
+
+def link_text(number):
+    """Listing link text in one of the date formats used on codot.gov."""
+    day = meeting_date(number)
+    text = (
+        day.strftime('%B %d, %Y'),
+        day.strftime('%b. %d, %Y').replace('Sep.', 'Sept.'),
+        day.strftime('%m/%d/%Y'),
+        f"{day:%B} {day.day}-{day.day + 1}, {day.year}" if day.day < 28 else day.strftime('%B %d, %Y'),
+    )[number % 4]
+    return f"{text} (Workshop)" if number % 10 == 0 else text
+
+
+def event(number, projected):
+    data = {
+        'id': number + 1,
+        'eventName': f"Board Meeting {number + 1}",
+        'startDateTime': meeting_date(number).strftime('%Y-%m-%dT18:00:00Z'),
+        'publishedFiles': [
+            {'type': file_type, 'fileId': (number + 1) * 10 + offset}
+            for offset, file_type in enumerate(('Agenda', 'Minutes')[:FILES_PER_EVENT])
+        ],
+    }
+    if not projected:
+        data.update(UNPROJECTED_FIELDS)
+        for published_file in data['publishedFiles']:
+            published_file.update({'name': f"{published_file['type']} {number + 1}", 'fileType': 1, 'url': ''})
+    return data
+
+
+def listing_html(scale, packets):
+    # Minutes get the even document numbers, packets the odd ones.
+    links = ''.join(
+        f'<p><a href="/{scale}/hyland/docpop?docid={number}">{link_text(number)}</a></p>\n'
+        for number in range(int(packets), scale, 2)
+    )
+    return f'<html><body><article><div class="content">\n{links}</div></article></body></html>'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        url = urlparse(self.path)
+        scale, _, path = url.path.lstrip('/').partition('/')
+        if not scale.isdigit():
+            return self.send(404, b'', 'text/plain', send_body)
+        scale = int(scale)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if path == 'v1/Events':
+            return self.events(scale, query, send_body)
+        if path in ('cab/minutes', 'cab/packets'):
+            return self.listing(scale, path.endswith('packets'), send_body)
+        if path == 'hyland/docpop':
+            location = f"/{scale}/hyland/PdfPop.aspx?docid={query.get('docid', '0')}"
+            return self.send(302, b'', 'text/html', send_body, {'Location': location})
+        if path == 'hyland/PdfPop.aspx':
+            etag = f'"doc-{query.get("docid")}"'
+            if self.headers.get('If-None-Match') == etag:
+                return self.send(304, b'', 'application/pdf', send_body, {'ETag': etag})
+            body = pdf_document(int(query.get('docid', 0)))
+            return self.send(200, body, 'application/pdf', send_body, {'ETag': etag})
+        return self.send(404, b'', 'text/plain', send_body)
+
+    def events(self, scale, query, send_body):
+        top = int(query.get('$top', DEFAULT_PAGE_SIZE))
+        skip = int(query.get('$skip', 0))
+        projected = '$select' in query
+        data = {'value': [event(number, projected) for number in range(skip, min(skip + top, scale))]}
+        if query.get('$count') == 'true':
+            data['@odata.count'] = scale
+        if skip + top < scale:
+            next_query = dict(query, **{'$top': top, '$skip': skip + top})
+            next_query.pop('$count', None)
+            data['@odata.nextLink'] = f"http://{self.headers['Host']}/{scale}/v1/Events?{urlencode(next_query)}"
+        self.send(200, json.dumps(data).encode(), 'application/json', send_body)
+
+    def listing(self, scale, packets, send_body):
+        self.send(200, listing_html(scale, packets).encode(), 'text/html; charset=utf-8', send_body)
+
+    def send(self, status, body, content_type, send_body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+
+def start_server(port=0):
+    """Start the stand-in on a background thread and return the server (see server.server_port)."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8780)
+    args = parser.parse_args()
+    print(f"Serving on http://127.0.0.1:{args.port}/<scale>/")
+    ThreadingHTTPServer(('127.0.0.1', args.port), StandInHandler).serve_forever()
@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+SHARD_UNITS = {'month': 1, 'quarter': 3}
+
+
+def parse_date_arg(value):
+    """Parse a YYYY-MM-DD spider argument into a date."""
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def date_shards(since, until, unit='month'):
+    """Split the inclusive range since..until into calendar-aligned shards.
+
+    Yields (shard_key, start_date, end_date) tuples, e.g. ('2010-01', 2010-01-01, 2010-01-31)
+    for months or ('2010-Q1', 2010-01-01, 2010-03-31) for quarters. The first and last
+    shards are clipped to the requested range.
+    """
+    if unit not in SHARD_UNITS:
+        raise ValueError(f"Unknown shard unit '{unit}'. Expected one of: {', '.join(SHARD_UNITS)}")
+    step = SHARD_UNITS[unit]
+    # Align the first shard to the start of its month or quarter.
+    month = since.month - (since.month - 1) % step
+    shard_start = date(since.year, month, 1)
+    while shard_start <= until:
+        next_month = shard_start.month + step
+        next_start = date(shard_start.year + (next_month - 1) // 12, (next_month - 1) % 12 + 1, 1)
+        if unit == 'month':
+            key = shard_start.strftime('%Y-%m')
+        else:
+            key = f"{shard_start.year}-Q{(shard_start.month - 1) // 3 + 1}"
+        yield key, max(shard_start, since), min(next_start - timedelta(days=1), until)
+        shard_start = next_start
+
+
+class BackfillCheckpoint:
+    """Remembers which backfill shards finished, in a small JSON file.
+
+    The file is rewritten atomically after every completed shard, so an
+    interrupted backfill resumes with the shards that are still missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = set()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                self.completed = set(json.load(f).get('completed', []))
+            logging.info(f"Resuming backfill from {self.path}: {len(self.completed)} shards already completed.")
+        return self
+
+    def mark_completed(self, shard_key):
+        self.completed.add(shard_key)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'completed': sorted(self.completed)}, f)
+        os.replace(tmp_path, self.path)
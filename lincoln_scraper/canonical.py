@@ -0,0 +1,83 @@
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from w3lib.url import canonicalize_url
+
+# Query parameters that only say how a link was found, never which document it is.
+TRACKING_PARAMS = {'fbclid', 'gclid', 'msclkid', 'mc_cid', 'mc_eid', '_ga', '_gl'}
+TRACKING_PREFIXES = ('utm_',)
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+# Hyland links: the docpop redirect (/hyland/docpop?docid=N) and the page it redirects
+# to (/hyland/PdfPop.aspx?docid=N) are the same document.
+HYLAND_PATH_RE = re.compile(r'/(?:docpop|pdfpop)(?:\.aspx)?$', re.IGNORECASE)
+# CivicClerk portal links (/event/<event id>/files/<kind>/<file id>) and the API's file
+# stream (GetMeetingFileStream(fileId=N,...)) of <tenant>.portal/api.civicclerk.com.
+CIVICCLERK_PORTAL_RE = re.compile(r'/event/\d+/files/[^/]+/(\d+)/?$', re.IGNORECASE)
+CIVICCLERK_STREAM_RE = re.compile(r'GetMeetingFileStream\(fileId=(\d+)', re.IGNORECASE)
+CIVICCLERK_HOST_RE = re.compile(r'^([^.]+)\.(?:portal|api)\.civicclerk\.com$')
+
+
+def canonical_url(url):
+    """Normalize a URL so equivalent spellings compare equal.
+
+    Lowercases the scheme and host, drops default ports, fragments and tracking
+    parameters (utm_*, fbclid, ...) and sorts the remaining query parameters.
+    """
+    parts = urlsplit(canonicalize_url(url.strip()))
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    host, _, port = netloc.rpartition(':')
+    if host and DEFAULT_PORTS.get(scheme) == port:
+        netloc = host
+    query = urlencode([
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in TRACKING_PARAMS and not name.lower().startswith(TRACKING_PREFIXES)
+    ])
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def civicclerk_document_key(tenant_id, file_id):
+    return f"civicclerk:{tenant_id.lower()}:{file_id}"
+
+
+def document_key(url):
+    """The stable identity of the document a URL points to.
+
+    'hyland:<docid>' for Hyland links (whichever of the redirect or its target),
+    'civicclerk:<tenant>:<file id>' for CivicClerk portal and file stream links, and
+    'url:<canonical URL>' for anything else.
+    """
+    parts = urlsplit(url.strip())
+    if HYLAND_PATH_RE.search(parts.path):
+        docid = next((value for name, value in parse_qsl(parts.query) if name.lower() == 'docid' and value), None)
+        if docid:
+            return f"hyland:{docid.strip()}"
+    tenant = CIVICCLERK_HOST_RE.match((parts.hostname or '').lower())
+    if tenant:
+        file_id = CIVICCLERK_PORTAL_RE.search(parts.path) or CIVICCLERK_STREAM_RE.search(url)
+        if file_id:
+            return civicclerk_document_key(tenant[1], file_id[1])
+    return f"url:{canonical_url(url)}"
+
+
+class DocumentKeyIndex:
+    """Crawl-wide record of the documents requested and emitted so far, by document key."""
+
+    def __init__(self):
+        self.requested = set()
+        self.emitted = set()
+
+    def request(self, key):
+        """True the first time a document is requested; False once it was requested or emitted."""
+        if key in self.requested or key in self.emitted:
+            return False
+        self.requested.add(key)
+        return True
+
+    def emit(self, key):
+        """True the first time an item for a document is emitted."""
+        if key in self.emitted:
+            return False
+        self.emitted.add(key)
+        return True
@@ -0,0 +1,279 @@
+"""Change feed of the scraped collection: which documents were inserted, updated or removed.
+
+With CHANGE_FEED_ENABLED (and MONGO_SYNC_MODE = 'upsert'), MongoPipeline stores a
+content fingerprint with every document: a hash of its content fields (CONTENT_FIELDS),
+which include the file's sha256 when DocumentDownloadPipeline stored the file. Other
+fields, such as where the file is kept, do not count as a change. When the download
+was skipped, the item takes the stored file fields over instead. Items whose
+fingerprint matches the stored one are not written at all. Every real change is
+appended to the change log with the next sequence number:
+
+    {"seq": 42, "op": "updated", "key": {"document_key": "hyland:123"}, "source": "cab_minutes",
+     "fingerprint": "...", "previous_fingerprint": "...", "time": "...", "document": {...}}
+
+'inserted' and 'updated' events carry the new document, 'disappeared' events the last
+stored version of a document that a finished run pruned. The log is a MongoDB
+collection (CHANGE_FEED_COLLECTION in MONGO_DB, the sequence number is the _id) or,
+with CHANGE_FEED_BACKEND = 'jsonl', a file (CHANGE_FEED_PATH, default
+.scrapy/changes.jsonl). Consumers remember the last seq they processed and read on
+from there:
+
+    python -m lincoln_scraper.changefeed [--since SEQ] [--limit N]
+
+Events are recorded before the documents are written, so after a crash a change may
+be reported twice but is never lost.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from pymongo import ReturnDocument
+from scrapy.utils.project import data_path, get_project_settings
+from lincoln_scraper.mongo import get_client, release_client
+from lincoln_scraper.query import plain
+
+FINGERPRINT_FIELD = 'content_fingerprint'
+# The fields a document's fingerprint covers; absent ones are left out.
+CONTENT_FIELDS = ('date', 'meeting_title', 'category', 'URL', 'source', 'tenant', 'download_url',
+                  'document_key', 'sha256')
+# Set by DocumentDownloadPipeline; missing when the download was skipped.
+FILE_FIELDS = ('sha256', 'file_path', 'file_size')
+CHANGE_OPS = ('inserted', 'updated', 'disappeared')
+BACKENDS = ('mongo', 'jsonl')
+# A sequence number missing from the log is waited for this long before readers skip
+# it: another writer may have reserved it and not inserted its events yet.
+SETTLE_SECONDS = 30
+
+# Sequence numbers are reserved and their events written under one lock, so writers
+# in this process never leave a gap that a reader could overtake.
+_append_lock = threading.Lock()
+
+
+def content_fingerprint(document):
+    """SHA-256 of a document's content fields."""
+    fields = {field: document[field] for field in CONTENT_FIELDS if document.get(field) is not None}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def classify(collection, documents, key_fields):
+    """Compare documents about to be written with what collection holds for their keys.
+
+    Returns (events, to_write): an 'inserted' or 'updated' event for every real change,
+    and the documents that need writing, i.e. the changed ones plus stored documents
+    whose stored fingerprint is missing or outdated. A document without file fields
+    (its download was skipped) takes them over from the stored one.
+    """
+    keys = [tuple(document.get(field) for field in key_fields) for document in documents]
+    if len(key_fields) == 1:
+        query = {key_fields[0]: {'$in': [key[0] for key in keys]}}
+    else:
+        query = {'$or': [dict(zip(key_fields, key)) for key in keys]}
+    stored = {
+        tuple(doc.get(field) for field in key_fields): doc
+        for doc in collection.find(query, [*key_fields, *CONTENT_FIELDS, *FILE_FIELDS, FINGERPRINT_FIELD])
+    }
+    events, to_write = [], []
+    for key, document in zip(keys, documents):
+        fingerprint = document[FINGERPRINT_FIELD]
+        previous = stored.get(key)
+        if previous is None:
+            events.append(change_event('inserted', key_fields, key, document, fingerprint))
+            to_write.append(document)
+            continue
+        if not any(document.get(field) for field in FILE_FIELDS) and previous.get('sha256'):
+            document.update({field: previous[field] for field in FILE_FIELDS if field in previous})
+            fingerprint = document[FINGERPRINT_FIELD] = content_fingerprint(document)
+        # Recomputed rather than read, so fingerprints stored by an older field set
+        # are refreshed without reporting a change.
+        previous_fingerprint = content_fingerprint(previous)
+        if previous_fingerprint != fingerprint:
+            events.append(change_event('updated', key_fields, key, document, fingerprint, previous_fingerprint))
+            to_write.append(document)
+        elif previous.get(FINGERPRINT_FIELD) != fingerprint:
+            to_write.append(document)
+    return events, to_write
+
+
+def change_event(op, key_fields, key, document, fingerprint, previous_fingerprint=None):
+    document = {field: value for field, value in document.items() if field != '_id'}
+    return {
+        'op': op,
+        'key': dict(zip(key_fields, key)),
+        'source': document.get('source'),
+        'fingerprint': fingerprint,
+        'previous_fingerprint': previous_fingerprint,
+        'time': datetime.now(timezone.utc),
+        'document': document,
+    }
+
+
+class MongoChangeLog:
+    """Append-only change log in a collection; each event's _id is its sequence number.
+
+    The last number handed out is kept in <collection>_sequence and reserved with $inc,
+    a block per batch, so several processes can append to the same log.
+    """
+
+    def __init__(self, mongo_uri, mongo_db, collection_name):
+        self.mongo_uri = mongo_uri
+        self.mongo_db = mongo_db
+        self.collection_name = collection_name
+        self.client = None
+
+    def open(self):
+        self.client = get_client(self.mongo_uri)
+        db = self.client[self.mongo_db]
+        self.collection = db[self.collection_name]
+        self.sequence = db[f"{self.collection_name}_sequence"]
+
+    def close(self):
+        if self.client is not None:
+            release_client(self.mongo_uri)
+            self.client = None
+
+    def append(self, events):
+        if not events:
+            return
+        with _append_lock:
+            counter = self.sequence.find_one_and_update(
+                {'_id': 'seq'}, {'$inc': {'value': len(events)}},
+                upsert=True, return_document=ReturnDocument.AFTER,
+            )
+            first = counter['value'] - len(events) + 1
+            self.collection.insert_many(
+                [dict(event, _id=seq) for seq, event in enumerate(events, start=first)],
+                ordered=True,
+            )
+
+    def last_seq(self):
+        counter = self.sequence.find_one({'_id': 'seq'})
+        return counter['value'] if counter else 0
+
+    def read(self, since=0, limit=None, settle=SETTLE_SECONDS):
+        """Events after sequence number since, in order.
+
+        Stops before a missing number younger than settle seconds, so a consumer that
+        saves the last seq it saw never skips events another writer is still inserting.
+        """
+        cursor = self.collection.find({'_id': {'$gt': since}}, sort=[('_id', pymongo.ASCENDING)])
+        if limit:
+            cursor = cursor.limit(limit)
+        expected = since + 1
+        settled_before = datetime.now(timezone.utc) - timedelta(seconds=settle)
+        for event in cursor:
+            if event['_id'] != expected and _aware(event['time']) > settled_before:
+                break
+            expected = event['_id'] + 1
+            event['seq'] = event.pop('_id')
+            yield event
+
+
+def _aware(value):
+    # pymongo returns naive UTC datetimes unless the client is tz_aware.
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class JsonlChangeLog:
+    """Append-only change log in a JSON Lines file, for a single process.
+
+    Each line starts with its sequence number ({"seq": N, ...}), so reading on from a
+    sequence number only parses the lines after it in full.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.seq = 0
+
+    def open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.seq = self.last_seq()
+
+    def close(self):
+        pass
+
+    def append(self, events):
+        if not events:
+            return
+        with _append_lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for event in events:
+                    self.seq += 1
+                    f.write(json.dumps(dict({'seq': self.seq}, **plain(event)), default=str, ensure_ascii=False) + '\n')
+
+    def last_seq(self):
+        if not os.path.exists(self.path):
+            return 0
+        last = 0
+        for seq, _ in self._lines():
+            last = seq
+        return last
+
+    def read(self, since=0, limit=None, settle=None):
+        if not os.path.exists(self.path):
+            return
+        count = 0
+        for seq, line in self._lines():
+            if seq <= since:
+                continue
+            yield json.loads(line)
+            count += 1
+            if limit and count >= limit:
+                return
+
+    def _lines(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('{"seq": '):
+                    yield int(line[8:line.index(',')]), line
+
+
+def change_log_from_settings(settings):
+    """The change log configured by CHANGE_FEED_* settings, or None if the feed is disabled."""
+    if not settings.getbool('CHANGE_FEED_ENABLED'):
+        return None
+    backend = settings.get('CHANGE_FEED_BACKEND', 'mongo')
+    if backend == 'mongo':
+        return MongoChangeLog(
+            settings.get('MONGO_URI'),
+            settings.get('MONGO_DB', 'scrapy_data'),
+            settings.get('CHANGE_FEED_COLLECTION', 'document_changes'),
+        )
+    if backend == 'jsonl':
+        return JsonlChangeLog(settings.get('CHANGE_FEED_PATH') or data_path('changes.jsonl', createdir=True))
+    raise ValueError(f"Unknown CHANGE_FEED_BACKEND '{backend}'. Expected one of: {', '.join(BACKENDS)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print change feed events after a sequence number, as JSON lines.')
+    parser.add_argument('--since', type=int, default=0, help='Last sequence number already processed (default: 0, from the start).')
+    parser.add_argument('--limit', type=int, help='At most this many events.')
+    parser.add_argument('--last-seq', action='store_true', help='Print the last sequence number handed out and exit.')
+    args = parser.parse_args(argv)
+
+    settings = get_project_settings()
+    settings.set('CHANGE_FEED_ENABLED', True)
+    change_log = change_log_from_settings(settings)
+    change_log.open()
+    try:
+        if args.last_seq:
+            print(change_log.last_seq())
+            return 0
+        last = args.since
+        for event in change_log.read(args.since, args.limit):
+            print(json.dumps(plain(event), default=str, ensure_ascii=False))
+            last = event['seq']
+        sys.stderr.write(f"Read up to sequence number {last}; pass --since {last} next time.\n")
+        return 0
+    finally:
+        change_log.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    raise SystemExit(main())
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+
+import pymongo
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.project import data_path
+from lincoln_scraper.mongo import get_client, release_client
+
+
+class JsonCrawlStateStore:
+    """Crawl state kept in memory and persisted to a single JSON file.
+
+    Entries are grouped by namespace (e.g. 'hyland', 'civicclerk_file') and
+    keyed by a string such as a listing link or "<event id>:<file id>".
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+
+    def open(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+            logging.info(f"Loaded crawl state from {self.path} ({self.count()} entries).")
+
+    def close(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Other spiders in the same process may have saved the file since we loaded it,
+        # so merge our entries into its current contents rather than overwriting them.
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                merged = json.load(f)
+            for namespace, entries in self.entries.items():
+                merged.setdefault(namespace, {}).update(entries)
+            self.entries = merged
+        # Write to a temporary file first so an interrupted save can't corrupt the state.
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+        logging.info(f"Saved crawl state to {self.path} ({self.count()} entries).")
+
+    def count(self):
+        return sum(len(namespace) for namespace in self.entries.values())
+
+    def get(self, namespace, key):
+        return self.entries.get(namespace, {}).get(key)
+
+    def set(self, namespace, key, value):
+        self.entries.setdefault(namespace, {})[key] = value
+        self.dirty = True
+
+
+class MongoCrawlStateStore(JsonCrawlStateStore):
+    """Crawl state stored in a Mongo collection, one document per entry.
+
+    The whole state is read at open so lookups stay in memory; changed
+    entries are written back with a single bulk upsert at close.
+    """
+
+    def __init__(self, mongo_uri, mongo_db, collection_name):
+        super().__init__(path=None)
+        self.mongo_uri = mongo_uri
+        self.mongo_db = mongo_db
+        self.collection_name = collection_name
+        self.changed = set()
+
+    def open(self):
+        self.client = get_client(self.mongo_uri)
+        self.collection = self.client[self.mongo_db][self.collection_name]
+        for doc in self.collection.find({}, {'namespace': 1, 'key': 1, 'value': 1}):
+            self.entries.setdefault(doc['namespace'], {})[doc['key']] = doc['value']
+        logging.info(f"Loaded crawl state from {self.mongo_db}.{self.collection_name} ({self.count()} entries).")
+
+    def close(self):
+        try:
+            if self.changed:
+                self.collection.bulk_write([
+                    pymongo.UpdateOne(
+                        {'_id': f"{namespace}:{key}"},
+                        {'$set': {'namespace': namespace, 'key': key, 'value': self.entries[namespace][key]}},
+                        upsert=True,
+                    )
+                    for namespace, key in self.changed
+                ], ordered=False)
+                logging.info(f"Saved {len(self.changed)} crawl state entries to {self.mongo_db}.{self.collection_name}.")
+                self.changed.clear()
+        finally:
+            release_client(self.mongo_uri)
+
+    def set(self, namespace, key, value):
+        super().set(namespace, key, value)
+        self.changed.add((namespace, key))
+
+
+class CrawlStateExtension:
+    """Opens the crawl state store for the running spider as ``spider.crawl_state``.
+
+    Spiders use it to skip documents they already resolved in an earlier run,
+    or to revalidate them with conditional requests (CRAWL_STATE_REVALIDATE).
+    """
+
+    def __init__(self, store, stats):
+        self.store = store
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CRAWL_STATE_ENABLED'):
+            raise NotConfigured
+        backend = settings.get('CRAWL_STATE_BACKEND', 'file')
+        if backend == 'file':
+            store = JsonCrawlStateStore(settings.get('CRAWL_STATE_PATH') or data_path('crawlstate.json', createdir=True))
+        elif backend == 'mongo':
+            store = MongoCrawlStateStore(
+                mongo_uri=settings.get('MONGO_URI'),
+                mongo_db=settings.get('MONGO_DB', 'scrapy_data'),
+                collection_name=settings.get('CRAWL_STATE_MONGO_COLLECTION', 'crawl_state'),
+            )
+        else:
+            raise NotConfigured(f"Unknown CRAWL_STATE_BACKEND '{backend}'. Expected 'file' or 'mongo'.")
+        ext = cls(store, crawler.stats)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.store.open()
+        spider.crawl_state = self.store
+        self.stats.set_value('crawl_state/entries_loaded', self.store.count())
+
+    def spider_closed(self, spider):
+        # Entries record facts observed in this run, so they are saved even if the run was cut short.
+        self.store.close()
@@ -0,0 +1,220 @@
+import re
+from collections import namedtuple
+from datetime import date
+from functools import lru_cache
+from urllib.parse import urljoin, urlsplit
+
+from lxml import etree
+from scrapy.utils.response import get_base_url
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Streaming only beats json.loads with one of ijson's compiled backends; the pure
+# Python one is several times slower.
+STREAMING_JSON_AVAILABLE = ijson is not None and ijson.backend in ('yajl2_c', 'yajl2_cffi')
+
+# Month names and the abbreviations seen on codot.gov ("Jan", "Jan.", "Sept", "Sept.").
+MONTHS = {
+    'jan': 1, 'january': 1, 'feb': 2, 'february': 2, 'mar': 3, 'march': 3, 'apr': 4, 'april': 4,
+    'may': 5, 'jun': 6, 'june': 6, 'jul': 7, 'july': 7, 'aug': 8, 'august': 8,
+    'sep': 9, 'sept': 9, 'september': 9, 'oct': 10, 'october': 10, 'nov': 11, 'november': 11,
+    'dec': 12, 'december': 12,
+}
+_MONTH = r'(?:' + '|'.join(sorted(MONTHS, key=len, reverse=True)) + r')\.?'
+_DAY = r'\d{1,2}(?:st|nd|rd|th)?'
+_DASH = r'\s*(?:-|–|—|to|through|&|and)\s*'
+
+# Every date format seen in listing link texts, as one anchored pattern:
+#   "January 15, 2024", "Jan 15, 2024", "Jan. 15, 2024", "Sept. 5 2023", "15 January 2024",
+#   "March 3-4, 2022", "March 31 - April 1, 2022", "May 2021", "10/05/2020", "10/5/20",
+#   "10/05/2020 - 10/06/2020"
+# followed by anything (" (Workshop)", " - Special Meeting", ...).
+LINK_DATE_RE = re.compile(
+    r'^\s*(?:'
+    rf'(?P<month>{_MONTH})\s+(?P<day>{_DAY})'
+    rf'(?:{_DASH}(?:(?P<end_month>{_MONTH})\s+)?(?P<end_day>{_DAY}))?,?\s+(?P<year>\d{{4}})'
+    rf'|(?P<dmy_day>{_DAY})\s+(?P<dmy_month>{_MONTH}),?\s+(?P<dmy_year>\d{{4}})'
+    rf'|(?P<only_month>{_MONTH}),?\s+(?P<only_year>\d{{4}})'
+    r'|(?P<num_month>\d{1,2})/(?P<num_day>\d{1,2})/(?P<num_year>\d{4}|\d{2})'
+    r'(?:' + _DASH + r'(?P<num_end_month>\d{1,2})/(?P<num_end_day>\d{1,2})/(?P<num_end_year>\d{4}|\d{2}))?'
+    r')(?![\w/])',
+    re.IGNORECASE,
+)
+WORKSHOP_RE = re.compile(r'\bworkshop\b', re.IGNORECASE)
+_ORDINAL_RE = re.compile(r'(?:st|nd|rd|th)$', re.IGNORECASE)
+
+# start and end are ISO dates (end is None unless the text names a range); month_only
+# is True for texts like "May 2021", which get the first of the month.
+LinkDate = namedtuple('LinkDate', 'start end workshop month_only')
+
+
+def _month(value):
+    return MONTHS[value.lower().rstrip('.')]
+
+
+def _day(value):
+    return int(_ORDINAL_RE.sub('', value))
+
+
+def _year(value):
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+@lru_cache(maxsize=8192)
+def parse_link_date(text):
+    """Recognize the meeting date in a listing link text such as "Sept. 5, 2023 (Workshop)".
+
+    Returns a LinkDate, or None if the text doesn't start with a date. Results are
+    memoized, since the same texts come back on every run and on both listing pages.
+    """
+    match = LINK_DATE_RE.match(text)
+    if not match:
+        return None
+    groups = match.groupdict()
+    end = None
+    month_only = False
+    try:
+        if groups['month']:
+            year = int(groups['year'])
+            start = date(year, _month(groups['month']), _day(groups['day']))
+            if groups['end_day']:
+                end_month = _month(groups['end_month']) if groups['end_month'] else start.month
+                end = date(year, end_month, _day(groups['end_day']))
+                if end < start and groups['end_month']:
+                    # "December 30 - January 2, 2024": the year belongs to the end of the range.
+                    start = start.replace(year=year - 1)
+        elif groups['dmy_day']:
+            start = date(int(groups['dmy_year']), _month(groups['dmy_month']), _day(groups['dmy_day']))
+        elif groups['only_month']:
+            start = date(int(groups['only_year']), _month(groups['only_month']), 1)
+            month_only = True
+        else:
+            start = date(_year(groups['num_year']), int(groups['num_month']), int(groups['num_day']))
+            if groups['num_end_day']:
+                end = date(_year(groups['num_end_year']), int(groups['num_end_month']), int(groups['num_end_day']))
+    except ValueError:
+        # Matches the shape of a date but isn't one (e.g. "February 30, 2024").
+        return None
+    if end is not None and end < start:
+        end = None
+    return LinkDate(
+        start.isoformat(),
+        end.isoformat() if end else None,
+        bool(WORKSHOP_RE.search(text, match.end())),
+        month_only,
+    )
+
+
+ISO_DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})(?:[T ]|$)')
+
+
+def iso_date(value):
+    """The YYYY-MM-DD date of an ISO 8601 timestamp such as '2024-05-01T18:00:00Z', or None."""
+    match = ISO_DATE_RE.match(value or '')
+    if not match:
+        return None
+    try:
+        return date(int(match[1]), int(match[2]), int(match[3])).isoformat()
+    except ValueError:
+        return None
+
+
+# The document links on the codot.gov listing pages, most specific first. Compiled once.
+# Each walks the page's links a single time and keeps those inside the right elements
+# (ancestor tests), which is much faster on long pages than descending container by
+# container like "article div[class*=content] p a" does.
+_IN_ARTICLE = 'ancestor::article'
+LISTING_LINK_XPATHS = [
+    etree.XPath(
+        'descendant::a[@href]['
+        f"ancestor::p[ancestor::div[contains(@class, 'content')][{_IN_ARTICLE}]]"
+        f" or ancestor::li[ancestor::ul[ancestor::div[contains(concat(' ', normalize-space(@class), ' '), ' item-list ')][{_IN_ARTICLE}]]]"
+        f" or ancestor::*[contains(concat(' ', normalize-space(@class), ' '), ' field--name-body ')][{_IN_ARTICLE}]"
+        ']'
+    ),
+    etree.XPath(f'descendant::a[@href][{_IN_ARTICLE}]'),  # the site's markup changed: any link in the article
+    etree.XPath('descendant::a[@href]'),  # last resort
+]
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def _absolute_url(href, base_url, origin):
+    # urljoin dominates the cost of long pages, and almost every link is root-relative
+    # ("/hyland/docpop?docid=1") or absolute, which need no real joining.
+    if href.startswith(('https://', 'http://')):
+        return href
+    if href.startswith('/') and not href.startswith('//') and '/.' not in href:
+        return origin + href
+    return urljoin(base_url, href)
+
+
+def extract_listing_links(response):
+    """Return (link text, absolute URL, tier) for the document links on a listing page.
+
+    tier is the index of the XPath in LISTING_LINK_XPATHS that found them; the
+    broader ones are only tried when the more specific ones find nothing. Links
+    without text and in-page anchors are skipped.
+    """
+    root = response.selector.root
+    base_url = get_base_url(response)
+    base = urlsplit(base_url)
+    origin = f"{base.scheme}://{base.netloc}"
+    for tier, xpath in enumerate(LISTING_LINK_XPATHS):
+        links = []
+        for anchor in xpath(root):
+            href = anchor.get('href').strip()
+            if not href or href.startswith('#'):
+                continue
+            # All of the link's text, so markup inside the link (<strong>Sept.</strong> 5, 2023)
+            # doesn't hide the date.
+            text = _WHITESPACE_RE.sub(' ', ''.join(anchor.itertext())).strip()
+            if text:
+                links.append((text, _absolute_url(href, base_url, origin), tier))
+        if links:
+            return links
+    return []
+
+
+def iter_odata_values(body, metadata):
+    """Yield the entries of an OData page's 'value' array one by one, straight from the bytes.
+
+    Only the entry being decoded is held in memory, never the whole document (nor the
+    decoded text of the body). The page's other top-level fields ('@odata.nextLink',
+    '@odata.count', ...) are stored in metadata as they are read, so metadata is
+    complete once the generator is exhausted. Needs ijson (STREAMING_JSON_AVAILABLE);
+    raises ijson.JSONError on malformed input, possibly after yielding some entries.
+    """
+    depth = 0
+    nesting = 0  # Bracket depth inside the entry being built
+    builder = None
+    for prefix, event, value in ijson.parse(body, use_float=True):
+        if builder is not None:
+            # Inside an entry: build it up until its closing bracket.
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                nesting += 1
+            elif event in ('end_map', 'end_array'):
+                nesting -= 1
+                if nesting == 0:
+                    yield builder.value
+                    builder = None
+            continue
+        if depth == 2 and prefix == 'value.item':
+            if event in ('start_map', 'start_array'):
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+                nesting = 1
+            else:
+                yield value
+            continue
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+        elif depth == 1 and event != 'map_key':
+            # A top-level scalar; its prefix is the key itself (even '@odata.nextLink').
+            metadata[prefix] = value
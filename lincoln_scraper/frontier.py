@@ -0,0 +1,588 @@
+"""Crawl frontier and dupefilter in MongoDB, shared by several worker processes.
+
+Start the same spider on as many workers (processes or machines) as needed:
+
+    scrapy crawl cab_minutes -s SCHEDULER=lincoln_scraper.frontier.MongoScheduler \\
+        -s DUPEFILTER_CLASS=lincoln_scraper.frontier.MongoDupeFilter
+
+Workers with the same FRONTIER_CRAWL_ID (default: the spider name) share one queue
+and one set of seen requests; each stops once nothing is left queued or in flight.
+The reactor never waits for the database: new requests are written in batches,
+claimed requests are fetched ahead of the engine and the end-of-crawl check is
+cached, all on pool threads. Enable FrontierAckMiddleware (on in settings.py) so
+requests dropped by a downloader middleware are acknowledged too.
+"""
+import logging
+import os
+import pickle
+import socket
+from collections import deque
+from time import time
+
+import pymongo
+from bson import Binary
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from scrapy import signals
+from scrapy.core.scheduler import BaseScheduler
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.exceptions import IgnoreRequest
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.misc import build_from_crawler, load_object
+from scrapy.utils.request import request_from_dict
+from twisted.internet import defer, task, threads
+from lincoln_scraper.mongo import get_client, release_client
+
+# Meta keys the scheduler sets on requests it hands out; never stored with a request.
+FRONTIER_META_KEYS = ('frontier_id', 'frontier_slot')
+# How many ready hosts a claim looks at before giving up for this round.
+CLAIM_CANDIDATES = 8
+
+# Sent by FrontierAckMiddleware for a claimed request that a downloader middleware
+# dropped before it reached a download slot; handlers get `request`.
+request_ignored = object()
+
+
+def frontier_settings(crawler):
+    settings = crawler.settings
+    return {
+        'mongo_uri': settings.get('FRONTIER_MONGO_URI') or settings.get('MONGO_URI'),
+        'mongo_db': settings.get('MONGO_DB', 'scrapy_data'),
+        'prefix': settings.get('FRONTIER_COLLECTION_PREFIX', 'frontier'),
+        # Workers cooperate on the crawl with the same id: by default the spider name.
+        'crawl_id': settings.get('FRONTIER_CRAWL_ID') or crawler.spider.name,
+    }
+
+
+class MongoFrontier:
+    """Request queue and host politeness state shared by every worker of a crawl.
+
+    Three collections (prefix 'frontier' by default):
+
+    - <prefix>_requests: one document per queued or leased request. Workers claim
+      requests with an atomic findAndModify that leases them for lease_seconds;
+      a request whose lease runs out (its worker crashed) goes back to the queue.
+      Acknowledged requests are deleted.
+    - <prefix>_hosts: one document per download slot (host) with its pending and
+      in-flight counts and the earliest time the next request may start. A request
+      is only claimed after its host was reserved with a compare-and-set, so the
+      host's concurrency and delay hold across all workers.
+    - <prefix>_fingerprints: fingerprints of every request seen in the crawl (MongoDupeFilter).
+    """
+
+    def __init__(self, mongo_uri, mongo_db, prefix, crawl_id, worker_id, lease_seconds=300, max_leases=3):
+        self.mongo_uri = mongo_uri
+        self.mongo_db = mongo_db
+        self.prefix = prefix
+        self.crawl_id = crawl_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.max_leases = max_leases
+        self.client = None
+
+    def open(self):
+        self.client = get_client(self.mongo_uri)
+        db = self.client[self.mongo_db]
+        self.requests = db[f"{self.prefix}_requests"]
+        self.hosts = db[f"{self.prefix}_hosts"]
+        self.fingerprints = db[f"{self.prefix}_fingerprints"]
+        self.requests.create_index([('crawl', pymongo.ASCENDING), ('slot', pymongo.ASCENDING), ('state', pymongo.ASCENDING),
+                                    ('priority', pymongo.DESCENDING), ('_id', pymongo.ASCENDING)], name='claim')
+        self.requests.create_index([('crawl', pymongo.ASCENDING), ('state', pymongo.ASCENDING), ('lease_until', pymongo.ASCENDING)], name='leases')
+        self.hosts.create_index([('crawl', pymongo.ASCENDING), ('next_allowed_at', pymongo.ASCENDING)], name='ready')
+        self.fingerprints.create_index([('crawl', pymongo.ASCENDING)], name='crawl')
+
+    def close(self):
+        if self.client is not None:
+            release_client(self.mongo_uri)
+            self.client = None
+
+    def reset_if_finished(self):
+        """Start a new crawl when the previous one with this id has nothing left to do."""
+        if self.requests.find_one({'crawl': self.crawl_id}, {'_id': 1}) is not None:
+            return False
+        self.fingerprints.delete_many({'crawl': self.crawl_id})
+        self.hosts.delete_many({'crawl': self.crawl_id})
+        return True
+
+    def has_requests(self):
+        # Queued or leased by any worker: leased requests may still produce new ones.
+        return self.requests.find_one({'crawl': self.crawl_id}, {'_id': 1}) is not None
+
+    def mark_seen(self, fingerprints):
+        """Record request fingerprints; returns those some worker had already seen."""
+        if not fingerprints:
+            return set()
+        try:
+            self.fingerprints.insert_many(
+                [{'_id': f"{self.crawl_id}:{fingerprint}", 'crawl': self.crawl_id} for fingerprint in fingerprints],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            errors = e.details['writeErrors']
+            if any(error['code'] != 11000 for error in errors):
+                raise
+            return {fingerprints[error['index']] for error in errors}
+        return set()
+
+    def push(self, entries):
+        """Queue a batch of requests; returns the entries some worker had already seen.
+
+        Each entry is a dict with the serialized 'payload', its 'slot', 'priority', the
+        slot's 'concurrency' and 'delay', and the request 'fingerprint' (None for
+        requests that skip the dupefilter).
+        """
+        seen = self.mark_seen([entry['fingerprint'] for entry in entries if entry['fingerprint']])
+        fresh = [entry for entry in entries if entry['fingerprint'] not in seen]
+        if fresh:
+            self.requests.insert_many([{
+                'crawl': self.crawl_id, 'slot': entry['slot'], 'state': 'queued', 'priority': entry['priority'],
+                'request': Binary(entry['payload']), 'leases': 0, 'created_at': time(),
+            } for entry in fresh])
+            by_slot = {}
+            for entry in fresh:
+                by_slot.setdefault(entry['slot'], []).append(entry)
+            for slot, slot_entries in by_slot.items():
+                self._add_pending(slot, len(slot_entries), slot_entries[-1]['concurrency'], slot_entries[-1]['delay'])
+        return [entry for entry in entries if entry['fingerprint'] in seen]
+
+    def _add_pending(self, slot, count, concurrency, delay):
+        host_id = f"{self.crawl_id}:{slot}"
+        update = {'$inc': {'pending': count}, '$set': {'concurrency': concurrency, 'delay': delay},
+                  '$setOnInsert': {'crawl': self.crawl_id, 'slot': slot, 'in_flight': 0, 'next_allowed_at': 0}}
+        try:
+            self.hosts.update_one({'_id': host_id}, update, upsert=True)
+        except DuplicateKeyError:
+            # Another worker inserted the host document at the same moment: now it exists.
+            self.hosts.update_one({'_id': host_id}, update)
+
+    def claim(self, now):
+        """Lease the best queued request of a host that may be contacted now, or return None.
+
+        Returns (document, seconds until a host may be ready) where the second value
+        tells the caller how long to wait before trying again when nothing was claimed.
+        """
+        candidates = self.hosts.find(
+            {'crawl': self.crawl_id, 'pending': {'$gt': 0}},
+            sort=[('next_allowed_at', pymongo.ASCENDING)], limit=CLAIM_CANDIDATES,
+        )
+        wait = None
+        for host in candidates:
+            if host['next_allowed_at'] > now:
+                wait = host['next_allowed_at'] - now if wait is None else min(wait, host['next_allowed_at'] - now)
+                continue
+            if host['in_flight'] >= host['concurrency']:
+                continue
+            # Compare-and-set on the values we read, so two workers can't both take the slot.
+            reserved = self.hosts.update_one(
+                {'_id': host['_id'], 'next_allowed_at': host['next_allowed_at'], 'in_flight': host['in_flight']},
+                {'$inc': {'in_flight': 1, 'pending': -1}, '$set': {'next_allowed_at': now + host['delay']}},
+            )
+            if not reserved.modified_count:
+                continue
+            doc = self.requests.find_one_and_update(
+                {'crawl': self.crawl_id, 'slot': host['slot'], 'state': 'queued'},
+                {'$set': {'state': 'leased', 'worker': self.worker_id, 'lease_until': now + self.lease_seconds},
+                 '$inc': {'leases': 1}},
+                sort=[('priority', pymongo.DESCENDING), ('_id', pymongo.ASCENDING)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if doc is not None:
+                return doc, None
+            # The pending count was off (e.g. after a crash): recount and give the slot back.
+            pending = self.requests.count_documents({'crawl': self.crawl_id, 'slot': host['slot'], 'state': 'queued'})
+            self.hosts.update_one({'_id': host['_id']}, {'$inc': {'in_flight': -1}, '$set': {'pending': pending}})
+        return None, wait
+
+    def claim_many(self, now, limit):
+        """Lease up to limit requests, see claim(). Returns (documents, wait)."""
+        documents = []
+        while len(documents) < limit:
+            doc, wait = self.claim(now)
+            if doc is None:
+                return documents, wait
+            documents.append(doc)
+        return documents, None
+
+    def ack(self, request_id, slot):
+        """The request was handled: remove it and free its host slot."""
+        if self.requests.delete_one({'_id': request_id, 'worker': self.worker_id}).deleted_count:
+            self.hosts.update_one({'_id': f"{self.crawl_id}:{slot}"}, {'$inc': {'in_flight': -1}})
+
+    def requeue_expired(self, now):
+        """Return requests whose lease ran out to the queue. Returns (requeued, abandoned)."""
+        requeued = abandoned = 0
+        while True:
+            doc = self.requests.find_one_and_update(
+                {'crawl': self.crawl_id, 'state': 'leased', 'lease_until': {'$lt': now}},
+                {'$set': {'state': 'queued'}, '$unset': {'worker': '', 'lease_until': ''}},
+            )
+            if doc is None:
+                return requeued, abandoned
+            host_id = f"{self.crawl_id}:{doc['slot']}"
+            if doc['leases'] >= self.max_leases:
+                # Leased again and again without being acknowledged: give up on it.
+                self.requests.delete_one({'_id': doc['_id'], 'state': 'queued'})
+                self.hosts.update_one({'_id': host_id}, {'$inc': {'in_flight': -1}})
+                abandoned += 1
+            else:
+                self.hosts.update_one({'_id': host_id}, {'$inc': {'in_flight': -1, 'pending': 1}})
+                requeued += 1
+
+    def release_worker(self, acknowledge):
+        """Drop (acknowledge=True) or requeue this worker's remaining leases."""
+        while True:
+            doc = self.requests.find_one_and_update(
+                {'crawl': self.crawl_id, 'state': 'leased', 'worker': self.worker_id},
+                {'$set': {'state': 'queued'}, '$unset': {'worker': '', 'lease_until': ''}},
+            )
+            if doc is None:
+                return
+            host_id = f"{self.crawl_id}:{doc['slot']}"
+            if acknowledge:
+                self.requests.delete_one({'_id': doc['_id'], 'state': 'queued'})
+                self.hosts.update_one({'_id': host_id}, {'$inc': {'in_flight': -1}})
+            else:
+                self.hosts.update_one({'_id': host_id}, {'$inc': {'in_flight': -1, 'pending': 1}})
+
+
+class MongoDupeFilter(RFPDupeFilter):
+    """Dupefilter for MongoScheduler, whose fingerprint set is shared by every worker of a crawl.
+
+    request_seen() only looks at the fingerprints this worker has seen, in memory, so
+    the reactor never waits for the database. MongoScheduler records new fingerprints
+    in MongoDB when it writes their requests to the frontier, and drops the requests
+    another worker had already seen.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(None, crawler.settings.getbool('DUPEFILTER_DEBUG'), fingerprinter=crawler.request_fingerprinter)
+
+
+class FrontierAckMiddleware:
+    """Downloader middleware that reports claimed requests dropped with IgnoreRequest.
+
+    A request dropped in process_request() never reaches a download slot, so neither
+    response_received nor request_left_downloader fires for it and MongoScheduler
+    would leave it leased until the lease runs out. Harmless with other schedulers:
+    only requests carrying a frontier lease are reported.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, IgnoreRequest) and 'frontier_id' in request.meta:
+            self.crawler.signals.send_catch_log(request_ignored, request=request, spider=spider)
+
+
+class MongoScheduler(BaseScheduler):
+    """Scheduler that keeps the request queue in MongoDB so several worker processes
+    (on one or many machines) can share a crawl. See MongoFrontier for the storage.
+
+    Run the same spider on every worker with the same FRONTIER_CRAWL_ID (default: the
+    spider name). Each worker claims requests whose host may be contacted now, so
+    CONCURRENT_REQUESTS_PER_DOMAIN, DOWNLOAD_DELAY and DOWNLOAD_SLOTS apply to the
+    whole crawl rather than per process. A worker finishes once no requests are
+    queued or leased by anyone. Pair it with MongoDupeFilter so no URL is fetched twice.
+
+    Database calls run on pool threads. New requests are written in one batch per
+    reactor turn. Up to FRONTIER_PREFETCH (default CONCURRENT_REQUESTS) requests are
+    claimed ahead of the engine and handed to it with engine.crawl(), which passes
+    them back through enqueue_request() into the local buffer that next_request()
+    serves from, and makes the engine ask for them even when it is otherwise idle.
+    """
+
+    def __init__(self, crawler, dupefilter, frontier, stats, poll_interval=0.5, prefetch=16):
+        self.crawler = crawler
+        self.df = dupefilter
+        self.frontier = frontier
+        self.stats = stats
+        self.poll_interval = poll_interval
+        self.prefetch = prefetch
+        self.settings = crawler.settings
+        self.local = deque()  # requests that can't be serialized stay in this process
+        self.ready = deque()  # requests claimed from the frontier, waiting for the engine
+        self._outbox = []  # requests waiting to be written to the frontier
+        self._handing_over = None
+        self._claiming = self._flushing = self._checking = self._closing = False
+        self._retry_at = 0
+        self._pending = True
+        self._pending_checked_at = None
+        self._pushed = 0  # batches written to the frontier, to spot stale pending checks
+        self._busy = set()  # Deferreds of database calls in flight
+        self._reaper = None
+        self._fill_call = None
+        self._flush_call = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        config = frontier_settings(crawler)
+        worker_id = settings.get('FRONTIER_WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+        frontier = MongoFrontier(
+            config['mongo_uri'], config['mongo_db'], config['prefix'], config['crawl_id'], worker_id,
+            lease_seconds=settings.getfloat('FRONTIER_LEASE_SECONDS', 300),
+            max_leases=settings.getint('FRONTIER_MAX_LEASES', 3),
+        )
+        dupefilter = build_from_crawler(load_object(settings['DUPEFILTER_CLASS']), crawler)
+        scheduler = cls(crawler, dupefilter, frontier, crawler.stats,
+                        poll_interval=settings.getfloat('FRONTIER_POLL_INTERVAL', 0.5),
+                        prefetch=int(settings.get('FRONTIER_PREFETCH') or settings.getint('CONCURRENT_REQUESTS', 16)))
+        crawler.signals.connect(scheduler.request_done, signal=signals.response_received)
+        crawler.signals.connect(scheduler.request_done, signal=signals.request_left_downloader)
+        crawler.signals.connect(scheduler.request_done, signal=request_ignored)
+        return scheduler
+
+    def open(self, spider):
+        self.spider = spider
+        # Each worker only scrapes part of the crawl, so none of them may prune what it
+        # didn't see itself (MongoPipeline's MONGO_PRUNE_UNSEEN).
+        spider.allow_prune = False
+
+        def connect():
+            self.frontier.open()
+            return self.settings.getbool('FRONTIER_RESET_FINISHED', True) and self.frontier.reset_if_finished()
+
+        def opened(reset):
+            if reset:
+                logging.info(f"Starting a new frontier crawl '{self.frontier.crawl_id}'.")
+            else:
+                logging.info(f"Joining frontier crawl '{self.frontier.crawl_id}' as worker {self.frontier.worker_id}.")
+            self._reaper = task.LoopingCall(self._requeue_expired)
+            self._reaper.start(max(1.0, self.frontier.lease_seconds / 4), now=False)
+            return self.df.open()
+        return threads.deferToThread(connect).addCallback(opened)
+
+    def close(self, reason):
+        self._closing = True
+        if self._reaper is not None and self._reaper.running:
+            self._reaper.stop()
+        for call in (self._fill_call, self._flush_call):
+            if call is not None and call.active():
+                call.cancel()
+
+        def finish(outbox):
+            if outbox:
+                # Other workers may still crawl them.
+                self.frontier.push(outbox)
+            # A clean finish means the engine is done with everything this worker leased;
+            # otherwise hand the leases back so other workers pick them up right away.
+            self.frontier.release_worker(acknowledge=reason == 'finished')
+            self.frontier.close()
+
+        def finish_in_thread(_):
+            outbox, self._outbox = self._outbox, []
+            return threads.deferToThread(finish, outbox)
+        d = defer.DeferredList(list(self._busy)).addCallback(finish_in_thread)
+        return d.addCallback(lambda _: self.df.close(reason))
+
+    def has_pending_requests(self):
+        if self.local or self.ready or self._outbox or self._flushing or self._claiming:
+            return True
+        # Answer from the last check and refresh it on a pool thread, at most once per
+        # poll interval: the engine asks on every idle pass and on its 5s heartbeat.
+        self._check_pending()
+        return self._pending
+
+    def _check_pending(self, force=False):
+        if self._checking or self._closing:
+            return
+        if not force and self._pending_checked_at is not None and time() - self._pending_checked_at < self.poll_interval:
+            return
+        self._checking = True
+        d = self._in_thread(self.frontier.has_requests)
+        d.addCallbacks(self._checked, self._check_failed, callbackArgs=(self._pushed,))
+
+    def _checked(self, pending, pushed):
+        self._checking = False
+        self._pending_checked_at = time()
+        # A batch written while the query ran may not be in its answer; _flushed() has
+        # already set the flag for it.
+        if pushed == self._pushed:
+            self._pending = pending
+
+    def _check_failed(self, failure):
+        self._checking = False
+        self._pending_checked_at = time()
+        logging.error(f"Could not check the frontier for pending requests: {failure.getErrorMessage()}")
+
+    def enqueue_request(self, request):
+        if request is self._handing_over:
+            self.ready.append(request)
+            return True
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        meta = {key: value for key, value in request.meta.items() if key not in FRONTIER_META_KEYS}
+        try:
+            payload = pickle.dumps(request.replace(meta=meta).to_dict(spider=self.spider), protocol=4)
+        except Exception as e:
+            # Same fallback as Scrapy's disk queues: keep the request in memory.
+            logging.warning(f"Could not serialize {request} for the shared frontier ({e}); keeping it in this worker.")
+            self.local.append(request)
+            self.stats.inc_value('frontier/enqueued/local')
+            self.stats.inc_value('scheduler/enqueued')
+            return True
+        slot = meta.get('download_slot') or urlparse_cached(request).hostname or ''
+        slot_settings = self.settings.getdict('DOWNLOAD_SLOTS').get(slot, {})
+        self._outbox.append({
+            'request': request, 'payload': payload, 'slot': slot, 'priority': request.priority,
+            'concurrency': slot_settings.get('concurrency', self.settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')),
+            'delay': slot_settings.get('delay', self.settings.getfloat('DOWNLOAD_DELAY')),
+            'fingerprint': None if request.dont_filter else self.df.request_fingerprint(request),
+        })
+        self._schedule_flush()
+        return True
+
+    def next_request(self):
+        if self.local:
+            self.stats.inc_value('scheduler/dequeued')
+            return self.local.popleft()
+        if not self.ready:
+            self._fill()
+            return None
+        request = self.ready.popleft()
+        self.stats.inc_value('scheduler/dequeued')
+        self._fill()
+        return request
+
+    def request_done(self, request, spider=None, **kwargs):
+        # Sent for every download (successful or not) and for responses served without
+        # one (e.g. from the HTTP cache); acknowledging twice is harmless.
+        frontier_id = request.meta.pop('frontier_id', None)
+        if frontier_id is None:
+            return
+        self.stats.inc_value('frontier/acknowledged')
+        d = self._in_thread(self.frontier.ack, frontier_id, request.meta.get('frontier_slot'))
+        d.addCallbacks(self._slot_freed, lambda failure: logging.error(f"Could not acknowledge {request}: {failure.getErrorMessage()}"))
+
+    def _slot_freed(self, _):
+        # The host has room again: claim the next request now rather than at the next poll.
+        self._retry_at = 0
+        self._fill()
+        if not (self.local or self.ready or self._outbox):
+            # Possibly the last request of the crawl: have the answer ready for the
+            # engine's next idle check.
+            self._check_pending(force=True)
+
+    def _in_thread(self, f, *args):
+        d = threads.deferToThread(f, *args)
+        self._busy.add(d)
+
+        def done(result):
+            self._busy.discard(d)
+            return result
+        return d.addBoth(done)
+
+    def _schedule_flush(self):
+        if self._flush_call is None and not self._flushing:
+            from twisted.internet import reactor
+            # Everything the spider yields in this reactor turn goes out in one batch.
+            self._flush_call = reactor.callLater(0, self._flush)
+
+    def _flush(self):
+        self._flush_call = None
+        if not self._outbox or self._flushing:
+            return
+        entries, self._outbox = self._outbox, []
+        self._flushing = True
+        d = self._in_thread(self.frontier.push, entries)
+        d.addCallbacks(self._flushed, self._flush_failed, callbackArgs=(entries,), errbackArgs=(entries,))
+
+    def _flushed(self, duplicates, entries):
+        self._flushing = False
+        for entry in duplicates:
+            # Another worker queued the same request first.
+            self.df.log(entry['request'], self.spider)
+        self._pushed += 1
+        queued = len(entries) - len(duplicates)
+        self.stats.inc_value('frontier/enqueued', queued)
+        self.stats.inc_value('scheduler/enqueued', queued)
+        if queued:
+            self._pending = True
+            self._retry_at = 0
+            self._fill()
+        if self._outbox:
+            self._schedule_flush()
+
+    def _flush_failed(self, failure, entries):
+        self._flushing = False
+        self.stats.inc_value('frontier/push_failed', len(entries))
+        logging.error(f"Could not write {len(entries)} requests to the frontier: {failure.getErrorMessage()}")
+        if self._outbox:
+            self._schedule_flush()
+
+    def _fill(self):
+        # Claim requests on a pool thread until `prefetch` of them wait for the engine.
+        wanted = self.prefetch - len(self.ready)
+        if self._closing or self._claiming or wanted <= 0 or time() < self._retry_at:
+            return
+        self._claiming = True
+        d = self._in_thread(self.frontier.claim_many, time(), wanted)
+        d.addCallbacks(self._claimed, self._claim_failed, callbackArgs=(wanted,))
+
+    def _claimed(self, result, wanted):
+        self._claiming = False
+        documents, wait = result
+        if self._closing:
+            return  # release_worker() hands the leases back
+        for doc in documents:
+            request = request_from_dict(pickle.loads(doc['request']), spider=self.spider)
+            request.meta['frontier_id'] = doc['_id']
+            request.meta['frontier_slot'] = doc['slot']
+            self.stats.inc_value('frontier/claimed')
+            # Scheduled a second time on this worker, so request_scheduled fires again.
+            self._handing_over = request
+            try:
+                self.crawler.engine.crawl(request)
+            finally:
+                self._handing_over = None
+        if len(documents) < wanted:
+            # Nothing more may start yet: try again once the next host is expected to be free.
+            self._schedule_fill(min(wait, self.poll_interval) if wait is not None else self.poll_interval)
+
+    def _claim_failed(self, failure):
+        self._claiming = False
+        logging.error(f"Could not claim requests from the frontier: {failure.getErrorMessage()}")
+        self._schedule_fill(self.poll_interval)
+
+    def _schedule_fill(self, delay):
+        # The engine only comes back every few seconds on its own, so keep a timer that
+        # claims (and hands over) the next requests as soon as a host may be contacted.
+        from twisted.internet import reactor
+
+        self._retry_at = time() + delay
+        if self._fill_call is not None and self._fill_call.active():
+            if self._fill_call.getTime() <= reactor.seconds() + delay:
+                return
+            self._fill_call.cancel()
+        self._fill_call = reactor.callLater(delay, self._retry_fill)
+
+    def _retry_fill(self):
+        self._fill_call = None
+        self._retry_at = 0
+        self._fill()
+
+    def _requeue_expired(self):
+        d = self._in_thread(self.frontier.requeue_expired, time())
+
+        def report(counts):
+            requeued, abandoned = counts
+            if requeued:
+                self.stats.inc_value('frontier/lease_expired', requeued)
+                logging.warning(f"Returned {requeued} requests with expired leases to the frontier.")
+            if abandoned:
+                self.stats.inc_value('frontier/abandoned', abandoned)
+                logging.error(f"Dropped {abandoned} requests leased {self.frontier.max_leases} times without completing.")
+        d.addCallbacks(report, lambda failure: logging.error(f"Frontier lease check failed: {failure.getErrorMessage()}"))
+        return d
+
+    def __len__(self):
+        # Requests this worker holds; counting the shared queue would block on the database.
+        return len(self.local) + len(self.ready) + len(self._outbox)
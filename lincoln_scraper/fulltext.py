@@ -0,0 +1,204 @@
+"""Page-level full-text index over the downloaded documents.
+
+TextExtractionPipeline (in pipelines.py) extracts the text of every stored PDF in a
+process pool with extract_pdf_text() and writes it to one of the indexes below, keyed
+by the document's SHA-256 so a file is only ever extracted once:
+
+- MongoTextIndex: one document per page in TEXT_INDEX_COLLECTION (default
+  'document_pages') with a Mongo text index, plus one status document per file in
+  '<collection>_files'.
+- SqliteTextIndex: a local inverted index (SQLite FTS5) in .scrapy/fulltext.sqlite3.
+
+Search it from the command line:
+
+    python -m lincoln_scraper.fulltext "road closure" [--limit 20]
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from time import process_time
+
+import pymongo
+from scrapy.utils.project import data_path, get_project_settings
+from lincoln_scraper.mongo import get_client, release_client
+
+# MongoClients opened by extraction workers (GridFS-backed document stores), one per URI.
+_worker_clients = {}
+
+
+def extract_pdf_text(source):
+    """Extract the text of every page of a PDF. Runs in a worker process.
+
+    source is a file path, or ('gridfs', mongo_uri, mongo_db, bucket, sha256) for
+    documents stored in GridFS. Returns {'pages': [str, ...], 'error': str or None,
+    'cpu_seconds': float}.
+    """
+    from pypdf import PdfReader
+
+    started = process_time()
+    try:
+        with _open_source(source) as f:
+            if f.read(5) != b'%PDF-':
+                return {'pages': [], 'error': 'not a PDF', 'cpu_seconds': process_time() - started}
+            f.seek(0)
+            reader = PdfReader(f)
+            pages = []
+            for page in reader.pages:
+                try:
+                    pages.append(page.extract_text() or '')
+                except Exception:
+                    # One broken page (bad font, odd encoding) shouldn't lose the whole document.
+                    pages.append('')
+    except Exception as e:
+        return {'pages': [], 'error': f"{type(e).__name__}: {e}", 'cpu_seconds': process_time() - started}
+    return {'pages': pages, 'error': None, 'cpu_seconds': process_time() - started}
+
+
+def _open_source(source):
+    if isinstance(source, str):
+        return open(source, 'rb')
+    _, mongo_uri, mongo_db, bucket_name, sha256 = source
+    import gridfs
+    if mongo_uri not in _worker_clients:
+        _worker_clients[mongo_uri] = pymongo.MongoClient(mongo_uri)
+    return gridfs.GridFSBucket(_worker_clients[mongo_uri][mongo_db], bucket_name=bucket_name).open_download_stream(sha256)
+
+
+class MongoTextIndex:
+    """Page text in Mongo: '<collection>' holds one document per page (text-indexed),
+    '<collection>_files' one document per extracted file.
+    """
+
+    def __init__(self, mongo_uri, mongo_db, collection_name='document_pages'):
+        self.mongo_uri = mongo_uri
+        self.mongo_db = mongo_db
+        self.collection_name = collection_name
+
+    def open(self):
+        self.client = get_client(self.mongo_uri)
+        db = self.client[self.mongo_db]
+        self.pages = db[self.collection_name]
+        self.files = db[f"{self.collection_name}_files"]
+        self.pages.create_index([('text', pymongo.TEXT)], name='page_text', default_language='english')
+        self.pages.create_index([('sha256', pymongo.ASCENDING), ('page', pymongo.ASCENDING)], name='sha256_page')
+
+    def close(self):
+        release_client(self.mongo_uri)
+
+    def known_hashes(self):
+        return {doc['_id'] for doc in self.files.find({}, {'_id': 1})}
+
+    def store(self, sha256, pages, error):
+        # Pages first: a file only counts as extracted once all of its pages are in.
+        self.pages.delete_many({'sha256': sha256})
+        if pages:
+            self.pages.insert_many([
+                {'_id': f"{sha256}:{number}", 'sha256': sha256, 'page': number, 'text': text}
+                for number, text in enumerate(pages, 1)
+            ])
+        self.files.replace_one({'_id': sha256}, {
+            '_id': sha256, 'page_count': len(pages), 'error': error,
+            'extracted_at': datetime.now(timezone.utc),
+        }, upsert=True)
+
+    def search(self, query, limit=20):
+        cursor = self.pages.find(
+            {'$text': {'$search': query}},
+            {'sha256': 1, 'page': 1, 'text': 1, 'score': {'$meta': 'textScore'}},
+        ).sort([('score', {'$meta': 'textScore'})]).limit(limit)
+        return [{'sha256': doc['sha256'], 'page': doc['page'], 'score': doc['score'], 'text': doc['text']} for doc in cursor]
+
+
+class SqliteTextIndex:
+    """Page text in a local SQLite FTS5 inverted index (no Mongo needed to search)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Writes come from reactor pool threads, one at a time under self.lock.
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (sha256 TEXT PRIMARY KEY, page_count INTEGER, error TEXT, extracted_at TEXT)')
+        self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(sha256 UNINDEXED, page UNINDEXED, text, tokenize='porter unicode61')")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def known_hashes(self):
+        with self.lock:
+            return {row[0] for row in self.db.execute('SELECT sha256 FROM files')}
+
+    def store(self, sha256, pages, error):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM pages WHERE sha256 = ?', (sha256,))
+            self.db.executemany('INSERT INTO pages (sha256, page, text) VALUES (?, ?, ?)',
+                                [(sha256, number, text) for number, text in enumerate(pages, 1)])
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                            (sha256, len(pages), error, datetime.now(timezone.utc).isoformat()))
+
+    def search(self, query, limit=20):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT sha256, page, bm25(pages), text FROM pages WHERE pages MATCH ? ORDER BY bm25(pages) LIMIT ?',
+                (query, limit),
+            ).fetchall()
+        # bm25() is lower for better matches; flip it so higher scores are better, as in Mongo.
+        return [{'sha256': sha256, 'page': page, 'score': -score, 'text': text} for sha256, page, score, text in rows]
+
+
+def text_index_from_settings(settings):
+    if settings.get('TEXT_INDEX_BACKEND', 'mongo') == 'sqlite':
+        return SqliteTextIndex(settings.get('TEXT_INDEX_PATH') or os.path.join(data_path('', createdir=True), 'fulltext.sqlite3'))
+    return MongoTextIndex(
+        settings.get('MONGO_URI'),
+        settings.get('MONGO_DB', 'scrapy_data'),
+        settings.get('TEXT_INDEX_COLLECTION', 'document_pages'),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Search the text of the downloaded documents.')
+    parser.add_argument('query')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    settings = get_project_settings()
+    index = text_index_from_settings(settings)
+    index.open()
+    try:
+        results = index.search(args.query, args.limit)
+        # Show which meetings the matching files belong to.
+        documents = {}
+        if results:
+            client = get_client(settings.get('MONGO_URI'))
+            collection = client[settings.get('MONGO_DB', 'scrapy_data')][settings.get('MONGO_COLLECTION', 'scraped_documents')]
+            try:
+                for doc in collection.find({'sha256': {'$in': list({result['sha256'] for result in results})}},
+                                           {'sha256': 1, 'date': 1, 'meeting_title': 1, 'URL': 1}):
+                    documents.setdefault(doc['sha256'], doc)
+            except pymongo.errors.PyMongoError as e:
+                # The local index works without Mongo; the results just lack the meeting details.
+                logging.warning(f"Could not look up the meetings of the results: {e}")
+            finally:
+                release_client(settings.get('MONGO_URI'))
+        for result in results:
+            doc = documents.get(result['sha256'], {})
+            snippet = ' '.join(result['text'].split())[:160]
+            print(f"{result['score']:7.2f}  {doc.get('date', '')}  {doc.get('meeting_title', result['sha256'][:12])}  p.{result['page']}")
+            print(f"         {doc.get('URL', '')}")
+            print(f"         {snippet}")
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    raise SystemExit(main())
@@ -0,0 +1,216 @@
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import zlib
+from time import time
+
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.extensions.httpcache import DummyPolicy
+from scrapy.utils.project import data_path
+from scrapy.utils.response import response_from_dict
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+# Bodies are only stored compressed if that saves at least this fraction of their size
+# (PDFs are mostly compressed already and not worth inflating on every cache hit).
+MIN_COMPRESSION_SAVING = 0.1
+# After an eviction the cache is brought down to this fraction of HTTPCACHE_MAX_BYTES,
+# so it doesn't evict again on the very next store.
+EVICTION_LOW_WATERMARK = 0.9
+
+
+class TTLCachePolicy(DummyPolicy):
+    """Cache policy with a time-to-live per URL pattern.
+
+    HTTPCACHE_TTL_RULES is a list of (regex, seconds) pairs; the first pattern that
+    matches the request URL (re.search) sets its TTL, otherwise HTTPCACHE_EXPIRATION_SECS
+    applies. A TTL of 0 never expires. Expired entries are fetched again, or revalidated
+    with a conditional request when HTTPCACHE_REVALIDATE is True (a 304 then serves
+    the cached response).
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.default_ttl = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.ttl_rules = [(re.compile(pattern), int(ttl)) for pattern, ttl in settings.getlist('HTTPCACHE_TTL_RULES')]
+        self.revalidate = settings.getbool('HTTPCACHE_REVALIDATE')
+
+    def ttl_for(self, url):
+        for pattern, ttl in self.ttl_rules:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        ttl = self.ttl_for(request.url)
+        if not ttl or time() - request.meta.get('cache_timestamp', 0) < ttl:
+            return True
+        if self.revalidate:
+            if b'ETag' in cachedresponse.headers:
+                request.headers['If-None-Match'] = cachedresponse.headers['ETag']
+            if b'Last-Modified' in cachedresponse.headers:
+                request.headers['If-Modified-Since'] = cachedresponse.headers['Last-Modified']
+        return False
+
+    def is_cached_response_valid(self, cachedresponse, response, request):
+        return response.status == 304
+
+
+class RevalidatingHttpCacheMiddleware(HttpCacheMiddleware):
+    """HttpCacheMiddleware that restarts an entry's time-to-live when a 304 revalidates it.
+
+    Scrapy serves the cached response on a 304 but, before 2.19, leaves the stored
+    entry as it was: it stays expired, so every later request for it is revalidated
+    again, and it ages towards LRU eviction however often it is used.
+    """
+
+    def process_response(self, request, response, spider=None):
+        cachedresponse = request.meta.get('cached_response')
+        result = super().process_response(request, response, spider)
+        refresh = getattr(self.storage, 'refresh_response', None)
+        if cachedresponse is not None and result is cachedresponse and response.status == 304 and refresh:
+            refresh(spider if spider is not None else self.crawler.spider, request)
+        return result
+
+
+class SqliteCacheStorage:
+    """HTTP cache storage in a single SQLite file (HTTPCACHE_DIR/httpcache.sqlite3).
+
+    Entries are looked up by request fingerprint through the primary key index,
+    bodies are zlib-compressed, and once the stored bodies and headers exceed
+    HTTPCACHE_MAX_BYTES (0 = unlimited) the least recently used entries are evicted.
+    All spiders share the file, and so the byte budget.
+    """
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.path = os.path.join(self.cachedir, 'httpcache.sqlite3')
+        self.max_bytes = settings.getint('HTTPCACHE_MAX_BYTES')
+        self.compression_level = settings.getint('HTTPCACHE_COMPRESSION_LEVEL', 6)
+        self.db = None
+
+    def open_spider(self, spider):
+        self.db = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        # Must be set before the table exists so freed pages can be given back at close.
+        self.db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                response_url TEXT NOT NULL,
+                headers BLOB NOT NULL,
+                body BLOB NOT NULL,
+                compressed INTEGER NOT NULL,
+                extra BLOB NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)')
+        # Running total of the entry sizes, kept by triggers so checking the byte budget
+        # doesn't scan the table (and stays right when several spiders share the file).
+        self.db.execute('CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)')
+        self.db.execute('INSERT OR IGNORE INTO cache_size VALUES (0, 0)')
+        self.db.execute('''
+            CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries
+            BEGIN UPDATE cache_size SET bytes = bytes + NEW.size; END
+        ''')
+        self.db.execute('''
+            CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries
+            BEGIN UPDATE cache_size SET bytes = bytes + NEW.size - OLD.size; END
+        ''')
+        self.db.execute('''
+            CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries
+            BEGIN UPDATE cache_size SET bytes = bytes - OLD.size; END
+        ''')
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        self.stats = spider.crawler.stats
+        logging.debug(f"Using SQLite cache storage in {self.path}")
+
+    def close_spider(self, spider):
+        self.db.execute('PRAGMA incremental_vacuum')
+        # Fold the write-ahead log back into the file so the cache is a single file again.
+        self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.db.close()
+        self.db = None
+
+    def _key(self, spider, request):
+        return f"{spider.name}:{self._fingerprinter.fingerprint(request).hex()}"
+
+    def retrieve_response(self, spider, request):
+        key = self._key(spider, request)
+        row = self.db.execute(
+            'SELECT status, response_url, headers, body, compressed, extra, stored_at FROM entries WHERE key = ?',
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None  # not cached
+        status, response_url, headers, body, compressed, extra, stored_at = row
+        self.db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (time(), key))
+        data = {
+            'url': response_url,
+            'status': status,
+            'headers': headers_raw_to_dict(headers),
+            'body': zlib.decompress(body) if compressed else body,
+        }
+        data.update(pickle.loads(extra))
+        request.meta['cache_timestamp'] = stored_at
+        return response_from_dict(data)
+
+    def refresh_response(self, spider, request):
+        # A 304 confirmed the stored response: it is fresh (and recently used) again.
+        now = time()
+        self.db.execute('UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?',
+                        (now, now, self._key(spider, request)))
+        request.meta['cache_timestamp'] = now
+
+    def store_response(self, spider, request, response):
+        headers = headers_dict_to_raw(response.headers)
+        body = response.body
+        compressed = zlib.compress(body, self.compression_level)
+        use_compressed = len(compressed) <= len(body) * (1 - MIN_COMPRESSION_SAVING)
+        if use_compressed:
+            body = compressed
+        extra = pickle.dumps({
+            key: value
+            for key, value in response.to_dict().items()
+            if key not in {'url', 'status', 'headers', 'body'}
+        }, protocol=4)
+        now = time()
+        self.db.execute(
+            '''INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (key) DO UPDATE SET
+                   url = excluded.url, status = excluded.status, response_url = excluded.response_url,
+                   headers = excluded.headers, body = excluded.body, compressed = excluded.compressed,
+                   extra = excluded.extra, stored_at = excluded.stored_at,
+                   accessed_at = excluded.accessed_at, size = excluded.size''',
+            (self._key(spider, request), request.url, response.status, response.url, headers, body,
+             int(use_compressed), extra, now, now, len(headers) + len(body) + len(extra)),
+        )
+        if self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        total = self.db.execute('SELECT bytes FROM cache_size').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - self.max_bytes * EVICTION_LOW_WATERMARK
+        evicted = freed = 0
+        while freed < target:
+            oldest = self.db.execute('SELECT key, size FROM entries ORDER BY accessed_at LIMIT 100').fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if freed >= target:
+                    break
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                evicted += 1
+                freed += size
+        self.stats.inc_value('httpcache/evicted', evicted)
+        self.stats.inc_value('httpcache/evicted_bytes', freed)
+        logging.info(f"HTTP cache over {self.max_bytes} bytes. Evicted {evicted} least recently used entries ({freed} bytes).")
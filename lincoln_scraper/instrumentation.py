@@ -0,0 +1,227 @@
+import bisect
+import json
+import logging
+import os
+from time import monotonic
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.project import data_path
+
+# Custom signals, sent by the spider middleware and MongoPipeline. Nothing listens
+# to them unless INSTRUMENTATION_ENABLED is set, so they cost almost nothing otherwise.
+callback_timed = object()  # spider, callback, cpu_seconds, wall_seconds
+mongo_write_timed = object()  # seconds, operations
+
+# Histogram bucket upper bounds in seconds (the last bucket is +Inf).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_PREFIX = 'lincoln_scraper'
+
+# Crawlers whose metrics the shared HTTP endpoint serves (one endpoint per process).
+_exporters = []
+_endpoint = None
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, in the shape Prometheus expects."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation; None without observations.
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound if bound != float('inf') else self.max
+        return self.max
+
+    def to_dict(self):
+        data = {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'max': round(self.max, 6),
+            'buckets': {str(bound): count for bound, count in zip(self.buckets + ('+Inf',), self.counts)},
+        }
+        # An empty histogram has no mean or quantiles; leave them out rather than report 0 or a bucket bound.
+        if self.count:
+            data.update(mean=round(self.sum / self.count, 6), p50=self.quantile(0.5), p95=self.quantile(0.95))
+        return data
+
+    def prometheus_lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class InstrumentationExtension:
+    """Collects hot-path timings and writes them out when the spider closes.
+
+    - CPU and wall time of every spider callback (measured by LincolnScraperSpiderMiddleware)
+    - per host: time a request waits in its download slot (concurrency limits, download
+      delay and AutoThrottle), time to first byte and total download time
+    - the current delay of each download slot, i.e. what AutoThrottle settled on
+    - MongoPipeline write latency per batch
+    - every numeric crawler stat, which includes the retry counters
+
+    Results go to INSTRUMENTATION_DIR (default .scrapy/instrumentation) as <spider>.json
+    and <spider>.prom (Prometheus text-file format). With INSTRUMENTATION_HTTP_PORT they
+    are also served at http://127.0.0.1:<port>/metrics (and /metrics.json) during the crawl.
+    """
+
+    def __init__(self, crawler, output_dir, http_port=None):
+        self.crawler = crawler
+        self.output_dir = output_dir
+        self.http_port = http_port
+        self.callbacks = {}  # callback name -> {'cpu': Histogram, 'wall': Histogram}
+        self.hosts = {}  # host -> {'queue': ..., 'ttfb': ..., 'total': ...}
+        self.slot_delays = {}  # download slot -> last seen delay
+        self.mongo_writes = Histogram()
+        self.mongo_operations = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('INSTRUMENTATION_ENABLED'):
+            raise NotConfigured
+        ext = cls(
+            crawler,
+            output_dir=settings.get('INSTRUMENTATION_DIR') or data_path('instrumentation', createdir=True),
+            http_port=settings.getint('INSTRUMENTATION_HTTP_PORT') or None,
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(ext.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(ext.request_left_downloader, signal=signals.request_left_downloader)
+        crawler.signals.connect(ext.callback_timed, signal=callback_timed)
+        crawler.signals.connect(ext.mongo_write_timed, signal=mongo_write_timed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.spider_name = spider.name
+        _exporters.append(self)
+        if self.http_port:
+            start_endpoint(self.http_port)
+
+    def spider_closed(self, spider):
+        os.makedirs(self.output_dir, exist_ok=True)
+        json_path = os.path.join(self.output_dir, f"{spider.name}.json")
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        with open(os.path.join(self.output_dir, f"{spider.name}.prom"), 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        logging.info(f"Instrumentation written to {json_path} (and .prom).")
+        _exporters.remove(self)
+
+    def _host_histograms(self, request):
+        host = urlparse_cached(request).hostname or ''
+        if host not in self.hosts:
+            self.hosts[host] = {'queue': Histogram(), 'ttfb': Histogram(), 'total': Histogram()}
+        return self.hosts[host]
+
+    def request_reached_downloader(self, request, spider):
+        request.meta['instrumentation_reached'] = monotonic()
+
+    def headers_received(self, headers, body_length, request, spider):
+        request.meta['instrumentation_headers'] = monotonic()
+
+    def request_left_downloader(self, request, spider):
+        reached = request.meta.get('instrumentation_reached')
+        if reached is None:
+            return
+        now = monotonic()
+        histograms = self._host_histograms(request)
+        histograms['total'].observe(now - reached)
+        latency = request.meta.get('download_latency')
+        headers_at = request.meta.get('instrumentation_headers')
+        if latency is not None and headers_at is not None and headers_at >= reached:
+            # download_latency runs from sending the request to the response headers,
+            # so whatever came before that was spent waiting in the download slot.
+            histograms['ttfb'].observe(latency)
+            histograms['queue'].observe(max(0.0, headers_at - latency - reached))
+        slot_key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(slot_key) if slot_key else None
+        if slot is not None:
+            self.slot_delays[slot_key] = slot.delay
+
+    def callback_timed(self, spider, callback, cpu_seconds, wall_seconds):
+        if callback not in self.callbacks:
+            self.callbacks[callback] = {'cpu': Histogram(), 'wall': Histogram()}
+        self.callbacks[callback]['cpu'].observe(cpu_seconds)
+        self.callbacks[callback]['wall'].observe(wall_seconds)
+
+    def mongo_write_timed(self, seconds, operations):
+        self.mongo_writes.observe(seconds)
+        self.mongo_operations += operations
+
+    def to_dict(self):
+        return {
+            'spider': self.spider_name,
+            'callbacks': {name: {kind: h.to_dict() for kind, h in hs.items()} for name, hs in self.callbacks.items()},
+            'download': {host: {kind: h.to_dict() for kind, h in hs.items()} for host, hs in self.hosts.items()},
+            'slot_delays': self.slot_delays,
+            'mongo_writes': dict(self.mongo_writes.to_dict(), operations=self.mongo_operations),
+            'stats': {key: value for key, value in self.crawler.stats.get_stats().items()},
+        }
+
+    def prometheus_text(self):
+        spider = f'spider="{self.spider_name}"'
+        lines = []
+        for name, histograms in self.callbacks.items():
+            for kind, histogram in histograms.items():
+                lines.extend(histogram.prometheus_lines(f'{METRIC_PREFIX}_callback_{kind}_seconds', f'{spider},callback="{name}"'))
+        for host, histograms in self.hosts.items():
+            for kind, histogram in histograms.items():
+                lines.extend(histogram.prometheus_lines(f'{METRIC_PREFIX}_download_{kind}_seconds', f'{spider},host="{host}"'))
+        for slot_key, delay in self.slot_delays.items():
+            lines.append(f'{METRIC_PREFIX}_download_slot_delay_seconds{{{spider},slot="{slot_key}"}} {delay}')
+        lines.extend(self.mongo_writes.prometheus_lines(f'{METRIC_PREFIX}_mongo_write_seconds', spider))
+        for key, value in self.crawler.stats.get_stats().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'{METRIC_PREFIX}_stat{{{spider},name="{key}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def start_endpoint(port):
+    """Serve the metrics of every running crawler on 127.0.0.1:port (once per process)."""
+    global _endpoint
+    if _endpoint is not None:
+        return
+    from twisted.internet import reactor
+    from twisted.internet.error import CannotListenError
+    from twisted.web.resource import Resource
+    from twisted.web.server import Site
+
+    class MetricsResource(Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            if request.path == b'/metrics.json':
+                request.setHeader(b'Content-Type', b'application/json')
+                return json.dumps([exporter.to_dict() for exporter in _exporters], default=str).encode()
+            request.setHeader(b'Content-Type', b'text/plain; version=0.0.4')
+            return ''.join(exporter.prometheus_text() for exporter in _exporters).encode()
+
+    try:
+        _endpoint = reactor.listenTCP(port, Site(MetricsResource()), interface='127.0.0.1')
+        logging.info(f"Serving instrumentation at http://127.0.0.1:{port}/metrics")
+    except CannotListenError as e:
+        logging.warning(f"Could not serve instrumentation on port {port}: {e}")
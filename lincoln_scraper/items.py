@@ -4,4 +4,21 @@ class MeetingDocumentItem(scrapy.Item):
     date = scrapy.Field()
     meeting_title = scrapy.Field()
     category = scrapy.Field()
-    URL = scrapy.Field()
\ No newline at end of file
+    URL = scrapy.Field()
+    # Name of the spider (site) the document came from; documents are pruned per source.
+    source = scrapy.Field()
+    # CivicClerk tenant id (e.g. 'lincolncowi') for documents from CivicClerk portals.
+    tenant = scrapy.Field()
+    # Where the document file itself can be downloaded, if that differs from URL
+    # (CivicClerk portal links point to a viewer page, not the file).
+    download_url = scrapy.Field()
+    # Set by DocumentDownloadPipeline: content hash, location in the document store and size in bytes.
+    sha256 = scrapy.Field()
+    file_path = scrapy.Field()
+    file_size = scrapy.Field()
+    # Stable identity of the document across URLs and sources (see lincoln_scraper.canonical),
+    # e.g. 'hyland:12345' or 'civicclerk:lincolncowi:678'; the MongoDB upsert key.
+    document_key = scrapy.Field()
+    # Set by MongoPipeline when the change feed is enabled: hash of the content fields
+    # (see lincoln_scraper.changefeed.CONTENT_FIELDS), compared with the stored one to detect changes.
+    content_fingerprint = scrapy.Field()
@@ -0,0 +1,188 @@
+"""Low-overhead logging for large crawls: JSON output and sampling of repeated messages.
+
+Both are switched on by settings and installed on Scrapy's root log handler by
+StructuredLoggingExtension:
+
+- LOG_JSON writes one JSON object per line (time, level, logger, spider, event,
+  message) instead of Scrapy's text format.
+- LOG_SAMPLING_ENABLED lets the first LOG_SAMPLE_FIRST records of each kind of
+  INFO/DEBUG message through, then only one in every LOG_SAMPLE_EVERY. Warnings and
+  errors always pass in full. How often each sampled message occurred goes to the
+  crawl stats (log/repeated/<event>, log/suppressed) when the spider closes, along
+  with the records logged without a spider (module-level logging.* calls).
+
+A message's kind is its 'event' extra when the caller gives one
+(``self.logger.debug("Yielding item: %s", url, extra={'event': 'cab.item'})``),
+otherwise its logger and unformatted template, so per-item messages must pass their
+values as arguments rather than format them into the message. Records are dropped before they are
+formatted, so a suppressed message with lazy %-style arguments costs a dict lookup.
+"""
+import json
+import logging
+import re
+from datetime import datetime, timezone
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.log import LogCounterHandler
+
+# %-style and {}-style placeholders, removed when a template is turned into an event name.
+PLACEHOLDER_RE = re.compile(r'%(\(\w+\))?[-#0 +]*\d*(\.\d+)?[sdifrx%]|\{[^}]*\}')
+EVENT_NAME_LENGTH = 48
+# At most this many distinct events are counted (and templates cached) per process.
+# Messages formatted eagerly (f-strings) make a new template per record; past the cap
+# they share one '<logger>:untracked' event per logger, so memory stays bounded.
+MAX_EVENTS = 1000
+
+# One filter and formatter per process, shared by every crawler that enables them.
+_sampling_filter = None
+_json_formatter = None
+
+
+def template_event(logger_name, template):
+    # 'Scraped from %(src)s\n%(item)s' -> 'scrapy.core.scraper:scraped_from'
+    words = re.sub(r'[^a-z0-9]+', '_', PLACEHOLDER_RE.sub('', str(template)).lower()).strip('_')
+    return f"{logger_name}:{words[:EVENT_NAME_LENGTH].rstrip('_')}"
+
+
+class SamplingFilter(logging.Filter):
+    """Passes the first `first` records of each event, then one in every `every`."""
+
+    def __init__(self, first=20, every=500, max_events=MAX_EVENTS):
+        super().__init__()
+        self.first = first
+        self.every = every
+        self.max_events = max_events
+        self.counts = {}  # (spider, event) -> records seen
+        self.suppressed = {}  # spider -> records dropped
+        self._events = {}  # (logger name, template) -> event name
+
+    def event_name(self, record):
+        event = getattr(record, 'event', None)
+        if event:
+            return event
+        key = (record.name, record.msg)
+        try:
+            return self._events[key]
+        except KeyError:
+            event = template_event(record.name, record.msg)
+            if len(self._events) < self.max_events:
+                self._events[key] = event
+            return event
+        except TypeError:  # An unhashable object logged as the message
+            return template_event(record.name, record.msg)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        spider = getattr(record, 'spider', None)
+        key = (spider, self.event_name(record))
+        if key not in self.counts and len(self.counts) >= self.max_events:
+            key = (spider, f"{record.name}:untracked")
+        count = self.counts[key] = self.counts.get(key, 0) + 1
+        if count <= self.first:
+            return True
+        if self.every and (count - self.first) % self.every == 0:
+            record.occurrence = count  # Lets the reader see this line stands for many
+            return True
+        self.suppressed[spider] = self.suppressed.get(spider, 0) + 1
+        return False
+
+    def pop_spider(self, spider):
+        # Counts of the events that were sampled, plus the number of dropped records.
+        repeated = {}
+        for key in [key for key in self.counts if key[0] is spider]:
+            count = self.counts.pop(key)
+            if count > self.first:
+                repeated[key[1]] = count
+        return repeated, self.suppressed.pop(spider, 0)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; the message is only formatted if the record is emitted."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        spider = getattr(record, 'spider', None)
+        if spider is not None:
+            entry['spider'] = getattr(spider, 'name', str(spider))
+        if getattr(record, 'event', None):
+            entry['event'] = record.event
+        if getattr(record, 'occurrence', None):
+            entry['occurrence'] = record.occurrence
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def install(json_format=False, sampling=False, first=20, every=500):
+    """Attach the JSON formatter and/or the sampling filter to the root log handlers."""
+    global _sampling_filter, _json_formatter
+    if sampling and _sampling_filter is None:
+        _sampling_filter = SamplingFilter(first, every)
+    if json_format and _json_formatter is None:
+        _json_formatter = JsonFormatter()
+    for handler in logging.root.handlers:
+        # The handler behind the log_count/* stats must keep seeing every record.
+        if isinstance(handler, LogCounterHandler):
+            continue
+        if json_format and handler.formatter is not _json_formatter:
+            handler.setFormatter(_json_formatter)
+        if sampling and _sampling_filter not in handler.filters:
+            handler.addFilter(_sampling_filter)
+    return _sampling_filter
+
+
+class StructuredLoggingExtension:
+    """Installs JSON logging and/or sampling for the crawl and reports what was sampled."""
+
+    def __init__(self, crawler, json_format, sampling, first=20, every=500):
+        self.crawler = crawler
+        self.json_format = json_format
+        self.sampling = sampling
+        self.first = first
+        self.every = every
+        self.sampling_filter = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        json_format = settings.getbool('LOG_JSON')
+        sampling = settings.getbool('LOG_SAMPLING_ENABLED')
+        if not (json_format or sampling):
+            raise NotConfigured
+        ext = cls(crawler, json_format, sampling,
+                  first=settings.getint('LOG_SAMPLE_FIRST', 20),
+                  every=settings.getint('LOG_SAMPLE_EVERY', 500))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        if sampling:
+            crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        # Every crawler replaces Scrapy's root handler after its extensions are built,
+        # so the handler is only final once the spider opens.
+        self.sampling_filter = install(self.json_format, self.sampling, self.first, self.every)
+
+    def spider_closed(self, spider):
+        repeated, suppressed = self.sampling_filter.pop_spider(spider)
+        # Module-level logging.* calls carry no spider; count them with this crawl. When
+        # several crawlers share the process, the first one to close reports them.
+        unowned, unowned_suppressed = self.sampling_filter.pop_spider(None)
+        for event, count in unowned.items():
+            repeated[event] = repeated.get(event, 0) + count
+        suppressed += unowned_suppressed
+        stats = self.crawler.stats
+        for event, count in repeated.items():
+            stats.set_value(f'log/repeated/{event}', count)
+        if suppressed:
+            stats.set_value('log/suppressed', suppressed)
+            logging.info(f"Log sampling suppressed {suppressed} records of {len(repeated)} repeated messages "
+                         f"(counts in the log/repeated/* stats).")
@@ -1,9 +1,30 @@
-from scrapy import signals
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from itemadapter import ItemAdapter, is_item
+from scrapy import Request, signals
+from scrapy.downloadermiddlewares.retry import RetryMiddleware, get_retry_request
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest, NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.response import response_status_message
+from lincoln_scraper.canonical import DocumentKeyIndex, document_key
+from lincoln_scraper.instrumentation import callback_timed
 
 class LincolnScraperSpiderMiddleware:
+    # With INSTRUMENTATION_ENABLED, times every spider callback (CPU and wall time) and
+    # reports it to the InstrumentationExtension. SPIDER_MIDDLEWARES puts it right next
+    # to the spider, so only the callback's own code runs while the clock is running.
+
+    def __init__(self, crawler=None):
+        self.crawler = crawler
+        self.timed = bool(crawler and crawler.settings.getbool('INSTRUMENTATION_ENABLED'))
+
     @classmethod
     def from_crawler(cls, crawler):
-        s = cls()
+        s = cls(crawler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
@@ -11,8 +32,53 @@ class LincolnScraperSpiderMiddleware:
         return None
 
     def process_spider_output(self, response, result, spider):
-        for i in result:
-            yield i
+        if not self.timed:
+            yield from result
+            return
+        cpu = wall = 0.0
+        iterator = iter(result)
+        try:
+            while True:
+                cpu_start, wall_start = time.thread_time(), time.perf_counter()
+                try:
+                    i = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    cpu += time.thread_time() - cpu_start
+                    wall += time.perf_counter() - wall_start
+                yield i
+        finally:
+            self._report(response, spider, cpu, wall)
+
+    async def process_spider_output_async(self, response, result, spider):
+        # Used instead of the method above when a callback or start() is asynchronous.
+        if not self.timed:
+            async for i in result:
+                yield i
+            return
+        cpu = wall = 0.0
+        iterator = result.__aiter__()
+        try:
+            while True:
+                cpu_start, wall_start = time.thread_time(), time.perf_counter()
+                try:
+                    i = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    cpu += time.thread_time() - cpu_start
+                    wall += time.perf_counter() - wall_start
+                yield i
+        finally:
+            self._report(response, spider, cpu, wall)
+
+    def _report(self, response, spider, cpu, wall):
+        callback = response.request.callback if response.request is not None else None
+        self.crawler.signals.send_catch_log(
+            signal=callback_timed, spider=spider,
+            callback=getattr(callback, '__name__', 'parse'), cpu_seconds=cpu, wall_seconds=wall,
+        )
 
     def process_spider_exception(self, response, exception, spider):
         pass
@@ -24,21 +90,241 @@ class LincolnScraperSpiderMiddleware:
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
 
-class LincolnScraperDownloaderMiddleware:
+class DocumentDedupMiddleware:
+    """Drops requests and items for documents this crawl already covered, by document key.
+
+    Requests carrying meta['document_key'] are dropped when that document was already
+    requested or emitted, so one document linked from several listing pages or API
+    pages (or through different URLs) is fetched once. A follow-up request for the
+    document the response itself was about (e.g. the CAB spider's GET after a rejected
+    HEAD) is let through. Items get a 'document_key' (from
+    their URL unless the spider set one) and only the first item per key goes on to
+    the pipelines. Other requests (listing pages, API pages) pass untouched.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.index = DocumentKeyIndex()
+
     @classmethod
     def from_crawler(cls, crawler):
-        s = cls()
-        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
-        return s
+        if not crawler.settings.getbool('DOCUMENT_DEDUP_ENABLED', True):
+            raise NotConfigured
+        return cls(crawler.stats)
+
+    def process_spider_output(self, response, result, spider):
+        for output in result:
+            if self._keep(output, response):
+                yield output
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for output in result:
+            if self._keep(output, response):
+                yield output
+
+    def _keep(self, output, response=None):
+        if isinstance(output, Request):
+            key = output.meta.get('document_key')
+            if key is None or self.index.request(key):
+                return True
+            if response is not None and response.meta.get('document_key') == key:
+                return True
+            self.stats.inc_value('dedup/duplicate_requests')
+            logging.debug("Dropping request for already covered document %s: %s", key, output.url,
+                          extra={'event': 'dedup.duplicate_request'})
+            return False
+        if not is_item(output):
+            return True
+        adapter = ItemAdapter(output)
+        if 'document_key' not in adapter.field_names() or not adapter.get('URL'):
+            return True
+        if not adapter.get('document_key'):
+            adapter['document_key'] = document_key(adapter['URL'])
+        if self.index.emit(adapter['document_key']):
+            self.stats.inc_value('dedup/unique_documents')
+            return True
+        self.stats.inc_value('dedup/duplicate_items')
+        logging.debug("Dropping duplicate item for document %s: %s", adapter['document_key'], adapter['URL'],
+                      extra={'event': 'dedup.duplicate_item'})
+        return False
+
+class RetryPolicyMiddleware(RetryMiddleware):
+    """Scrapy's RetryMiddleware with per-status and per-host policies.
+
+    - Permanent errors (RETRY_PERMANENT_HTTP_CODES, e.g. 404/410) are never
+      retried, even if listed in RETRY_HTTP_CODES.
+    - Retries wait an exponential backoff with jitter, or the server's
+      Retry-After on 429/503.
+    - A burst of failures from one host opens a circuit breaker: requests to
+      that host are held back for a cooldown instead of piling up more errors.
+
+    A request that has to wait leaves the downloader (its attempt ends with
+    IgnoreRequest, which skips the errback) and a copy is scheduled again once the
+    wait is over, so waiting requests hold no download slot and don't count
+    toward CONCURRENT_REQUESTS. The spider is kept open while requests are held.
+
+    RETRY_STATUS_POLICIES and RETRY_HOST_POLICIES override max_retries,
+    backoff_base, backoff_max, breaker_threshold and breaker_cooldown; a
+    status policy takes precedence over a host policy.
+    """
+
+    def __init__(self, settings, stats=None):
+        super().__init__(settings)
+        self.stats = stats
+        self.permanent_http_codes = {int(code) for code in settings.getlist('RETRY_PERMANENT_HTTP_CODES')}
+        self.retry_http_codes -= self.permanent_http_codes
+        self.default_policy = {
+            'max_retries': self.max_retry_times,
+            'backoff_base': settings.getfloat('RETRY_BACKOFF_BASE', 1.0),
+            'backoff_max': settings.getfloat('RETRY_BACKOFF_MAX', 60.0),
+            'breaker_threshold': settings.getint('RETRY_BREAKER_THRESHOLD', 5),
+            'breaker_cooldown': settings.getfloat('RETRY_BREAKER_COOLDOWN', 60.0),
+        }
+        self.status_policies = {int(status): policy for status, policy in settings.getdict('RETRY_STATUS_POLICIES').items()}
+        self.host_policies = settings.getdict('RETRY_HOST_POLICIES')
+        self.retry_after_max = settings.getfloat('RETRY_AFTER_MAX', 300.0)
+        self.breakers = {}
+        self.held = set()  # DelayedCalls that schedule held-back requests again
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        mw = cls(crawler.settings, crawler.stats)
+        mw.crawler = crawler
+        crawler.signals.connect(mw.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    def spider_idle(self, spider):
+        if self.held:
+            raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        for call in self.held:
+            if call.active():
+                call.cancel()
+        self.held.clear()
+
+    def _policy(self, host, status=None):
+        policy = dict(self.default_policy)
+        policy.update(self.host_policies.get(host, {}))
+        policy.update(self.status_policies.get(status, {}))
+        return policy
 
     def process_request(self, request, spider):
-        return None
+        # A request still in its retry backoff, or for a host whose breaker is open, is
+        # taken out of the downloader and scheduled again once it may be sent.
+        host = urlparse_cached(request).hostname
+        breaker = self.breakers.get(host)
+        not_before = max(request.meta.get('retry_not_before', 0), breaker.open_until if breaker else 0)
+        delay = not_before - time.time()
+        if delay <= 0:
+            return None
+        from twisted.internet import reactor  # Not at module level: that would install the default reactor
+        self.stats.inc_value('retry_policy/wait_seconds', delay)
+        self.stats.inc_value(f'retry_policy/wait_seconds/{host}', delay)
+        self.stats.inc_value('retry_policy/held')
+        # The dupefilter has seen the request already; the copy must get through it.
+        held = request.replace(dont_filter=True)
+
+        def release():
+            self.held.discard(call)
+            self.crawler.engine.crawl(held)
+        call = reactor.callLater(delay, release)
+        self.held.add(call)
+        # This attempt ends here; the copy carries the callback and errback on.
+        request.errback = None
+        raise IgnoreRequest(f"Held back for {delay:.1f}s by the retry policy")
 
     def process_response(self, request, response, spider):
-        return response
+        host = urlparse_cached(request).hostname
+        if request.meta.get('dont_retry', False):
+            return response
+        if response.status in self.permanent_http_codes:
+            self.stats.inc_value(f'retry_policy/permanent/{response.status}')
+            self._record_success(host)
+            return response
+        if response.status not in self.retry_http_codes:
+            self._record_success(host)
+            return response
+        policy = self._policy(host, response.status)
+        self._record_failure(host, policy)
+        retry_after = None
+        if response.status in (429, 503):
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        return self._retry_with_policy(request, response_status_message(response.status), policy, retry_after) or response
 
     def process_exception(self, request, exception, spider):
-        pass
+        if not isinstance(exception, self.exceptions_to_retry) or request.meta.get('dont_retry', False):
+            return None
+        host = urlparse_cached(request).hostname
+        policy = self._policy(host)
+        self._record_failure(host, policy)
+        return self._retry_with_policy(request, exception, policy)
 
-    def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
+    def _retry_with_policy(self, request, reason, policy, retry_after=None):
+        retry_request = get_retry_request(
+            request,
+            spider=self.crawler.spider,
+            reason=reason,
+            max_retry_times=request.meta.get('max_retry_times', policy['max_retries']),
+            priority_adjust=request.meta.get('priority_adjust', self.priority_adjust),
+        )
+        host = urlparse_cached(request).hostname
+        if retry_request is None:
+            self.stats.inc_value('retry_policy/gave_up')
+            return None
+        attempt = retry_request.meta['retry_times']
+        if retry_after is not None:
+            delay = min(retry_after, self.retry_after_max)
+            self.stats.inc_value('retry_policy/retry_after_honored')
+        else:
+            # Exponential backoff with "equal jitter": half of the step is fixed, half random,
+            # so concurrent retries of the same host spread out.
+            step = min(policy['backoff_max'], policy['backoff_base'] * 2 ** (attempt - 1))
+            delay = step / 2 + random.uniform(0, step / 2)
+        retry_request.meta['retry_not_before'] = time.time() + delay
+        self.stats.inc_value(f'retry_policy/retries/{host}')
+        return retry_request
+
+    def _record_success(self, host):
+        breaker = self.breakers.get(host)
+        if breaker:
+            breaker.failures = 0
+            breaker.probing = False
+
+    def _record_failure(self, host, policy):
+        breaker = self.breakers.setdefault(host, HostBreaker())
+        breaker.failures += 1
+        # After a cooldown the breaker lets requests through again; if the first result is
+        # another failure, it reopens right away instead of counting up to the threshold.
+        if breaker.probing or breaker.failures >= policy['breaker_threshold']:
+            breaker.open_until = time.time() + policy['breaker_cooldown']
+            breaker.failures = 0
+            breaker.probing = True
+            self.stats.inc_value(f'retry_policy/breaker_opened/{host}')
+            logging.warning(f"Too many failures from {host}. Holding its requests for {policy['breaker_cooldown']}s.")
+
+
+class HostBreaker:
+    """Circuit breaker state for one host."""
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds requested by a Retry-After header, or None."""
+    if not value:
+        return None
+    value = value.decode('latin-1').strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,100 @@
+import logging
+import threading
+
+import pymongo
+
+# One pooled MongoClient per URI for the whole process. Every crawler run by
+# lincoln_scraper.run (and every component inside it) shares the same client,
+# so the connection handshake and pool are paid for once.
+_clients = {}
+_client_refs = {}
+_lock = threading.Lock()
+
+
+def get_client(mongo_uri):
+    """Return the shared client for mongo_uri, creating it on first use.
+
+    Every call must be paired with release_client(); the client is closed
+    when its last user releases it.
+    """
+    with _lock:
+        if mongo_uri not in _clients:
+            _clients[mongo_uri] = pymongo.MongoClient(mongo_uri)
+            _client_refs[mongo_uri] = 0
+        _client_refs[mongo_uri] += 1
+        return _clients[mongo_uri]
+
+
+def register_client(mongo_uri, client):
+    """Use client as the shared client for mongo_uri, e.g. an in-memory stand-in in the benchmarks.
+
+    The registration holds a reference of its own, so the client is never closed.
+    """
+    with _lock:
+        _clients[mongo_uri] = client
+        _client_refs[mongo_uri] = 1
+
+
+def release_client(mongo_uri):
+    with _lock:
+        if mongo_uri not in _clients:
+            return
+        _client_refs[mongo_uri] -= 1
+        if _client_refs[mongo_uri] == 0:
+            _clients.pop(mongo_uri).close()
+            del _client_refs[mongo_uri]
+            logging.info("MongoDB connection closed.")
+
+
+class SyncSession:
+    """State shared by every MongoPipeline writing to the same collection in this process.
+
+    When several spiders run concurrently, one-off steps (dropping the collection
+    for MONGO_OVERWRITE_COLLECTION, resetting the staging collection) must happen
+    once, and the staging swap must wait until the last spider has finished.
+    """
+
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    def __init__(self, key):
+        self.key = key
+        self.users = 0
+        self.claimed = set()
+        self.sources = set()
+        self.all_finished = True
+        self.allow_prune = True
+        self.lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls, mongo_uri, mongo_db, collection_name):
+        key = (mongo_uri, mongo_db, collection_name)
+        with cls._sessions_lock:
+            session = cls._sessions.setdefault(key, cls(key))
+            session.users += 1
+            return session
+
+    def claim(self, step):
+        """Return True for the first caller of a one-off step, False afterwards."""
+        with self.lock:
+            if step in self.claimed:
+                return False
+            self.claimed.add(step)
+            return True
+
+    def release(self, sources, finished, allow_prune):
+        """Record one pipeline's outcome; return True if it was the last user.
+
+        The outcome of all users is then available in sources, all_finished
+        and allow_prune.
+        """
+        with self.lock:
+            self.sources.update(sources)
+            self.all_finished = self.all_finished and finished
+            self.allow_prune = self.allow_prune and allow_prune
+            self.users -= 1
+            last = self.users == 0
+        if last:
+            with self._sessions_lock:
+                self._sessions.pop(self.key, None)
+        return last
@@ -1,9 +1,55 @@
 import pymongo
+import gridfs
+import hashlib
+import importlib.util
 import logging
+import mimetypes
+import os
+import random
+import tempfile
+from datetime import datetime, timezone
+from itertools import islice
+from urllib.parse import urlparse
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.project import data_path
+from time import monotonic
+from twisted.internet import defer, task, threads
+from twisted.internet.protocol import Protocol
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone, UNKNOWN_LENGTH
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers
+from lincoln_scraper.canonical import document_key
+from lincoln_scraper.changefeed import FINGERPRINT_FIELD, change_event, change_log_from_settings, classify, content_fingerprint
+from lincoln_scraper.instrumentation import mongo_write_timed
+from lincoln_scraper.mongo import SyncSession, get_client, release_client
+from lincoln_scraper.query import ensure_query_indexes
+
+SYNC_MODES = ('append', 'upsert')
+# Documents per cursor batch and per bulk write or delete when the pipeline walks a
+# collection, so memory stays bounded however large the collection grows.
+CURSOR_BATCH_SIZE = 1000
+# Up to this many keys seen in a run, pruning sends them to the server in one $nin
+# query (well below MongoDB's 16 MB query limit); beyond it the keys are streamed.
+PRUNE_NIN_LIMIT = 100000
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
 
 class MongoPipeline:
 
-    def __init__(self, mongo_uri, mongo_db, mongo_collection, overwrite_collection):
+    def __init__(self, mongo_uri, mongo_db, mongo_collection, overwrite_collection,
+                 buffered_writes=False, batch_size=500, flush_interval=5.0,
+                 max_pending_batches=4, stats=None, sync_mode='append',
+                 upsert_key=('document_key',), prune_unseen=True, staging_swap=False,
+                 signals=None, change_log=None):
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
         self.mongo_collection_name = mongo_collection
@@ -11,28 +57,97 @@ class MongoPipeline:
         self.client = None
         self.db = None
         self.collection = None
+        self.session = None
+
+        # Buffered mode: items are collected and written with unordered bulk_write
+        # on the reactor thread pool, so Mongo round-trips never block downloading.
+        self.buffered_writes = buffered_writes
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending_batches = max(1, max_pending_batches)
+        self.stats = stats
+        # Used to report write latency to the InstrumentationExtension.
+        self.signals = signals
+        self._buffer = []
+        self._pending = set()  # Deferreds of batches currently being written
+        self._waiters = []  # Deferreds of items held back while the pending queue is full
+        self._flush_loop = None
+        self._batch_count = 0
+
+        # Sync mode: 'append' inserts every item; 'upsert' writes each item against a
+        # unique key so unchanged documents are left alone, then removes documents of
+        # the crawled sources that were not seen in this run.
+        if sync_mode not in SYNC_MODES:
+            raise ValueError(f"Unknown MONGO_SYNC_MODE '{sync_mode}'. Expected one of: {', '.join(SYNC_MODES)}")
+        self.sync_mode = sync_mode
+        self.upsert_key = tuple(upsert_key)
+        self.prune_unseen = prune_unseen
+        # Staging swap: build the run into a separate collection and rename it over
+        # the live one when the run finishes, so readers never see a partial collection.
+        self.staging_swap = staging_swap
+        self.staging_collection_name = f"{mongo_collection}__staging"
+        self._seen_keys = {}  # source -> set of upsert key tuples seen in this run
+        # Change feed (see lincoln_scraper.changefeed): only documents whose content
+        # fingerprint changed are written, and each change is appended to the change log.
+        if change_log is not None and sync_mode != 'upsert':
+            logging.warning("CHANGE_FEED_ENABLED needs MONGO_SYNC_MODE = 'upsert'. Change feed disabled.")
+            change_log = None
+        self.change_log = change_log
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(
+        pipeline = cls(
             mongo_uri=crawler.settings.get('MONGO_URI'),
             mongo_db=crawler.settings.get('MONGO_DB', 'scrapy_data'),
             mongo_collection=crawler.settings.get('MONGO_COLLECTION', 'scraped_documents'),
-            overwrite_collection=crawler.settings.getbool('MONGO_OVERWRITE_COLLECTION', False)
+            overwrite_collection=crawler.settings.getbool('MONGO_OVERWRITE_COLLECTION', False),
+            buffered_writes=crawler.settings.getbool('MONGO_BUFFERED_WRITES', False),
+            batch_size=crawler.settings.getint('MONGO_BATCH_SIZE', 500),
+            flush_interval=crawler.settings.getfloat('MONGO_FLUSH_INTERVAL', 5.0),
+            max_pending_batches=crawler.settings.getint('MONGO_MAX_PENDING_BATCHES', 4),
+            stats=crawler.stats,
+            sync_mode=crawler.settings.get('MONGO_SYNC_MODE', 'append'),
+            upsert_key=crawler.settings.getlist('MONGO_UPSERT_KEY', ['document_key']),
+            prune_unseen=crawler.settings.getbool('MONGO_PRUNE_UNSEEN', True),
+            staging_swap=crawler.settings.getbool('MONGO_STAGING_SWAP', False),
+            signals=crawler.signals,
+            change_log=change_log_from_settings(crawler.settings),
         )
+        # Pruning and the staging swap depend on how the crawl ended, which is only
+        # known once spider_closed fires, so the client is closed there as well.
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
 
     def open_spider(self, spider):
         try:
-            self.client = pymongo.MongoClient(self.mongo_uri)
+            # The client is shared with every other crawler in this process.
+            self.client = get_client(self.mongo_uri)
             self.db = self.client[self.mongo_db]
-            
-            if self.overwrite_collection:
+            # So are one-off steps on the collection, which must run once per process.
+            self.session = SyncSession.acquire(self.mongo_uri, self.mongo_db, self.mongo_collection_name)
+
+            if self.overwrite_collection and self.session.claim('overwrite'):
                 logging.info(f"Overwriting enabled. Dropping collection: {self.mongo_collection_name} in DB: {self.mongo_db}")
                 self.db.drop_collection(self.mongo_collection_name)
-                self.overwrite_collection = False 
+                self.overwrite_collection = False
 
             self.collection = self.db[self.mongo_collection_name]
-            logging.info(f"MongoDB connection established. DB: {self.mongo_db}, Collection: {self.mongo_collection_name}")
+            if self.sync_mode == 'upsert':
+                # Migrate the live collection even with a staging swap: its documents are
+                # compared with and carried over to the staging collection by this key.
+                self._ensure_upsert_index(self.collection)
+            if self.sync_mode == 'upsert' and self.staging_swap:
+                # Start from an empty staging collection, discarding leftovers of a failed run.
+                if self.session.claim('reset_staging'):
+                    self.db.drop_collection(self.staging_collection_name)
+                self.collection = self.db[self.staging_collection_name]
+                self._ensure_upsert_index(self.collection, migrate=False)
+            logging.info(f"MongoDB connection established. DB: {self.mongo_db}, Collection: {self.collection.name}")
+            if self.change_log is not None:
+                self.change_log.open()
+            # Indexes behind lincoln_scraper.query, so consumers never scan the collection.
+            if self.session.claim('query_indexes'):
+                ensure_query_indexes(self.collection)
         except pymongo.errors.ConfigurationError as e:
             logging.error(f"MongoDB configuration error: {e}")
             raise
@@ -40,18 +155,744 @@ class MongoPipeline:
             logging.error(f"MongoDB connection failed: {e}")
             raise
 
+        if self.buffered_writes:
+            # Flush partially filled buffers periodically so slow crawls still write steadily.
+            self._flush_loop = task.LoopingCall(self._flush)
+            self._flush_loop.start(self.flush_interval, now=False)
+            logging.info(f"Buffered MongoDB writes enabled (batch size: {self.batch_size}, flush interval: {self.flush_interval}s).")
+
     def close_spider(self, spider):
+        if self._flush_loop is not None and self._flush_loop.running:
+            self._flush_loop.stop()
+        if self.buffered_writes:
+            # Drain whatever is still buffered and wait for every batch in flight.
+            self._flush()
+            return defer.DeferredList(list(self._pending))
+
+    def spider_closed(self, spider, reason):
+        if self.client is None:
+            return
+        d = threads.deferToThread(self._finish_sync, reason, getattr(spider, 'allow_prune', True))
+        d.addErrback(lambda failure: logging.error(f"MongoDB sync finalization failed: {failure.getErrorMessage()}"))
+        d.addBoth(lambda _: self._close_client())
+        return d
+
+    def _close_client(self):
+        if self.change_log is not None:
+            self.change_log.close()
         if self.client:
-            self.client.close()
-            logging.info("MongoDB connection closed.")
+            release_client(self.mongo_uri)
+            self.client = None
+
+    def _ensure_upsert_index(self, collection, migrate=True):
+        index_name = 'sync_key_' + '_'.join(self.upsert_key)
+        indexes = collection.index_information()
+        if migrate and index_name not in indexes and self.session.claim(f'migrate_{index_name}'):
+            # The upsert key changed (e.g. from URL+source to document_key): the old unique
+            # index would reject rows the new key merges, so replace it and bring the
+            # existing documents in line first.
+            for name in indexes:
+                if name.startswith('sync_key_'):
+                    collection.drop_index(name)
+                    logging.info(f"Dropped unique index '{name}' of the previous MONGO_UPSERT_KEY.")
+            if 'document_key' in self.upsert_key:
+                self._migrate_document_keys(collection)
+        try:
+            collection.create_index([(field, pymongo.ASCENDING) for field in self.upsert_key],
+                                    unique=True, name=index_name)
+        except OperationFailure as e:
+            # Usually duplicates left over from append mode; a single run with
+            # MONGO_OVERWRITE_COLLECTION=True clears them.
+            logging.error(f"Could not create unique index '{index_name}' on {collection.name}: {e}")
+
+    def _migrate_document_keys(self, collection):
+        # Give documents stored before document keys existed their key, and keep only the
+        # most recently written document of each key (ObjectIds grow over time). Runs once
+        # per collection: a marker in <collection>__migrations records that it is done.
+        migrations = self.db[f"{collection.name}__migrations"]
+        if migrations.find_one({'_id': 'document_keys'}):
+            return
+        added = removed = 0
+        if collection.find_one({}, {'_id': 1}) is not None:
+            # Only documents without a key reach this process, streamed in batches.
+            missing = collection.find({'document_key': {'$exists': False}, 'URL': {'$type': 'string'}},
+                                      {'URL': 1}, batch_size=CURSOR_BATCH_SIZE)
+            for docs in _chunks(missing, CURSOR_BATCH_SIZE):
+                collection.bulk_write([
+                    UpdateOne({'_id': doc['_id']}, {'$set': {'document_key': document_key(doc['URL'])}})
+                    for doc in docs
+                ], ordered=False)
+                added += len(docs)
+            # The server groups the documents by key and returns only the duplicated keys.
+            groups = collection.aggregate([
+                {'$match': {'document_key': {'$type': 'string'}}},
+                {'$group': {'_id': '$document_key', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+                {'$match': {'count': {'$gt': 1}}},
+            ], allowDiskUse=True, batchSize=CURSOR_BATCH_SIZE)
+            older = (_id for group in groups for _id in sorted(group['ids'])[:-1])
+            for ids in _chunks(older, CURSOR_BATCH_SIZE):
+                removed += collection.delete_many({'_id': {'$in': ids}}).deleted_count
+        try:
+            migrations.insert_one({'_id': 'document_keys', 'time': datetime.now(timezone.utc)})
+        except DuplicateKeyError:
+            pass  # Another process finished the same migration
+        if self.stats:
+            self.stats.inc_value('mongo/duplicates_removed', removed)
+        logging.info(f"Added document keys to {added} documents and removed {removed} duplicates.")
+
+    def _finish_sync(self, reason, allow_prune=True):
+        # Runs on a reactor pool thread after all batches have been written.
+        finished = reason == 'finished'
+        last = self.session.release(self._seen_keys.keys(), finished, allow_prune)
+        if self.sync_mode != 'upsert':
+            return
+        if self.staging_swap:
+            # The staging collection is shared by every spider writing to this collection
+            # in the process, so the last one to finish swaps it in (or discards it).
+            if not last:
+                return
+            if not self.session.all_finished:
+                logging.warning("A spider did not finish cleanly. Discarding the staging collection to keep the live collection intact.")
+                self.db.drop_collection(self.staging_collection_name)
+                return
+            self._swap_staging_collection(self.session.sources, self.session.allow_prune)
+            return
+        if not finished:
+            logging.warning(f"Spider closed with reason '{reason}'. Skipping prune to keep the live collection intact.")
+            return
+        if self.prune_unseen and allow_prune:
+            self._prune_unseen_documents()
+        elif self.prune_unseen:
+            logging.info("Spider covered only part of its source (e.g. a backfill). Skipping prune.")
+
+    def _prune_unseen_documents(self):
+        # Only sources that produced items in this run are pruned, so a spider
+        # that found nothing (e.g. the site was down) never wipes its documents.
+        # The change feed reports the last stored version of every pruned document.
+        for source, seen_keys in self._seen_keys.items():
+            if len(self.upsert_key) == 1 and len(seen_keys) <= PRUNE_NIN_LIMIT:
+                # The server picks the stale documents; only they reach this process.
+                stale = {'source': source, self.upsert_key[0]: {'$nin': [key[0] for key in seen_keys]}}
+                if self.change_log is not None:
+                    for documents in _chunks(self.collection.find(stale, batch_size=CURSOR_BATCH_SIZE), CURSOR_BATCH_SIZE):
+                        self._record_disappeared(documents)
+                pruned = self.collection.delete_many(stale).deleted_count
+            else:
+                # Compound keys and very large runs: stream the keys and delete in batches.
+                pruned = 0
+                cursor = self.collection.find({'source': source}, {field: 1 for field in self.upsert_key},
+                                              batch_size=CURSOR_BATCH_SIZE)
+                stale_ids = (doc['_id'] for doc in cursor
+                             if tuple(doc.get(field) for field in self.upsert_key) not in seen_keys)
+                for ids in _chunks(stale_ids, CURSOR_BATCH_SIZE):
+                    if self.change_log is not None:
+                        self._record_disappeared(list(self.collection.find({'_id': {'$in': ids}})))
+                    pruned += self.collection.delete_many({'_id': {'$in': ids}}).deleted_count
+            if self.stats:
+                self.stats.inc_value('mongo/documents_pruned', pruned)
+            logging.info(f"Pruned {pruned} documents from source '{source}' not seen in this run.")
+
+    def _record_disappeared(self, documents):
+        if self.change_log is None or not documents:
+            return
+        self.change_log.append([
+            change_event('disappeared', self.upsert_key, tuple(doc.get(field) for field in self.upsert_key), doc,
+                         None, content_fingerprint(doc))
+            for doc in documents
+        ])
+        if self.stats:
+            self.stats.inc_value('changes/disappeared', len(documents))
+
+    def _swap_staging_collection(self, sources, allow_prune=True):
+        live_name = self.mongo_collection_name
+        if live_name in self.db.list_collection_names():
+            live = self.db[live_name]
+            keyed = {field: {'$exists': True} for field in self.upsert_key}
+            if self.change_log is not None and allow_prune:
+                # Documents of the crawled sources that the staging collection lacks
+                # disappear with the swap. The server looks each one up by key in the
+                # staging collection's unique index; only the missing ones come back.
+                fields = {f"k{i}": f"${field}" for i, field in enumerate(self.upsert_key)}
+                disappeared = live.aggregate([
+                    {'$match': {'source': {'$in': list(sources)}}},
+                    {'$lookup': {
+                        'from': self.staging_collection_name, 'let': fields, 'as': '_staged',
+                        'pipeline': [
+                            {'$match': {'$expr': {'$and': [
+                                {'$eq': [f"${field}", f"$$k{i}"]} for i, field in enumerate(self.upsert_key)
+                            ]}}},
+                            {'$project': {'_id': 1}},
+                        ],
+                    }},
+                    {'$match': {'_staged': {'$size': 0}}},
+                    {'$project': {'_staged': 0}},
+                ], allowDiskUse=True, batchSize=CURSOR_BATCH_SIZE)
+                for documents in _chunks(disappeared, CURSOR_BATCH_SIZE):
+                    self._record_disappeared(documents)
+            # Carry over documents of sources not crawled in this run (another spider
+            # may share the collection), then swap the staging collection in. When the
+            # spider only covered part of its source, its other documents are kept too.
+            # Documents written before the upsert key existed have none to merge on, so
+            # they keep their _id instead.
+            match = {'source': {'$nin': list(sources)}} if allow_prune else {}
+            try:
+                live.aggregate([
+                    {'$match': {**match, **keyed}},
+                    {'$project': {'_id': 0}},
+                    {'$merge': {'into': self.staging_collection_name, 'on': list(self.upsert_key),
+                                'whenMatched': 'keepExisting', 'whenNotMatched': 'insert'}},
+                ])
+                live.aggregate([
+                    {'$match': {**match, '$or': [{field: {'$exists': False}} for field in self.upsert_key]}},
+                    {'$merge': {'into': self.staging_collection_name,
+                                'whenMatched': 'keepExisting', 'whenNotMatched': 'insert'}},
+                ])
+            except OperationFailure as e:
+                # E.g. several keyless documents, which the staging collection's unique
+                # index rejects: keep the live collection rather than lose them.
+                logging.error(f"Could not carry documents of {live_name} over to the staging collection ({e}). "
+                              f"Discarding the staging collection to keep the live collection intact.")
+                self.db.drop_collection(self.staging_collection_name)
+                return
+        self.client.admin.command(
+            'renameCollection', f"{self.mongo_db}.{self.staging_collection_name}",
+            to=f"{self.mongo_db}.{live_name}", dropTarget=True,
+        )
+        logging.info(f"Swapped staging collection {self.staging_collection_name} into {live_name}.")
 
     def process_item(self, item, spider):
         if self.collection is None:
             logging.error("MongoDB collection not available. Item not processed.")
             return item
+        if self.sync_mode == 'upsert':
+            if not item.get('source'):
+                item['source'] = spider.name
+            if 'document_key' in self.upsert_key and not item.get('document_key') and item.get('URL'):
+                item['document_key'] = document_key(item['URL'])
+            key = tuple(item.get(field) for field in self.upsert_key)
+            self._seen_keys.setdefault(item['source'], set()).add(key)
+            if self.change_log is not None:
+                item[FINGERPRINT_FIELD] = content_fingerprint(item)
+        if self.buffered_writes:
+            return self._buffer_item(item)
         try:
-            self.collection.insert_one(dict(item))
-            logging.debug(f"Item inserted into MongoDB: {item}")
+            started = monotonic()
+            if self.sync_mode == 'upsert':
+                documents = self._record_changes([dict(item)])
+                if documents:
+                    self.collection.bulk_write([self._build_operation(document) for document in documents])
+                logging.debug("Item upserted into MongoDB: %s", item, extra={'event': 'mongo.item_upserted'})
+            else:
+                self.collection.insert_one(dict(item))
+                logging.debug("Item inserted into MongoDB: %s", item, extra={'event': 'mongo.item_inserted'})
+            self._report_write(monotonic() - started, 1)
         except Exception as e:
             logging.error(f"Error inserting item into MongoDB: {e}")
         return item
+
+    def _build_operation(self, item):
+        document = dict(item)
+        if self.sync_mode == 'upsert':
+            # $set with identical values is a no-op on the server, so unchanged
+            # documents are matched but not rewritten.
+            key_filter = {field: document.get(field) for field in self.upsert_key}
+            return UpdateOne(key_filter, {'$set': document}, upsert=True)
+        return InsertOne(document)
+
+    def _record_changes(self, documents):
+        # Appends the real changes among documents to the change log and returns the
+        # documents that still need writing (all of them without a change feed).
+        if self.change_log is None:
+            return documents
+        # A staging collection starts empty, so compare with the live collection, but
+        # write every document: the staging collection must end up complete.
+        target = self.db[self.mongo_collection_name] if self.staging_swap else self.collection
+        events, to_write = classify(target, documents, self.upsert_key)
+        self.change_log.append(events)
+        if self.stats:
+            for event in events:
+                self.stats.inc_value(f"changes/{event['op']}")
+            self.stats.inc_value('changes/unchanged', len(documents) - len(events))
+        return documents if self.staging_swap else to_write
+
+    def _buffer_item(self, item):
+        self._buffer.append(dict(item))
+        if len(self._buffer) >= self.batch_size:
+            self._flush()
+        if len(self._pending) < self.max_pending_batches:
+            return item
+        # Backpressure: too many batches are in flight, so hold this item (and with it
+        # the scraper's item slot) until one of them has been written.
+        waiter = defer.Deferred()
+        waiter.addCallback(lambda _: item)
+        self._waiters.append(waiter)
+        if self.stats:
+            self.stats.inc_value('mongo/backpressure_waits')
+        return waiter
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        documents, self._buffer = self._buffer, []
+        self._batch_count += 1
+        batch_number = self._batch_count
+        d = threads.deferToThread(self._write_batch, documents)
+        self._pending.add(d)
+        d.addCallbacks(self._batch_written, self._batch_failed,
+                       callbackArgs=(batch_number, len(documents)),
+                       errbackArgs=(batch_number, len(documents)))
+        d.addBoth(self._batch_done, d)
+
+    def _write_batch(self, documents):
+        # Runs on a reactor pool thread; pymongo clients are thread-safe.
+        started = monotonic()
+        documents = self._record_changes(documents)
+        if not documents:
+            return {}, [], monotonic() - started
+        operations = [self._build_operation(document) for document in documents]
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            return result.bulk_api_result, [], monotonic() - started
+        except BulkWriteError as e:
+            # With ordered=False the rest of the batch is still applied.
+            return e.details, e.details.get('writeErrors', []), monotonic() - started
+
+    def _batch_written(self, outcome, batch_number, size):
+        result, write_errors, seconds = outcome
+        self._report_write(seconds, size)
+        if self.stats:
+            self.stats.inc_value('mongo/batches_written')
+            self.stats.inc_value('mongo/documents_inserted', result.get('nInserted', 0))
+            self.stats.inc_value('mongo/documents_upserted', result.get('nUpserted', 0))
+            self.stats.inc_value('mongo/documents_modified', result.get('nModified', 0))
+        if write_errors:
+            if self.stats:
+                self.stats.inc_value('mongo/write_errors', len(write_errors))
+            logging.error(
+                f"MongoDB batch {batch_number}: {len(write_errors)} of {size} operations failed. "
+                f"First error: {write_errors[0].get('errmsg')}"
+            )
+        else:
+            logging.debug("MongoDB batch %s written (%s operations).", batch_number, size, extra={'event': 'mongo.batch_written'})
+
+    def _report_write(self, seconds, operations):
+        if self.signals:
+            self.signals.send_catch_log(signal=mongo_write_timed, seconds=seconds, operations=operations)
+
+    def _batch_failed(self, failure, batch_number, size):
+        if self.stats:
+            self.stats.inc_value('mongo/failed_batches')
+        logging.error(f"MongoDB batch {batch_number} of {size} operations failed: {failure.getErrorMessage()}")
+
+    def _batch_done(self, _, d):
+        self._pending.discard(d)
+        # Release held-back items now that there is room for another batch.
+        while self._waiters and len(self._pending) < self.max_pending_batches:
+            self._waiters.pop(0).callback(None)
+
+
+class DocumentDownloadPipeline:
+    """Downloads the document behind every item and stores it by content hash.
+
+    Files are streamed chunk by chunk into a temporary file while their SHA-256 is
+    computed, so memory use doesn't depend on the document size. They are then stored
+    once per hash, either under DOCUMENTS_STORE/<2 hex chars>/<sha256><ext> or in the
+    GridFS bucket DOCUMENTS_GRIDFS_BUCKET (DOCUMENTS_STORE = 'gridfs'), and the item
+    gets 'sha256', 'file_path' and 'file_size' fields. With the crawl state enabled,
+    files are requested conditionally (ETag/Last-Modified), so unchanged files are
+    not downloaded again.
+
+    Downloads are as polite as the crawl: at most DOCUMENTS_CONCURRENCY_PER_HOST
+    (default CONCURRENT_REQUESTS_PER_DOMAIN) run per host, they start DOWNLOAD_DELAY
+    apart (randomized with RANDOMIZE_DOWNLOAD_DELAY), and a download fails once
+    connecting or waiting for the next data takes longer than DOWNLOAD_TIMEOUT.
+    """
+
+    def __init__(self, store, max_size, concurrency_per_host, user_agent, stats=None,
+                 mongo_uri=None, mongo_db=None, gridfs_bucket='documents',
+                 download_timeout=180, download_delay=0, randomize_delay=True):
+        self.store = store
+        self.max_size = max_size
+        self.concurrency_per_host = concurrency_per_host
+        self.user_agent = user_agent
+        self.download_timeout = download_timeout
+        self.download_delay = download_delay
+        self.randomize_delay = randomize_delay
+        self.stats = stats
+        self.mongo_uri = mongo_uri
+        self.mongo_db = mongo_db
+        self.gridfs_bucket_name = gridfs_bucket
+        self.semaphores = {}  # host -> DeferredSemaphore
+        self.next_start = {}  # host -> reactor time before which no download may start
+        self.agent = None
+        self.bucket = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DOCUMENTS_ENABLED'):
+            raise NotConfigured
+        return cls(
+            store=settings.get('DOCUMENTS_STORE') or data_path('documents', createdir=True),
+            max_size=settings.getint('DOCUMENTS_MAX_SIZE'),
+            concurrency_per_host=int(settings.get('DOCUMENTS_CONCURRENCY_PER_HOST')
+                                     or settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN', 8)),
+            user_agent=settings.get('USER_AGENT'),
+            stats=crawler.stats,
+            mongo_uri=settings.get('MONGO_URI'),
+            mongo_db=settings.get('MONGO_DB', 'scrapy_data'),
+            gridfs_bucket=settings.get('DOCUMENTS_GRIDFS_BUCKET', 'documents'),
+            download_timeout=settings.getfloat('DOWNLOAD_TIMEOUT', 180),
+            download_delay=settings.getfloat('DOWNLOAD_DELAY'),
+            randomize_delay=settings.getbool('RANDOMIZE_DOWNLOAD_DELAY', True),
+        )
+
+    def open_spider(self, spider):
+        from twisted.internet import reactor
+        from twisted.web.client import Agent, BrowserLikeRedirectAgent, HTTPConnectionPool
+        pool = HTTPConnectionPool(reactor, persistent=True)
+        pool.maxPersistentPerHost = self.concurrency_per_host
+        self.agent = BrowserLikeRedirectAgent(Agent(reactor, connectTimeout=self.download_timeout, pool=pool))
+        self.pool = pool
+        self.reactor = reactor
+        if self.store == 'gridfs':
+            self.client = get_client(self.mongo_uri)
+            self.bucket = gridfs.GridFSBucket(self.client[self.mongo_db], bucket_name=self.gridfs_bucket_name)
+            self.files_collection = self.client[self.mongo_db][f"{self.gridfs_bucket_name}.files"]
+            self.tmp_dir = data_path('documents_tmp', createdir=True)
+            logging.info(f"Storing documents in GridFS bucket {self.mongo_db}.{self.gridfs_bucket_name}.")
+        else:
+            self.tmp_dir = os.path.join(self.store, '.tmp')
+            os.makedirs(self.tmp_dir, exist_ok=True)
+            logging.info(f"Storing documents in {self.store}.")
+
+    def close_spider(self, spider):
+        d = self.pool.closeCachedConnections()
+        if self.bucket is not None:
+            release_client(self.mongo_uri)
+        return d
+
+    def process_item(self, item, spider):
+        url = item.get('download_url') or item.get('URL')
+        if not url:
+            return item
+        host = urlparse(url).hostname
+        semaphore = self.semaphores.setdefault(host, defer.DeferredSemaphore(self.concurrency_per_host))
+        d = semaphore.run(self._download_in_turn, host, url, getattr(spider, 'crawl_state', None))
+        d.addCallback(self._update_item, item)
+        d.addErrback(self._download_failed, item, url)
+        return d
+
+    def _download_in_turn(self, host, url, crawl_state):
+        # Downloads from a host start DOWNLOAD_DELAY apart, like the crawl's own requests.
+        if not self.download_delay:
+            return self._download(url, crawl_state)
+        delay = self.download_delay
+        if self.randomize_delay:
+            delay *= random.uniform(0.5, 1.5)
+        now = self.reactor.seconds()
+        start = max(now, self.next_start.get(host, now))
+        self.next_start[host] = start + delay
+        return task.deferLater(self.reactor, start - now, self._download, url, crawl_state)
+
+    def _download(self, url, crawl_state):
+        known = crawl_state.get('documents', url) if crawl_state else None
+        headers = {b'User-Agent': [self.user_agent.encode()], b'Accept-Encoding': [b'identity']}
+        if known and known.get('etag'):
+            headers[b'If-None-Match'] = [known['etag'].encode('latin-1')]
+        if known and known.get('last_modified'):
+            headers[b'If-Modified-Since'] = [known['last_modified'].encode('latin-1')]
+        d = self.agent.request(b'GET', url.encode(), Headers(headers))
+        timeout = self.reactor.callLater(self.download_timeout, d.cancel)
+
+        def headers_received(result):
+            if timeout.active():
+                timeout.cancel()
+            elif isinstance(result, Failure):
+                # The agent wraps the cancellation (e.g. in ResponseNeverReceived).
+                raise DocumentDownloadError(f"No response within DOWNLOAD_TIMEOUT ({self.download_timeout:g}s)")
+            return result
+        d.addBoth(headers_received)
+        d.addCallback(self._receive, url, known, crawl_state)
+        return d
+
+    def _receive(self, response, url, known, crawl_state):
+        if response.code == 304 and known:
+            # Unchanged since we stored it: nothing to download.
+            response.deliverBody(DiscardBody())
+            self._inc_stat('documents/not_modified')
+            return known
+        if response.code != 200:
+            response.deliverBody(DiscardBody())
+            raise DocumentDownloadError(f"HTTP {response.code}")
+        if self.max_size and response.length != UNKNOWN_LENGTH and response.length > self.max_size:
+            response.deliverBody(DiscardBody())
+            raise DocumentTooLarge(f"{response.length} bytes exceeds DOCUMENTS_MAX_SIZE ({self.max_size})")
+
+        finished = defer.Deferred()
+        content_type = (response.headers.getRawHeaders(b'Content-Type') or [b''])[0].decode('latin-1')
+        writer = HashingFileWriter(self.tmp_dir, self.max_size, finished, self.download_timeout, self.reactor)
+        response.deliverBody(writer)
+        finished.addCallback(lambda _: threads.deferToThread(self._store_file, writer, content_type))
+        finished.addErrback(self._discard_partial, writer)
+
+        def record(stored):
+            stored.update({
+                'etag': (response.headers.getRawHeaders(b'ETag') or [b''])[0].decode('latin-1') or None,
+                'last_modified': (response.headers.getRawHeaders(b'Last-Modified') or [b''])[0].decode('latin-1') or None,
+            })
+            if crawl_state:
+                crawl_state.set('documents', url, stored)
+            return stored
+        return finished.addCallback(record)
+
+    def _store_file(self, writer, content_type):
+        # Runs on a reactor pool thread: moving or uploading the file may take a while.
+        sha256, size = writer.hash.hexdigest(), writer.size
+        if self.bucket is not None:
+            file_path = f"gridfs:{sha256}"
+            if self.files_collection.find_one({'_id': sha256}, {'_id': 1}) is None:
+                with open(writer.path, 'rb') as f:
+                    self.bucket.upload_from_stream_with_id(sha256, sha256, f, metadata={'contentType': content_type})
+                stored_new = True
+            else:
+                stored_new = False
+            os.remove(writer.path)
+        else:
+            extension = mimetypes.guess_extension(content_type.split(';')[0].strip()) or ''
+            file_path = os.path.join(sha256[:2], f"{sha256}{extension}")
+            destination = os.path.join(self.store, file_path)
+            stored_new = not os.path.exists(destination)
+            if stored_new:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.replace(writer.path, destination)
+            else:
+                os.remove(writer.path)
+        self._inc_stat('documents/stored' if stored_new else 'documents/duplicates')
+        self._inc_stat('documents/bytes_downloaded', size)
+        return {'sha256': sha256, 'file_path': file_path, 'file_size': size}
+
+    def _discard_partial(self, failure, writer):
+        if os.path.exists(writer.path):
+            os.remove(writer.path)
+        return failure
+
+    def _update_item(self, stored, item):
+        item['sha256'] = stored['sha256']
+        item['file_path'] = stored['file_path']
+        item['file_size'] = stored['file_size']
+        return item
+
+    def _download_failed(self, failure, item, url):
+        # The item is still stored (with its URL) even if the document couldn't be fetched.
+        if failure.check(DocumentTooLarge):
+            self._inc_stat('documents/too_large')
+            logging.warning(f"Skipped document {url}: {failure.getErrorMessage()}")
+            return item
+        self._inc_stat('documents/failed')
+        logging.error(f"Could not download document {url}: {failure.getErrorMessage()}")
+        return item
+
+    def _inc_stat(self, key, count=1):
+        if self.stats:
+            self.stats.inc_value(key, count)
+
+
+class TextExtractionPipeline:
+    """Extracts the text of every downloaded PDF in a process pool and indexes it by page.
+
+    Runs after DocumentDownloadPipeline and only looks at items with a 'sha256'. Text
+    extraction is CPU-bound, so it happens in TEXT_EXTRACTION_WORKERS processes (default:
+    one per core), never on the reactor; items move on as soon as their file is queued.
+    Once TEXT_EXTRACTION_MAX_PENDING files are queued, further items are held back until
+    a worker frees up, which slows the crawl down instead of letting the queue grow.
+    Files whose hash is already in the index are never extracted again. The text goes to
+    the index in lincoln_scraper.fulltext selected by TEXT_INDEX_BACKEND.
+    """
+
+    def __init__(self, index, workers, max_pending, documents_store, stats=None,
+                 mongo_uri=None, mongo_db=None, gridfs_bucket='documents'):
+        self.index = index
+        self.workers = workers
+        self.max_pending = max_pending
+        self.documents_store = documents_store
+        self.stats = stats
+        self.mongo_uri = mongo_uri
+        self.mongo_db = mongo_db
+        self.gridfs_bucket = gridfs_bucket
+        self.executor = None
+        self.known = set()  # hashes already in the index
+        self._pending = {}  # sha256 -> Deferred of the extraction in flight
+        self._waiters = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('TEXT_EXTRACTION_ENABLED'):
+            raise NotConfigured
+        # pypdf is only imported by the workers, but fail early if it is missing.
+        if importlib.util.find_spec('pypdf') is None:
+            logging.warning("TEXT_EXTRACTION_ENABLED is set but pypdf is not installed (pip install pypdf). Text extraction disabled.")
+            raise NotConfigured
+        from lincoln_scraper.fulltext import text_index_from_settings
+        workers = settings.getint('TEXT_EXTRACTION_WORKERS') or os.cpu_count() or 1
+        return cls(
+            index=text_index_from_settings(settings),
+            workers=workers,
+            max_pending=settings.getint('TEXT_EXTRACTION_MAX_PENDING') or 2 * workers,
+            documents_store=settings.get('DOCUMENTS_STORE') or data_path('documents', createdir=True),
+            stats=crawler.stats,
+            mongo_uri=settings.get('MONGO_URI'),
+            mongo_db=settings.get('MONGO_DB', 'scrapy_data'),
+            gridfs_bucket=settings.get('DOCUMENTS_GRIDFS_BUCKET', 'documents'),
+        )
+
+    def open_spider(self, spider):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        self.index.open()
+        self.known = self.index.known_hashes()
+        # Spawned rather than forked workers: forking a process that runs a reactor
+        # and a thread pool can leave locks held in the child.
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        logging.info(f"Text extraction enabled ({self.workers} workers, {len(self.known)} documents already indexed).")
+
+    def close_spider(self, spider):
+        d = defer.DeferredList(list(self._pending.values()))
+
+        def shut_down(_):
+            self.executor.shutdown(wait=False)
+            self.index.close()
+        return d.addBoth(shut_down)
+
+    def process_item(self, item, spider):
+        sha256 = item.get('sha256')
+        if not sha256 or sha256 in self._pending:
+            return item
+        if sha256 in self.known:
+            self._inc_stat('text_extraction/cached')
+            return item
+        file_path = item.get('file_path') or ''
+        if file_path.startswith('gridfs:'):
+            source = ('gridfs', self.mongo_uri, self.mongo_db, self.gridfs_bucket, sha256)
+        else:
+            source = os.path.join(self.documents_store, file_path)
+        d = self._submit(source)
+        d.addCallback(lambda result: threads.deferToThread(self._store_text, sha256, result))
+        d.addErrback(self._extraction_failed, sha256)
+        d.addBoth(self._extraction_done, sha256)
+        self._pending[sha256] = d
+        if len(self._pending) <= self.max_pending:
+            return item
+        # Backpressure: the pool is saturated, so hold this item until a file is done.
+        waiter = defer.Deferred()
+        waiter.addCallback(lambda _: item)
+        self._waiters.append(waiter)
+        self._inc_stat('text_extraction/backpressure_waits')
+        return waiter
+
+    def _submit(self, source):
+        from lincoln_scraper.fulltext import extract_pdf_text
+        from twisted.internet import reactor
+        d = defer.Deferred()
+        future = self.executor.submit(extract_pdf_text, source)
+
+        def done(future):
+            # Called on an executor thread; hand the result back to the reactor.
+            if future.exception() is not None:
+                reactor.callFromThread(d.errback, future.exception())
+            else:
+                reactor.callFromThread(d.callback, future.result())
+        future.add_done_callback(done)
+        return d
+
+    def _store_text(self, sha256, result):
+        # Runs on a reactor pool thread.
+        self.index.store(sha256, result['pages'], result['error'])
+        self.known.add(sha256)
+        self._inc_stat('text_extraction/cpu_seconds', result['cpu_seconds'])
+        if result['error']:
+            self._inc_stat('text_extraction/unreadable')
+            logging.warning(f"Could not extract text from document {sha256}: {result['error']}")
+        else:
+            self._inc_stat('text_extraction/documents')
+            self._inc_stat('text_extraction/pages', len(result['pages']))
+
+    def _extraction_failed(self, failure, sha256):
+        self._inc_stat('text_extraction/failed')
+        logging.error(f"Text extraction for document {sha256} failed: {failure.getErrorMessage()}")
+
+    def _extraction_done(self, _, sha256):
+        self._pending.pop(sha256, None)
+        while self._waiters and len(self._pending) <= self.max_pending:
+            self._waiters.pop(0).callback(None)
+
+    def _inc_stat(self, key, count=1):
+        if self.stats:
+            self.stats.inc_value(key, count)
+
+
+class DocumentDownloadError(Exception):
+    pass
+
+
+class DocumentTooLarge(DocumentDownloadError):
+    pass
+
+
+class HashingFileWriter(Protocol):
+    """Writes a response body to a temporary file chunk by chunk, hashing it on the way.
+
+    Gives up when no data arrives for timeout seconds.
+    """
+
+    def __init__(self, tmp_dir, max_size, finished, timeout=None, clock=None):
+        fd, self.path = tempfile.mkstemp(dir=tmp_dir)
+        self.file = os.fdopen(fd, 'wb')
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.max_size = max_size
+        self.finished = finished
+        self.timeout = timeout
+        self.clock = clock
+        self.idle_call = None
+
+    def connectionMade(self):
+        if self.timeout and self.clock is not None:
+            self.idle_call = self.clock.callLater(self.timeout, self._timed_out)
+
+    def _timed_out(self):
+        self.file.close()
+        self.transport.stopProducing()
+        self.finished.errback(DocumentDownloadError(f"No data received within DOWNLOAD_TIMEOUT ({self.timeout:g}s)"))
+
+    def dataReceived(self, data):
+        if self.finished.called:
+            return
+        if self.idle_call is not None:
+            self.idle_call.reset(self.timeout)
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            # The server sent no Content-Length (or a wrong one): stop reading.
+            self.file.close()
+            self.transport.stopProducing()
+            self.finished.errback(DocumentTooLarge(f"Document exceeds DOCUMENTS_MAX_SIZE ({self.max_size})"))
+            return
+        self.hash.update(data)
+        self.file.write(data)
+
+    def connectionLost(self, reason):
+        if self.idle_call is not None and self.idle_call.active():
+            self.idle_call.cancel()
+        if self.finished.called:
+            return
+        self.file.close()
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback(None)
+        else:
+            self.finished.errback(reason)
+
+
+class DiscardBody(Protocol):
+    def dataReceived(self, data):
+        pass
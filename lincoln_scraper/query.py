@@ -0,0 +1,329 @@
+"""Read side of the scraped collection (MONGO_URI / MONGO_DB / MONGO_COLLECTION).
+
+Every query filters on source and/or category (equality) and a date range, and
+returns documents newest first, ordered by (date, _id). The compound indexes in
+QUERY_INDEXES cover each combination in that order, so MongoDB reads only the
+documents it returns, however large the collection grows. Pages continue after
+the last document of the previous page (keyset pagination) instead of skipping
+over the first N.
+
+    python -m lincoln_scraper.query find [--source S] [--category C] [--since DATE] [--until DATE] [--limit N]
+    python -m lincoln_scraper.query export --format jsonl|csv|parquet [--output FILE] [filters]
+    python -m lincoln_scraper.query serve [--port 8790]
+    python -m lincoln_scraper.query indexes
+
+find and export accept --explain to print the winning plan and the number of
+documents examined instead of the results.
+"""
+import argparse
+import base64
+import csv
+import json
+import logging
+import sys
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pymongo
+from bson import ObjectId, json_util
+from scrapy.utils.project import get_project_settings
+from lincoln_scraper.mongo import get_client, release_client
+
+# Equality fields first, then the sort (date, _id): one index per filter combination.
+QUERY_INDEXES = {
+    'query_date': [('date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+    'query_source_date': [('source', pymongo.ASCENDING), ('date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+    'query_category_date': [('category', pymongo.ASCENDING), ('date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+    'query_source_category_date': [('source', pymongo.ASCENDING), ('category', pymongo.ASCENDING),
+                                   ('date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+}
+SORT = [('date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]
+EXPORT_FIELDS = ['date', 'meeting_title', 'category', 'URL', 'source', 'tenant', 'document_key', 'download_url', 'sha256']
+EXPORT_FORMATS = ('jsonl', 'csv', 'parquet')
+# Rows fetched from MongoDB per round trip, and rows per Parquet row group.
+BATCH_SIZE = 1000
+MAX_PAGE_SIZE = 500
+
+
+def ensure_query_indexes(collection):
+    for name, keys in QUERY_INDEXES.items():
+        collection.create_index(keys, name=name)
+
+
+def encode_cursor(document):
+    """Opaque token pointing after document in (date, _id) order."""
+    return base64.urlsafe_b64encode(json_util.dumps([document.get('date'), document['_id']]).encode()).decode()
+
+
+def decode_cursor(token):
+    try:
+        date, _id = json_util.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise ValueError(f"Invalid cursor '{token}'")
+    return date, _id
+
+
+def build_filter(source=None, category=None, since=None, until=None, after=None):
+    """MongoDB filter for the given fields; dates are YYYY-MM-DD strings, both ends inclusive."""
+    query = {}
+    if source:
+        query['source'] = source
+    if category:
+        query['category'] = category
+    if since or until:
+        query['date'] = {}
+        if since:
+            query['date']['$gte'] = since
+        if until:
+            query['date']['$lte'] = until
+    if after:
+        # Everything after (date, _id) in descending order: older dates, or the same date with smaller ids.
+        date, _id = decode_cursor(after)
+        keyset = {'$or': [{'date': {'$lt': date}}, {'date': date, '_id': {'$lt': _id}}]}
+        query = {'$and': [query, keyset]} if query else keyset
+    return query
+
+
+class DocumentQuery:
+    """Indexed, batched queries over the scraped collection."""
+
+    def __init__(self, mongo_uri, mongo_db, collection_name):
+        self.mongo_uri = mongo_uri
+        self.mongo_db = mongo_db
+        self.collection_name = collection_name
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.get('MONGO_URI'),
+            settings.get('MONGO_DB', 'scrapy_data'),
+            settings.get('MONGO_COLLECTION', 'scraped_documents'),
+        )
+
+    def open(self, create_indexes=True):
+        self.client = get_client(self.mongo_uri)
+        self.collection = self.client[self.mongo_db][self.collection_name]
+        if create_indexes:
+            ensure_query_indexes(self.collection)
+
+    def close(self):
+        release_client(self.mongo_uri)
+
+    def find(self, limit=None, batch_size=BATCH_SIZE, projection=None, **filters):
+        """Cursor over the matching documents, newest first, fetched batch_size at a time."""
+        cursor = self.collection.find(build_filter(**filters), projection, sort=SORT, batch_size=batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    def page(self, limit=100, **filters):
+        """One page of results and the cursor token of the next page (None on the last page)."""
+        documents = list(self.find(limit=limit + 1, batch_size=limit + 1, **filters))
+        next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+        return documents[:limit], next_cursor
+
+    def explain(self, limit=None, **filters):
+        cursor = self.find(limit=limit, **filters)
+        plan = cursor.explain()
+        stats = plan.get('executionStats', {})
+        winning = plan.get('queryPlanner', {}).get('winningPlan', {})
+        return {
+            'index': _plan_index(winning),
+            'returned': stats.get('nReturned'),
+            'keys_examined': stats.get('totalKeysExamined'),
+            'documents_examined': stats.get('totalDocsExamined'),
+            'milliseconds': stats.get('executionTimeMillis'),
+        }
+
+
+def _plan_index(stage):
+    # The index of the first IXSCAN stage of a plan, or COLLSCAN if there is none.
+    while stage:
+        if stage.get('stage') == 'IXSCAN':
+            return stage.get('indexName')
+        if stage.get('stage') == 'COLLSCAN':
+            return 'COLLSCAN'
+        stage = stage.get('inputStage') or (stage.get('inputStages') or [None])[0] or stage.get('queryPlan')
+    return None
+
+
+def plain(value):
+    """A JSON/CSV-friendly version of a value read from MongoDB."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    return value
+
+
+def export(cursor, fmt, out, fields=None):
+    """Write the documents of cursor to out one batch at a time; returns the number written.
+
+    jsonl and csv write text to out; parquet (needs pyarrow) writes to a binary file.
+    Only the current batch is ever held in memory.
+    """
+    fields = fields or EXPORT_FIELDS
+    count = 0
+    if fmt == 'jsonl':
+        for document in cursor:
+            out.write(json.dumps(plain(document), ensure_ascii=False) + '\n')
+            count += 1
+    elif fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        for document in cursor:
+            writer.writerow({field: plain(document.get(field)) for field in fields})
+            count += 1
+    elif fmt == 'parquet':
+        count = _export_parquet(cursor, out, fields)
+    else:
+        raise ValueError(f"Unknown export format '{fmt}'. Expected one of: {', '.join(EXPORT_FORMATS)}")
+    return count
+
+
+def _export_parquet(cursor, out, fields):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet export needs pyarrow: pip install pyarrow")
+    schema = pa.schema([(field, pa.string()) for field in fields])
+    count = 0
+    with pq.ParquetWriter(out, schema) as writer:
+        batch = []
+        for document in cursor:
+            batch.append(document)
+            if len(batch) == BATCH_SIZE:
+                writer.write_table(_parquet_table(pa, schema, batch, fields))
+                count += len(batch)
+                batch = []
+        if batch or not count:
+            writer.write_table(_parquet_table(pa, schema, batch, fields))
+            count += len(batch)
+    return count
+
+
+def _parquet_table(pa, schema, documents, fields):
+    columns = {}
+    for field in fields:
+        values = (plain(document.get(field)) for document in documents)
+        columns[field] = [None if value is None else str(value) for value in values]
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """GET /documents?source=&category=&since=&until=&limit=&cursor= returns one page of
+    {"documents": [...], "next": <cursor of the next page or null>}."""
+
+    query = None  # set by serve()
+
+    def log_message(self, format, *args):
+        logging.debug("%s " + format, self.address_string(), *args, extra={'event': 'query.request'})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/documents':
+            return self.send_json(404, {'error': 'not found'})
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        try:
+            limit = min(int(params.get('limit', 100)), MAX_PAGE_SIZE)
+            if limit < 1:
+                raise ValueError('limit must be positive')
+            documents, next_cursor = self.query.page(
+                limit=limit, source=params.get('source'), category=params.get('category'),
+                since=params.get('since'), until=params.get('until'), after=params.get('cursor'),
+            )
+        except ValueError as e:
+            return self.send_json(400, {'error': str(e)})
+        self.send_json(200, {'documents': [plain(document) for document in documents], 'next': next_cursor})
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(query, port, host='127.0.0.1'):
+    handler = type('BoundQueryHandler', (QueryHandler,), {'query': query})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"Serving http://{host}:{server.server_port}/documents")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def add_filter_arguments(parser):
+    parser.add_argument('--source', help="e.g. cab_minutes, lincoln_county or civicclerk/<tenant>")
+    parser.add_argument('--category', help='minutes, agenda, agenda_packet or other')
+    parser.add_argument('--since', help='First date (YYYY-MM-DD), inclusive.')
+    parser.add_argument('--until', help='Last date (YYYY-MM-DD), inclusive.')
+    parser.add_argument('--limit', type=int, help='At most this many documents.')
+    parser.add_argument('--explain', action='store_true', help='Print the query plan instead of the results.')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query and export the scraped documents.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    find_parser = commands.add_parser('find', help='Print matching documents, newest first.')
+    add_filter_arguments(find_parser)
+    export_parser = commands.add_parser('export', help='Stream matching documents to a file.')
+    add_filter_arguments(export_parser)
+    export_parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl')
+    export_parser.add_argument('--output', help='File to write (default: stdout; required for parquet).')
+    export_parser.add_argument('--fields', help=f"Comma-separated fields for csv/parquet (default: {','.join(EXPORT_FIELDS)}).")
+    serve_parser = commands.add_parser('serve', help='Serve paginated results over HTTP on localhost.')
+    serve_parser.add_argument('--port', type=int, default=8790)
+    commands.add_parser('indexes', help='Create the query indexes and list all indexes.')
+    args = parser.parse_args(argv)
+
+    query = DocumentQuery.from_settings(get_project_settings())
+    query.open()
+    try:
+        if args.command == 'indexes':
+            for name, info in query.collection.index_information().items():
+                print(f"{name}: {info['key']}")
+            return 0
+        if args.command == 'serve':
+            serve(query, args.port)
+            return 0
+        filters = {'source': args.source, 'category': args.category, 'since': args.since, 'until': args.until}
+        if args.explain:
+            print(json.dumps(query.explain(limit=args.limit, **filters), indent=2))
+            return 0
+        if args.command == 'find':
+            for document in query.find(limit=args.limit, **filters):
+                print(f"{document.get('date', '')}  {document.get('category', ''):13}  {document.get('source', ''):24}  "
+                      f"{document.get('meeting_title', '')}  {document.get('URL', '')}")
+            return 0
+        if args.format == 'parquet' and not args.output:
+            parser.error('--output is required for parquet exports')
+        fields = args.fields.split(',') if args.fields else None
+        cursor = query.find(limit=args.limit, **filters)
+        if args.format == 'parquet':
+            count = export(cursor, 'parquet', args.output, fields)
+        elif args.output:
+            with open(args.output, 'w', encoding='utf-8', newline='') as out:
+                count = export(cursor, args.format, out, fields)
+        else:
+            count = export(cursor, args.format, sys.stdout, fields)
+        sys.stderr.write(f"Exported {count} documents.\n")
+        return 0
+    finally:
+        query.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    raise SystemExit(main())
@@ -0,0 +1,90 @@
+"""Run all spiders of the project concurrently in a single process.
+
+    python -m lincoln_scraper.run [-s NAME=VALUE ...] [--spider NAME ...]
+                                  [--spider-setting SPIDER:NAME=VALUE ...]
+
+The spiders hit unrelated hosts, so they share one reactor (and one pooled
+Mongo client, see lincoln_scraper.mongo) instead of running one after the
+other. The exit status is non-zero if any spider failed or did not finish.
+"""
+import argparse
+import logging
+import sys
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+
+def setting_pair(value):
+    name, sep, setting_value = value.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"Expected NAME=VALUE, got '{value}'")
+    return name, setting_value
+
+
+def spider_setting(value):
+    spider_name, sep, pair = value.partition(':')
+    if not sep or not spider_name:
+        raise argparse.ArgumentTypeError(f"Expected SPIDER:NAME=VALUE, got '{value}'")
+    return (spider_name,) + setting_pair(pair)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run the project's spiders concurrently in one process.")
+    parser.add_argument('-s', '--set', dest='settings', action='append', type=setting_pair, default=[],
+                        metavar='NAME=VALUE', help='Override a setting for every spider.')
+    parser.add_argument('--spider', dest='spiders', action='append', default=[], metavar='NAME',
+                        help='Only run these spiders (default: all spiders except RUNNER_SKIP_SPIDERS).')
+    parser.add_argument('--spider-setting', dest='spider_settings', action='append', type=spider_setting,
+                        default=[], metavar='SPIDER:NAME=VALUE', help='Override a setting for one spider.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = get_project_settings()
+    for name, value in args.settings:
+        settings.set(name, value, priority='cmdline')
+
+    process = CrawlerProcess(settings)
+    spider_names = args.spiders or [
+        name for name in process.spider_loader.list()
+        if name not in settings.getlist('RUNNER_SKIP_SPIDERS')
+    ]
+
+    failures = {}
+    crawlers = {}
+    for spider_name in spider_names:
+        crawler = process.create_crawler(spider_name)
+        # The crawler holds its own copy of the settings, so per-spider overrides stay local.
+        for target, name, value in args.spider_settings:
+            if target == spider_name:
+                crawler.settings.set(name, value, priority='cmdline')
+        crawlers[spider_name] = crawler
+        d = process.crawl(crawler)
+        d.addErrback(lambda failure, spider_name=spider_name: failures.setdefault(spider_name, failure.getErrorMessage()))
+
+    logging.info(f"Running {len(crawlers)} spiders concurrently: {', '.join(crawlers)}")
+    process.start()
+    return summarize(crawlers, failures)
+
+
+def summarize(crawlers, failures):
+    # Combined exit status: every spider must have finished cleanly.
+    exit_code = 0
+    for spider_name, crawler in crawlers.items():
+        stats = crawler.stats.get_stats() if crawler.stats else {}
+        reason = stats.get('finish_reason', 'not started')
+        if spider_name in failures:
+            reason = f"failed: {failures[spider_name]}"
+        logging.info(
+            f"{spider_name}: {reason}, {stats.get('item_scraped_count', 0)} items, "
+            f"{stats.get('log_count/ERROR', 0)} errors"
+        )
+        if reason != 'finished':
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,3 @@
-import pathlib
-
 BOT_NAME = 'lincoln_scraper'
 
 SPIDER_MODULES = ['lincoln_scraper.spiders']
@@ -54,19 +52,194 @@ MONGO_DB = "scrapy_data"
 MONGO_COLLECTION = "lincoln_cab_documents"
 MONGO_OVERWRITE_COLLECTION = False
 
+# Sync mode: 'append' (the default) inserts every scraped item. 'upsert' (used by the
+# scheduled workflow) writes items against a unique index on MONGO_UPSERT_KEY, so
+# unchanged documents are not rewritten, and (with MONGO_PRUNE_UNSEEN) deletes documents
+# of each crawled source that were not seen in a successfully finished run that covered
+# its whole source (not backfills or runs cut short by max_pages). MONGO_STAGING_SWAP
+# builds the run into a staging collection and renames it over the live one instead.
+# The default key, document_key, identifies a document however its URL is spelled and
+# whichever spider found it (lincoln_scraper.canonical), so it is stored only once.
+# Changing the key replaces the old unique index (and, for document_key, adds keys to
+# existing documents and removes their duplicates) on the next run.
+MONGO_SYNC_MODE = 'append'
+MONGO_UPSERT_KEY = ['document_key']
+MONGO_PRUNE_UNSEEN = True
+MONGO_STAGING_SWAP = False
+
+# Change feed (opt-in, upsert mode only): each document gets a fingerprint of its content
+# fields (lincoln_scraper.changefeed.CONTENT_FIELDS), items whose fingerprint is unchanged
+# are not written, and every insert, update and pruned document is appended with a
+# sequence number to CHANGE_FEED_COLLECTION in MONGO_DB ('mongo' backend) or to
+# CHANGE_FEED_PATH (default .scrapy/changes.jsonl, 'jsonl' backend).
+# Consumers read on from the last sequence number they saw: python -m lincoln_scraper.changefeed --since N
+CHANGE_FEED_ENABLED = False
+CHANGE_FEED_BACKEND = 'mongo'
+CHANGE_FEED_COLLECTION = 'document_changes'
+CHANGE_FEED_PATH = None
+
+# Buffered writes (opt-in; the scheduled workflow turns them on): collect items and
+# flush them with unordered bulk_write on a worker thread, so Mongo round-trips don't
+# stall the reactor. A batch is sent when MONGO_BATCH_SIZE items are buffered or every
+# MONGO_FLUSH_INTERVAL seconds. Once MONGO_MAX_PENDING_BATCHES batches are in flight,
+# new items wait (backpressure).
+MONGO_BUFFERED_WRITES = False
+MONGO_BATCH_SIZE = 500
+MONGO_FLUSH_INTERVAL = 5.0
+MONGO_MAX_PENDING_BATCHES = 4
+
+# Document downloads (opt-in): fetch every item's file, stream it to disk while hashing
+# it, and store each SHA-256 once under DOCUMENTS_STORE (default .scrapy/documents) or,
+# with DOCUMENTS_STORE = 'gridfs', in the DOCUMENTS_GRIDFS_BUCKET bucket of MONGO_DB.
+# Items get 'sha256', 'file_path' and 'file_size'. Larger files than DOCUMENTS_MAX_SIZE
+# are skipped; each host gets at most DOCUMENTS_CONCURRENCY_PER_HOST downloads at once
+# (default CONCURRENT_REQUESTS_PER_DOMAIN), started DOWNLOAD_DELAY apart and abandoned
+# after DOWNLOAD_TIMEOUT without data, like the crawl's own requests.
+# With the crawl state enabled, unchanged files are skipped via ETag/Last-Modified.
+DOCUMENTS_ENABLED = False
+DOCUMENTS_STORE = None
+DOCUMENTS_GRIDFS_BUCKET = 'documents'
+DOCUMENTS_MAX_SIZE = 200 * 1024 * 1024
+DOCUMENTS_CONCURRENCY_PER_HOST = None
+
+# Full-text index (opt-in, needs DOCUMENTS_ENABLED and `pip install pypdf`): extract the
+# text of every downloaded PDF in TEXT_EXTRACTION_WORKERS processes (0 = one per core)
+# and index it by page, in Mongo (TEXT_INDEX_COLLECTION, with a text index) or, with
+# TEXT_INDEX_BACKEND = 'sqlite', in a local FTS5 index at TEXT_INDEX_PATH (default
+# .scrapy/fulltext.sqlite3). Files are keyed by SHA-256 and only extracted once. Items are
+# held back once TEXT_EXTRACTION_MAX_PENDING files (0 = twice the workers) are queued.
+TEXT_EXTRACTION_ENABLED = False
+TEXT_EXTRACTION_WORKERS = 0
+TEXT_EXTRACTION_MAX_PENDING = 0
+TEXT_INDEX_BACKEND = 'mongo'
+TEXT_INDEX_COLLECTION = 'document_pages'
+TEXT_INDEX_PATH = None
+
+# Distributed crawl frontier (opt-in): with SCHEDULER = 'lincoln_scraper.frontier.MongoScheduler'
+# and DUPEFILTER_CLASS = 'lincoln_scraper.frontier.MongoDupeFilter', the request queue and
+# the seen requests live in FRONTIER_MONGO_URI (default MONGO_URI), in collections named
+# FRONTIER_COLLECTION_PREFIX_*, so several workers can share one crawl (FRONTIER_CRAWL_ID,
+# default the spider name). Workers lease requests for FRONTIER_LEASE_SECONDS; requests of
+# a worker that dies go back to the queue, and are dropped after FRONTIER_MAX_LEASES leases.
+# CONCURRENT_REQUESTS_PER_DOMAIN, DOWNLOAD_DELAY and DOWNLOAD_SLOTS hold across all workers.
+# Each worker claims up to FRONTIER_PREFETCH requests ahead of its engine (default
+# CONCURRENT_REQUESTS); they stay leased to it until they are downloaded.
+FRONTIER_MONGO_URI = None
+FRONTIER_COLLECTION_PREFIX = 'frontier'
+FRONTIER_CRAWL_ID = None
+FRONTIER_LEASE_SECONDS = 300
+FRONTIER_MAX_LEASES = 3
+FRONTIER_POLL_INTERVAL = 0.5
+FRONTIER_PREFETCH = None
+
 ITEM_PIPELINES = {
+   "lincoln_scraper.pipelines.DocumentDownloadPipeline": 200,
+   "lincoln_scraper.pipelines.TextExtractionPipeline": 250,
    "lincoln_scraper.pipelines.MongoPipeline": 300,
 }
 
+# Crawl state (opt-in; the scheduled workflow turns it on): remembers resolved Hyland
+# document URLs and CivicClerk pages/files (with their ETag/Last-Modified) between
+# runs. Known documents are skipped, or revalidated with conditional requests when
+# CRAWL_STATE_REVALIDATE is True.
+# The 'file' backend writes .scrapy/crawlstate.json unless CRAWL_STATE_PATH is set;
+# the 'mongo' backend uses MONGO_URI/MONGO_DB and CRAWL_STATE_MONGO_COLLECTION.
+CRAWL_STATE_ENABLED = False
+CRAWL_STATE_BACKEND = 'file'
+CRAWL_STATE_PATH = None
+CRAWL_STATE_MONGO_COLLECTION = 'crawl_state'
+CRAWL_STATE_REVALIDATE = False
+
+# How cab_minutes resolves Hyland links to their final document URL: 'head' (HEAD
+# request, falling back to 'headers' when rejected), 'headers' (GET, cancelled once
+# the response headers arrive) or 'get' (download the full document).
+CAB_RESOLVE_METHOD = 'head'
+
+# CivicClerk API paging (lincoln_county): page requests share a dedicated download
+# slot for the API host with this concurrency and delay, so the 'parallel' paging
+# mode can fetch all $top/$skip pages of a date window at once.
+CIVICCLERK_PAGE_CONCURRENCY = 4
+CIVICCLERK_PAGE_DELAY = 0
+# Decode API pages of at least CIVICCLERK_STREAM_JSON_MIN_BYTES event by event from the
+# response bytes (needs `pip install ijson` with its C backend), so memory stays flat with
+# large page sizes (-a page_size=5000) and items reach the pipelines before the page is
+# fully parsed. Streaming costs more CPU per event than json.loads, so smaller pages, and
+# all pages without ijson or with CIVICCLERK_STREAM_JSON = False, are decoded whole.
+CIVICCLERK_STREAM_JSON = True
+CIVICCLERK_STREAM_JSON_MIN_BYTES = 1024 * 1024
+
+# Tenants for the generic 'civicclerk' spider. Each row needs the tenant's CivicClerk
+# id (its subdomain) and may set 'name', 'concurrency', 'delay', 'source' or
+# 'enabled'. Rows are read from CIVICCLERK_TENANTS if set, otherwise from the JSON
+# file CIVICCLERK_TENANTS_FILE, otherwise from CIVICCLERK_TENANTS_COLLECTION in MONGO_DB.
+CIVICCLERK_TENANTS = []
+CIVICCLERK_TENANTS_FILE = 'civicclerk_tenants.json'
+CIVICCLERK_TENANTS_COLLECTION = None
+
+# Where lincoln_county backfills (-a since=YYYY-MM-DD) checkpoint completed shards.
+# Defaults to the project's .scrapy/ directory.
+BACKFILL_CHECKPOINT_DIR = None
+
+# Spiders that `python -m lincoln_scraper.run` leaves out unless named with --spider.
+# The generic civicclerk spider would duplicate lincoln_county with the default tenant list.
+RUNNER_SKIP_SPIDERS = ['civicclerk']
+
+# Instrumentation: callback CPU/wall time, per-host download latency histograms (slot
+# wait, time to first byte, total), download slot delays and MongoPipeline write latency.
+# Written to INSTRUMENTATION_DIR (default .scrapy/instrumentation) as JSON and Prometheus
+# text files when a spider closes, and served at http://127.0.0.1:<port>/metrics during
+# the crawl if INSTRUMENTATION_HTTP_PORT is set.
+INSTRUMENTATION_ENABLED = False
+INSTRUMENTATION_DIR = None
+INSTRUMENTATION_HTTP_PORT = None
+
+EXTENSIONS = {
+   "lincoln_scraper.crawlstate.CrawlStateExtension": 500,
+   "lincoln_scraper.instrumentation.InstrumentationExtension": 510,
+   "lincoln_scraper.logs.StructuredLoggingExtension": 520,
+}
+
 COOKIES_ENABLED = True
 
 RETRY_TIMES = 5
 
-RETRY_HTTP_CODES = [403, 429, 500, 502, 503, 504, 522, 524, 408, 404]
+RETRY_HTTP_CODES = [403, 429, 500, 502, 503, 504, 522, 524, 408]
+
+# Retry policy (lincoln_scraper.middlewares.RetryPolicyMiddleware, which replaces
+# Scrapy's RetryMiddleware). Permanent errors such as dead Hyland links fail fast.
+# Retries wait RETRY_BACKOFF_BASE * 2^(attempt - 1) seconds (with jitter, capped at
+# RETRY_BACKOFF_MAX), or the Retry-After of a 429/503 (capped at RETRY_AFTER_MAX).
+# RETRY_BREAKER_THRESHOLD consecutive failures from one host hold back its requests
+# for RETRY_BREAKER_COOLDOWN seconds. Status and host policies override max_retries,
+# backoff_base, backoff_max, breaker_threshold and breaker_cooldown.
+RETRY_PERMANENT_HTTP_CODES = [404, 410]
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 60.0
+RETRY_AFTER_MAX = 300.0
+RETRY_BREAKER_THRESHOLD = 5
+RETRY_BREAKER_COOLDOWN = 60.0
+RETRY_STATUS_POLICIES = {
+    403: {'max_retries': 1}, # Usually a block, not a hiccup
+    429: {'backoff_base': 5.0},
+}
+RETRY_HOST_POLICIES = {
+    'oitco.hylandcloud.com': {'max_retries': 2},
+}
 
 DOWNLOAD_TIMEOUT = 30
 
-LOG_LEVEL = 'DEBUG'
+# Per-link and per-item messages (and Scrapy's own "Crawled"/"Scraped from" lines) are
+# DEBUG; run with -s LOG_LEVEL=DEBUG to see them.
+LOG_LEVEL = 'INFO'
+
+# Structured logging (lincoln_scraper.logs). LOG_JSON writes one JSON object per line.
+# LOG_SAMPLING_ENABLED lets the first LOG_SAMPLE_FIRST records of each repeated INFO/DEBUG
+# message through, then one in every LOG_SAMPLE_EVERY; warnings and errors are never
+# sampled. The per-message totals go to the log/repeated/* crawl stats.
+LOG_JSON = False
+LOG_SAMPLING_ENABLED = False
+LOG_SAMPLE_FIRST = 20
+LOG_SAMPLE_EVERY = 500
 
 RANDOMIZE_DOWNLOAD_DELAY = True
 
@@ -74,21 +247,44 @@ CONCURRENT_REQUESTS_PER_DOMAIN = 1
 
 CONCURRENT_REQUESTS_PER_IP = 1
 
+# Per-IP slots need the plain priority queue; the downloader-aware queue that newer
+# Scrapy versions use by default refuses to run with CONCURRENT_REQUESTS_PER_IP.
+SCHEDULER_PRIORITY_QUEUE = 'scrapy.pqueues.ScrapyPriorityQueue'
+
 HTTPCACHE_ENABLED = True
 HTTPCACHE_EXPIRATION_SECS = 0
 HTTPCACHE_DIR = 'httpcache'
 HTTPCACHE_IGNORE_HTTP_CODES = []
-HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+# The cache is a single compressed SQLite file (.scrapy/httpcache/httpcache.sqlite3),
+# trimmed back to HTTPCACHE_MAX_BYTES by evicting the least recently used entries.
+HTTPCACHE_STORAGE = 'lincoln_scraper.httpcache.SqliteCacheStorage'
+HTTPCACHE_MAX_BYTES = 200 * 1024 * 1024
+HTTPCACHE_COMPRESSION_LEVEL = 6
+# Time-to-live per URL pattern (first match wins, HTTPCACHE_EXPIRATION_SECS otherwise).
+# Listing pages and API results change between runs; resolved documents do not.
+# With HTTPCACHE_REVALIDATE, expired entries are revalidated with conditional requests.
+HTTPCACHE_POLICY = 'lincoln_scraper.httpcache.TTLCachePolicy'
+HTTPCACHE_TTL_RULES = [
+    (r'^https?://www\.codot\.gov/', 6 * 3600),
+    (r'^https?://[^/]+\.api\.civicclerk\.com/', 3600),
+    (r'^https?://oitco\.hylandcloud\.com/', 30 * 24 * 3600),
+]
+HTTPCACHE_REVALIDATE = False
 
 DOWNLOADER_MIDDLEWARES = {
     'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
-    'scrapy.downloadermiddlewares.retry.RetryMiddleware': 90,
+    'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
+    'lincoln_scraper.middlewares.RetryPolicyMiddleware': 90,
+    # Acknowledges frontier requests dropped before download; a no-op without MongoScheduler.
+    'lincoln_scraper.frontier.FrontierAckMiddleware': 950,
     'scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware': 110,
     'scrapy.downloadermiddlewares.cookies.CookiesMiddleware': 130,
     'scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware': 810,
     'scrapy.downloadermiddlewares.redirect.RedirectMiddleware': 800,
     'scrapy.downloadermiddlewares.defaultheaders.DefaultHeadersMiddleware': 400,
-    "lincoln_scraper.middlewares.LincolnScraperDownloaderMiddleware": 543,
+    # Same as Scrapy's, but a 304 revalidation restarts the cache entry's TTL.
+    'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware': None,
+    'lincoln_scraper.httpcache.RevalidatingHttpCacheMiddleware': 900,
 }
 
 AUTOTHROTTLE_ENABLED = True
@@ -104,5 +300,9 @@ TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
 
 SPIDER_MIDDLEWARES = {
-   "lincoln_scraper.middlewares.LincolnScraperSpiderMiddleware": 543,
+   # Drops requests and items for documents the crawl already covered (by document key).
+   "lincoln_scraper.middlewares.DocumentDedupMiddleware": 900,
+   # Closest to the spider (after the built-in ones) so it can time the callbacks alone.
+   "lincoln_scraper.middlewares.LincolnScraperSpiderMiddleware": 950,
 }
+DOCUMENT_DEDUP_ENABLED = True
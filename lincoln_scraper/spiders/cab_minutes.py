@@ -1,28 +1,54 @@
 import scrapy
-from datetime import datetime
+from scrapy import signals
+from scrapy.exceptions import StopDownload
+from lincoln_scraper.canonical import document_key
+from lincoln_scraper.extraction import extract_listing_links, parse_link_date
 from lincoln_scraper.items import MeetingDocumentItem # Adjusted import path
 
+# How Hyland links are resolved to their final document URL (CAB_RESOLVE_METHOD):
+# 'head' sends a HEAD request and falls back to 'headers' when the server rejects it,
+# 'headers' sends a GET but stops the download as soon as the headers arrive,
+# 'get' downloads the whole document like a normal request.
+RESOLVE_METHODS = ('head', 'headers', 'get')
+# Status codes servers use to say they don't support HEAD.
+HEAD_REJECTED_CODES = [405, 501]
+
 class CabMinutesSpider(scrapy.Spider):
     name = 'cab_minutes'
     # Domains we are allowed to crawl. Includes the main site and the document hosting site.
     allowed_domains = ['www.codot.gov', 'oitco.hylandcloud.com']
+    # The codot.gov pages that list the Hyland document links, and what type of documents they generally contain.
+    listing_pages = [
+        {
+            'url': 'https://www.codot.gov/programs/aeronautics/colorado-aeronautical-board/cab-meeting-minutes-1',
+            'source_type': 'minutes' 
+        },
+        {
+            'url': 'https://www.codot.gov/programs/aeronautics/colorado-aeronautical-board/cab-packets',
+            'source_type': 'agenda_packet' 
+        }
+    ]
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.resolve_method = crawler.settings.get('CAB_RESOLVE_METHOD', 'head')
+        if spider.resolve_method not in RESOLVE_METHODS:
+            raise ValueError(f"Unknown CAB_RESOLVE_METHOD '{spider.resolve_method}'. Expected one of: {', '.join(RESOLVE_METHODS)}")
+        # Needed to cut off document downloads once we have the final URL.
+        crawler.signals.connect(spider.on_headers_received, signal=signals.headers_received)
+        return spider
     
+    # Scrapy 2.13+ entry point; older versions call start_requests() directly.
+    async def start(self):
+        for request in self.start_requests():
+            yield request
+
     # We're now fetching from two different pages on the codot site: one for minutes, one for packets.
     # This requires using start_requests() instead of the simple start_urls list.
     def start_requests(self):
-        # Define the source URLs and what type of documents they generally contain
-        sources = [
-            {
-                'url': 'https://www.codot.gov/programs/aeronautics/colorado-aeronautical-board/cab-meeting-minutes-1',
-                'source_type': 'minutes' 
-            },
-            {
-                'url': 'https://www.codot.gov/programs/aeronautics/colorado-aeronautical-board/cab-packets',
-                'source_type': 'agenda_packet' 
-            }
-        ]
         # Loop through our defined sources and create a request for each
-        for source in sources:
+        for source in self.listing_pages:
             yield scrapy.Request(
                 url=source['url'],
                 callback=self.parse_main_listing_page, # Send the response to our main parsing function
@@ -35,93 +61,160 @@ class CabMinutesSpider(scrapy.Spider):
         source_type = response.meta['source_type']
         self.logger.info(f"SUCCESS: Reached and processing main listing page: {response.url} (Source Type: {source_type})")
         
-        # Try a few CSS selectors to find the links to the actual documents (hosted on Hyland).
-        # The site structure might change, so having a few selectors makes it a bit more robust.
-        meeting_links_selectors = response.css('article div[class*="content"] p a, article div.item-list ul li a, article .field--name-body a')
-        # If the primary selectors don't find anything, broaden the search within the article tag.
-        if not meeting_links_selectors:
-            meeting_links_selectors = response.css('article a') 
-            # If still nothing, maybe the structure changed drastically? Try finding *any* link as a last resort.
-            if not meeting_links_selectors:
-                self.logger.warning(f"No meeting links found with primary or article selectors on {response.url}. Trying all links.")
-                meeting_links_selectors = response.css('a')
-        # If we *still* haven't found any links, something is wrong - log an error and stop processing this page.
-        if not meeting_links_selectors:
+        # Find the links to the actual documents (hosted on Hyland) in one pass over the page.
+        # The site structure might change, so the extractor falls back to broader XPaths
+        # (any link in the article, then any link at all) when the usual ones find nothing.
+        listing_links = extract_listing_links(response)
+        # If we haven't found any links, something is wrong - log an error and stop processing this page.
+        if not listing_links:
             self.logger.error(f"CRITICAL: No links found on {response.url} to process as meeting links.")
             return
+        if listing_links[0][2] > 0:
+            self.logger.warning(f"No meeting links found with the primary selectors on {response.url}. Using broader selectors.")
 
-        # Keep track of the Hyland document URLs we've already decided to visit
-        # to avoid requesting the same document multiple times if it's linked more than once.
-        processed_meeting_detail_urls = set()
         meeting_links_found_count = 0 # Counter to check if we found any valid date links
 
-        # Iterate through all the link elements we found
-        for link_selector in meeting_links_selectors:
-            # Extract the visible text of the link and the href (URL)
-            link_text_from_codot = link_selector.css('::text').get()
-            relative_url = link_selector.attrib.get('href')
+        # Iterate through all the links we found (text, absolute URL, which selector found it)
+        for link_text_from_codot, document_hyland_url, _ in listing_links:
+            # Recognize the date at the start of the link text. This handles every format seen
+            # on the site ("January 15, 2024", "Sept. 5, 2023", "March 3-4, 2022", "May 2021",
+            # "10/05/2020") followed by suffixes like " (Workshop)", and remembers texts it has seen.
+            link_date = parse_link_date(link_text_from_codot)
+            if not link_date:
+                # Not a meeting link (e.g. navigation), or a date format we don't know yet.
+                self.crawler.stats.inc_value('cab/links_without_date')
+                self.logger.debug("Link text has no recognizable date: '%s' (%s)", link_text_from_codot, document_hyland_url,
+                                  extra={'event': 'cab.link_without_date'})
+                continue
+
+            meeting_links_found_count += 1 # Increment our counter
+            # The date is already in the required YYYY-MM-DD format (the first day for ranges)
+            formatted_date = link_date.start
+
+            meta = { # Pass data along to the next function
+                'meeting_date_iso': formatted_date, # The parsed and formatted date
+                'original_link_text_from_codot': link_text_from_codot, # The original text from the link on codot.gov
+                'is_workshop': link_date.workshop, # Whether the link text marks the meeting as a workshop
+                'source_type': source_type, # Keep track of whether this came from the minutes or packets page
+                'listing_link': document_hyland_url, # Key for the crawl state store
+                # Which document this is ('hyland:<docid>'), however the link is spelled. A document
+                # linked more than once (on this page or the other listing page) is only requested
+                # once per crawl: DocumentDedupMiddleware drops the repeats.
+                'document_key': document_key(document_hyland_url),
+            }
 
-            # Skip if the link text or URL is missing, or if it's just an anchor link (#)
-            if not link_text_from_codot or not relative_url or relative_url.strip() == '#':
+            # If an earlier run already resolved this link, we may not need to fetch it again.
+            crawl_state = getattr(self, 'crawl_state', None)
+            known_document = crawl_state.get('hyland', document_hyland_url) if crawl_state else None
+            if known_document:
+                if not self.settings.getbool('CRAWL_STATE_REVALIDATE'):
+                    # Known document: reuse the stored URL without any request.
+                    self.crawler.stats.inc_value('crawl_state/skipped')
+                    yield self._build_item(meta, known_document['document_url'])
+                    continue
+                # Revalidate with a conditional request; a 304 means the stored URL is still good.
+                conditional_headers = {}
+                if known_document.get('etag'):
+                    conditional_headers['If-None-Match'] = known_document['etag']
+                if known_document.get('last_modified'):
+                    conditional_headers['If-Modified-Since'] = known_document['last_modified']
+                meta.update({
+                    'known_document': known_document,
+                    'handle_httpstatus_list': [304],
+                    'dont_cache': True, # The HTTP cache must not answer a revalidation
+                })
+                self.crawler.stats.inc_value('crawl_state/revalidated')
+                yield self._document_request(document_hyland_url, meta, conditional_headers)
                 continue
 
-            # Clean up the link text, often it includes things like " (Workshop)"
-            link_text_cleaned_for_date_parsing = link_text_from_codot.strip()
-            parsed_date = None
-            # Try to extract just the date part for parsing (e.g., remove " (Workshop)")
-            date_string_for_parsing = link_text_cleaned_for_date_parsing.split('(')[0].strip()
-
-            # Dates on the site aren't always in the same format, so try a few common ones.
-            date_formats_to_try = ["%B %d, %Y", "%b %d, %Y", "%B %Y", "%b. %d, %Y", "%m/%d/%Y"]
-            for fmt in date_formats_to_try:
-                try:
-                    # Attempt to parse the date string using the current format
-                    parsed_date = datetime.strptime(date_string_for_parsing, fmt)
-                    break # Stop trying formats if we successfully parse one
-                except ValueError:
-                    continue # Try the next format if this one failed
-            
-            # If we successfully parsed a date from the link text...
-            if parsed_date:
-                meeting_links_found_count += 1 # Increment our counter
-                # Format the date into the required YYYY-MM-DD format
-                formatted_date = parsed_date.strftime("%Y-%m-%d")
-                # Construct the full URL to the Hyland document page
-                document_hyland_url = response.urljoin(relative_url) 
-
-                # Check if we've already added this Hyland URL to our processing queue
-                if document_hyland_url in processed_meeting_detail_urls:
-                    self.logger.debug(f"Skipping already queued/processed Hyland URL: {document_hyland_url} from {response.url}")
-                    continue # Skip to the next link if we have
-                processed_meeting_detail_urls.add(document_hyland_url) # Add the URL to our set so we don't process it again
-                
-                # Log that we're about to request the Hyland document page
-                self.logger.info(f"Yielding request for document (Hyland): Original Link Text='{link_text_from_codot.strip()}', Hyland URL='{document_hyland_url}', Source Type='{source_type}'")
-                # Create a new request to fetch the Hyland document page
-                yield scrapy.Request(
-                    document_hyland_url, # The URL for the Hyland page (might redirect to PdfPop.aspx)
-                    callback=self.parse_meeting_document_page, # Send this response to the document parsing function
-                    meta={ # Pass data along to the next function
-                        'meeting_date_iso': formatted_date, # The parsed and formatted date
-                        'original_link_text_from_codot': link_text_from_codot.strip(), # The original text from the link on codot.gov
-                        'source_type': source_type # Keep track of whether this came from the minutes or packets page
-                    }
-                )
-        
+            # Log that we're about to request the Hyland document page. Per-link messages are DEBUG with
+            # lazy %-style arguments, so they cost next to nothing unless someone is reading them.
+            self.logger.debug("Yielding request for document (Hyland): Original Link Text='%s', Hyland URL='%s', Source Type='%s'",
+                              link_text_from_codot, document_hyland_url, source_type, extra={'event': 'cab.request'})
+            # Create a new request to resolve the Hyland document URL
+            yield self._document_request(document_hyland_url, meta)
+    
         # After checking all links, if we didn't find any that looked like dates, log a warning.
         if meeting_links_found_count == 0:
             self.logger.warning(f"No links on {response.url} (Source: {source_type}) were successfully parsed as meeting date links. Please verify selectors and link text formats.")
 
+    # Build the request that resolves a Hyland link (which might redirect to PdfPop.aspx) to its final URL.
+    # We only need the final URL, so by default we avoid downloading the document body at all.
+    def _document_request(self, url, meta, headers=None, method=None):
+        method = method or self.resolve_method
+        meta = dict(meta)
+        headers = dict(headers or {})
+        if method in ('head', 'headers'):
+            # The response has no body (HEAD, or a GET stopped after its headers), which the
+            # HTTP cache would otherwise store and later serve for the whole document.
+            meta['dont_cache'] = True
+        if method == 'head':
+            # Let rejected HEAD requests through to the callback so it can fall back to GET.
+            meta['handle_httpstatus_list'] = meta.get('handle_httpstatus_list', []) + HEAD_REJECTED_CODES
+        elif method == 'headers':
+            meta['stop_after_headers'] = True
+            # An empty body can't be decompressed, so ask for the document uncompressed.
+            headers['Accept-Encoding'] = 'identity'
+        return scrapy.Request(
+            url,
+            method='HEAD' if method == 'head' else 'GET',
+            headers=headers,
+            callback=self.parse_meeting_document_page, # Send this response to the document parsing function
+            meta=meta,
+        )
+
+    # Signal handler: stop downloading as soon as the headers of a 'headers' mode request arrive.
+    # Redirect responses are stopped too; the redirect middleware only needs their Location header.
+    def on_headers_received(self, headers, body_length, request, spider):
+        if spider is self and request.meta.get('stop_after_headers'):
+            self.crawler.stats.inc_value('cab/downloads_stopped_after_headers')
+            raise StopDownload(fail=False)
+
     # This function handles the response after following a link to the Hyland document page (e.g., PdfPop.aspx)
     def parse_meeting_document_page(self, response):
-        # Retrieve the data we passed along in the meta dictionary
-        meeting_date_iso = response.meta['meeting_date_iso']
-        original_link_text_from_codot = response.meta['original_link_text_from_codot'] 
-        source_type = response.meta['source_type'] # 'minutes' or 'agenda_packet'
+        if response.request.method == 'HEAD' and response.status in HEAD_REJECTED_CODES:
+            # The server doesn't support HEAD: retry as a GET that stops after the headers.
+            self.logger.info("HEAD rejected with %s for %s, falling back to GET.", response.status, response.url,
+                             extra={'event': 'cab.head_fallback'})
+            self.crawler.stats.inc_value('cab/head_fallbacks')
+            meta = {key: value for key, value in response.meta.items() if key in (
+                'meeting_date_iso', 'original_link_text_from_codot', 'is_workshop', 'source_type', 'listing_link',
+                'known_document', 'document_key')}
+            headers = {
+                name: value for name, value in response.request.headers.items()
+                if name.lower() in (b'if-none-match', b'if-modified-since')
+            }
+            if 'known_document' in meta:
+                meta.update({'handle_httpstatus_list': [304], 'dont_cache': True})
+            yield self._document_request(response.meta['listing_link'], meta, headers, method='headers')
+            return
+
         # The final URL after any redirects (usually ends in PdfPop.aspx?docid=...)
         document_url = response.url
+        if response.status == 304:
+            # Not modified since the last run: the stored document URL is still valid.
+            document_url = response.meta['known_document']['document_url']
+            self.crawler.stats.inc_value('crawl_state/not_modified')
+
+        # Remember the resolved URL and validators so later runs can skip or revalidate it.
+        crawl_state = getattr(self, 'crawl_state', None)
+        if crawl_state and response.status != 304:
+            crawl_state.set('hyland', response.meta['listing_link'], {
+                'document_url': document_url,
+                'etag': response.headers.get('ETag', b'').decode('latin-1') or None,
+                'last_modified': response.headers.get('Last-Modified', b'').decode('latin-1') or None,
+            })
+
+        yield self._build_item(response.meta, document_url)
+
+    def _build_item(self, meta, document_url):
+        # Retrieve the data we passed along in the meta dictionary
+        meeting_date_iso = meta['meeting_date_iso']
+        original_link_text_from_codot = meta['original_link_text_from_codot']
+        source_type = meta['source_type'] # 'minutes' or 'agenda_packet'
 
-        self.logger.info(f"Processing document page: URL='{document_url}' for date '{meeting_date_iso}', from link '{original_link_text_from_codot}', Source='{source_type}'")
+        self.logger.debug("Processing document page: URL='%s' for date '%s', from link '%s', Source='%s'",
+                          document_url, meeting_date_iso, original_link_text_from_codot, source_type, extra={'event': 'cab.document'})
         
         # Determine the category based on which codot.gov page the link came from.
         # This is a simplification based on the source page, not the document content itself.
@@ -132,7 +225,7 @@ class CabMinutesSpider(scrapy.Spider):
         # Try to create a slightly more descriptive meeting title than just the date.
         descriptive_meeting_title = "Board Meeting" # Default title
         # Check if the original link text mentioned it was a workshop
-        if "(workshop)" in original_link_text_from_codot.lower():
+        if meta.get('is_workshop', "(workshop)" in original_link_text_from_codot.lower()):
             descriptive_meeting_title = "Board Workshop"
 
         # Create an item to store the extracted data
@@ -141,8 +234,11 @@ class CabMinutesSpider(scrapy.Spider):
         item['meeting_title'] = descriptive_meeting_title # Use our generated title
         item['category'] = category # Use the category determined by the source page
         item['URL'] = document_url # The final URL of the document
+        item['source'] = self.name # Which spider produced it
+        item['document_key'] = meta.get('document_key') or document_key(document_url) # The upsert key
         
-        # Log the item we're about to yield
-        self.logger.info(f"Yielding item: Date='{item['date']}', Title='{item['meeting_title']}', Category='{item['category']}', URL='{item['URL']}' (Source: {source_type})")
-        # Yield the item so Scrapy can process it (e.g., save it to the CSV)
-        yield item 
\ No newline at end of file
+        # Log the item we're about to return
+        self.logger.debug("Yielding item: Date='%s', Title='%s', Category='%s', URL='%s' (Source: %s)",
+                          item['date'], item['meeting_title'], item['category'], item['URL'], source_type, extra={'event': 'cab.item'})
+        # Return the item so the caller can yield it to Scrapy (e.g., to save it to MongoDB)
+        return item 
\ No newline at end of file
@@ -0,0 +1,558 @@
+import scrapy
+import json
+import math
+from datetime import datetime, timedelta 
+from urllib.parse import urlparse
+from scrapy import signals
+from scrapy.utils.project import data_path
+from lincoln_scraper.backfill import BackfillCheckpoint, date_shards, parse_date_arg
+from lincoln_scraper.canonical import civicclerk_document_key
+from lincoln_scraper.extraction import STREAMING_JSON_AVAILABLE, ijson, iso_date, iter_odata_values
+from lincoln_scraper.items import MeetingDocumentItem
+from lincoln_scraper.mongo import get_client, release_client
+
+# OData projection: only the event fields the spider actually uses come over the wire.
+PROJECTED_SELECT = 'id,eventName,startDateTime'
+PROJECTED_EXPAND = 'publishedFiles($select=type,fileId)'
+# Paging modes: 'parallel' asks for $count on the first page and then requests every
+# other page at once with $top/$skip; 'nextlink' follows @odata.nextLink one page at a time.
+PAGING_MODES = ('parallel', 'nextlink')
+
+
+def normalize_tenant(config):
+    # A tenant only needs its CivicClerk id (the subdomain, e.g. 'lincolncowi');
+    # everything else can be overridden per tenant in the config.
+    tenant_id = config['id']
+    return {
+        'id': tenant_id,
+        'name': config.get('name', tenant_id),
+        # The CivicClerk API endpoint for accessing event (meeting) data.
+        'api_base_url': config.get('api_base_url', f"https://{tenant_id}.api.civicclerk.com/v1/Events"),
+        # The base URL for constructing direct links to document files.
+        'portal_base_url': config.get('portal_base_url', f"https://{tenant_id}.portal.civicclerk.com"),
+        # The API endpoint that streams a published file (used by DocumentDownloadPipeline).
+        'file_stream_url': config.get(
+            'file_stream_url',
+            f"https://{tenant_id}.api.civicclerk.com/v1/Meetings/GetMeetingFileStream(fileId={{file_id}},plainText=false)",
+        ),
+        # Optional per-tenant download slot overrides.
+        'concurrency': config.get('concurrency'),
+        'delay': config.get('delay'),
+        # Value stored in the items' 'source' field (defaults to "<spider>/<tenant id>").
+        'source': config.get('source'),
+    }
+
+
+def load_tenants(settings):
+    # Tenants come from CIVICCLERK_TENANTS (a list in settings), a JSON file
+    # (CIVICCLERK_TENANTS_FILE) or a Mongo collection (CIVICCLERK_TENANTS_COLLECTION).
+    tenants = settings.getlist('CIVICCLERK_TENANTS')
+    if not tenants and settings.get('CIVICCLERK_TENANTS_FILE'):
+        with open(settings.get('CIVICCLERK_TENANTS_FILE'), encoding='utf-8') as f:
+            tenants = json.load(f)
+    elif not tenants and settings.get('CIVICCLERK_TENANTS_COLLECTION'):
+        client = get_client(settings.get('MONGO_URI'))
+        try:
+            collection = client[settings.get('MONGO_DB', 'scrapy_data')][settings.get('CIVICCLERK_TENANTS_COLLECTION')]
+            tenants = list(collection.find({}, {'_id': 0}))
+        finally:
+            release_client(settings.get('MONGO_URI'))
+    # Rows can be switched off without deleting them.
+    return [tenant for tenant in tenants if tenant.get('enabled', True)]
+
+
+class CivicClerkSpider(scrapy.Spider):
+    """Scrapes meeting documents from any number of CivicClerk tenants at once.
+
+    Each tenant gets its own download slot (its API host), so tenants are crawled
+    concurrently while each host still sees at most CIVICCLERK_PAGE_CONCURRENCY
+    requests. Adding a jurisdiction means adding a row to the tenant config.
+    """
+    name = 'civicclerk'
+    # Subclasses for a single jurisdiction list their tenant here instead of using the config.
+    tenants = None
+
+    # Maximum pages per tenant and date window. 0 means no limit.
+    max_pages = 0
+    # Paging mode and page size ($top) used by the 'parallel' mode.
+    paging = 'parallel'
+    page_size = 100
+
+    custom_settings = {
+        'LOG_LEVEL': 'INFO',
+        # Spread requests across tenants: many hosts can be busy at once, while the
+        # per-host limits still come from the tenant download slots.
+        'CONCURRENT_REQUESTS': 64,
+        # CivicClerk tenants share IP addresses, so per-IP slots would serialize them.
+        'CONCURRENT_REQUESTS_PER_IP': 0,
+    }
+
+    def __init__(self, *args, paging=None, page_size=None, max_pages=None,
+                 since=None, until=None, shard='month', **kwargs):
+        super().__init__(*args, **kwargs)
+        # Spider arguments (-a paging=nextlink -a page_size=50 -a max_pages=0) arrive as strings.
+        if paging is not None:
+            self.paging = paging
+        if self.paging not in PAGING_MODES:
+            raise ValueError(f"Unknown paging mode '{self.paging}'. Expected one of: {', '.join(PAGING_MODES)}")
+        if page_size is not None:
+            self.page_size = int(page_size)
+        if max_pages is not None:
+            self.max_pages = int(max_pages)
+        self.page_counts = {} # tenant id -> pages parsed
+
+        # Backfill mode (-a since=2010-01-01 [-a until=2015-12-31] [-a shard=quarter]):
+        # the range is split into month or quarter shards that are crawled concurrently,
+        # each with its own $filter, and completed shards are checkpointed to disk.
+        self.backfill = since is not None
+        if self.backfill:
+            self.since = parse_date_arg(since)
+            self.until = parse_date_arg(until) if until else (datetime.utcnow() + timedelta(days=45)).date()
+            # The default end moves every day; only an explicit one names the checkpoint.
+            self.until_given = until is not None
+            self.shard_unit = shard
+            if max_pages is None:
+                self.max_pages = 0 # A backfill wants every page of every shard.
+            # A backfill only covers part of the history (and skips finished shards when
+            # resuming), so the Mongo pipeline must not prune documents it didn't see.
+            self.allow_prune = False
+        self.shard_pages = {} # shard key -> page requests not yet parsed
+        self.failed_shards = set()
+
+    @classmethod
+    def tenant_configs(cls, settings):
+        if cls.tenants is not None:
+            return cls.tenants
+        # update_settings() loads the tenants once and keeps them in the crawler's
+        # settings, so from_crawler() doesn't read the file or collection again.
+        loaded = settings.get('CIVICCLERK_LOADED_TENANTS')
+        if loaded is not None:
+            return loaded
+        return load_tenants(settings)
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.tenants = {}
+        # Stream large API pages with ijson when its compiled backend is installed, else use json.loads.
+        spider.stream_json = crawler.settings.getbool('CIVICCLERK_STREAM_JSON', True) and STREAMING_JSON_AVAILABLE
+        spider.stream_json_min_bytes = crawler.settings.getint('CIVICCLERK_STREAM_JSON_MIN_BYTES', 1024 * 1024)
+        for config in cls.tenant_configs(crawler.settings):
+            tenant = normalize_tenant(config)
+            tenant['api_host'] = urlparse(tenant['api_base_url']).hostname
+            tenant['source'] = tenant['source'] or f"{spider.name}/{tenant['id']}"
+            # Set headers to mimic a browser request, important for some APIs.
+            tenant['api_headers'] = {
+                'Accept': 'application/json', # We expect JSON response from the API
+                'Accept-Language': 'en-US,en;q=0.9',
+                'Origin': tenant['portal_base_url'], # Often needed for CORS
+                'Referer': tenant['portal_base_url'] + '/', # Often needed for context
+            }
+            spider.tenants[tenant['id']] = tenant
+        crawler.signals.connect(spider._page_dropped, signal=signals.request_dropped)
+        if not spider.tenants:
+            raise ValueError("No CivicClerk tenants configured. Set CIVICCLERK_TENANTS, CIVICCLERK_TENANTS_FILE or CIVICCLERK_TENANTS_COLLECTION.")
+        spider.allowed_domains = sorted(
+            {tenant['api_host'] for tenant in spider.tenants.values()}
+            | {urlparse(tenant['portal_base_url']).hostname for tenant in spider.tenants.values()}
+        )
+        return spider
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        # Page requests go through a dedicated download slot per tenant API host, so the
+        # parallel paging mode is bounded by CIVICCLERK_PAGE_CONCURRENCY (or the tenant's
+        # own 'concurrency'/'delay') rather than CONCURRENT_REQUESTS_PER_DOMAIN, and
+        # AutoThrottle adapts to each host separately. An explicit DOWNLOAD_SLOTS entry wins.
+        slots = settings.getdict('DOWNLOAD_SLOTS')
+        configs = cls.tenant_configs(settings)
+        settings.set('CIVICCLERK_LOADED_TENANTS', configs, priority='spider')
+        for config in configs:
+            tenant = normalize_tenant(config)
+            slots.setdefault(urlparse(tenant['api_base_url']).hostname, {
+                'concurrency': tenant['concurrency'] or settings.getint('CIVICCLERK_PAGE_CONCURRENCY', 4),
+                'delay': tenant['delay'] if tenant['delay'] is not None else settings.getfloat('CIVICCLERK_PAGE_DELAY', 0),
+            })
+        settings.set('DOWNLOAD_SLOTS', slots, priority='spider')
+
+    async def start(self):
+        # Scrapy 2.13+ entry point; older versions call start_requests() directly.
+        for request in self.start_requests():
+            yield request
+
+    def start_requests(self):
+        self.logger.info(f"Crawling {len(self.tenants)} CivicClerk tenants: {', '.join(self.tenants)}")
+        for tenant in self.tenants.values():
+            if self.backfill:
+                yield from self._backfill_requests(tenant)
+            else:
+                yield from self._window_requests(tenant)
+
+    def _window_requests(self, tenant):
+
+        # Instead of scraping the static meeting page, we query the API directly.
+        # To make the scraped data somewhat relevant, we create a dynamic date window 
+        # around the current time, rather than fetching *all* historical/future data.
+        today_utc = datetime.utcnow()
+
+        # Define the window: e.g., 15 days back, 45 days forward. 
+        # This is arbitrary but ensures we get some recent data.
+        start_date_limit_obj = today_utc - timedelta(days=15) 
+        end_date_limit_obj = today_utc + timedelta(days=45) 
+
+        # Format dates into the ISO 8601 format required by the OData API filter.
+        filter_start_date_str = start_date_limit_obj.strftime('%Y-%m-%dT00:00:00Z')
+        # Use 23:59:59 to ensure the end date is inclusive.
+        filter_end_date_str = end_date_limit_obj.strftime('%Y-%m-%dT23:59:59Z') 
+
+        self.logger.info(f"Calculated dynamic date window for filtering: START = {filter_start_date_str}, END = {filter_end_date_str}")
+
+        window = (filter_start_date_str, filter_end_date_str)
+        url = self._events_url(tenant, window, skip=0)
+        
+        self.logger.info(f"Starting scrape of {tenant['id']} for DYNAMIC date range ({self.max_pages} pages max, {self.paging} paging) with URL: {url}")
+        yield self._page_request(tenant, url, {'window': window, 'skip': 0, 'projected': True})
+
+    def _backfill_requests(self, tenant):
+        if not hasattr(self, 'checkpoint'):
+            # Named without the default end date, so a backfill resumed on a later day
+            # finds the checkpoint of the earlier run (shard keys don't depend on it).
+            until = f"_{self.until}" if self.until_given else ''
+            checkpoint_name = f"backfill_{self.name}_{self.since}{until}_{self.shard_unit}.json"
+            checkpoint_dir = self.settings.get('BACKFILL_CHECKPOINT_DIR')
+            if checkpoint_dir:
+                checkpoint_path = f"{checkpoint_dir.rstrip('/')}/{checkpoint_name}"
+            else:
+                checkpoint_path = data_path(checkpoint_name, createdir=True)
+            self.checkpoint = BackfillCheckpoint(checkpoint_path).load()
+
+        # Shard keys include the tenant, so one checkpoint file covers every tenant.
+        shards = [(f"{tenant['id']}:{key}", start, end) for key, start, end in date_shards(self.since, self.until, self.shard_unit)]
+        pending = [shard for shard in shards if shard[0] not in self.checkpoint.completed]
+        self.logger.info(f"Backfill of {tenant['id']} {self.since}..{self.until}: {len(pending)} of {len(shards)} {self.shard_unit} shards to crawl (checkpoint: {self.checkpoint.path}).")
+        self.crawler.stats.inc_value('backfill/shards_total', len(shards))
+        self.crawler.stats.inc_value('backfill/shards_skipped', len(shards) - len(pending))
+        # All shards are scheduled at once; the API download slot decides how many run concurrently.
+        for shard_key, shard_start, shard_end in pending:
+            window = (shard_start.strftime('%Y-%m-%dT00:00:00Z'), shard_end.strftime('%Y-%m-%dT23:59:59Z'))
+            url = self._events_url(tenant, window, skip=0)
+            yield self._page_request(tenant, url, {'window': window, 'skip': 0, 'projected': True, 'shard': shard_key})
+
+    def _events_url(self, tenant, window, skip=0, projected=True):
+        filter_start_date_str, filter_end_date_str = window
+        # Construct the OData $filter query parameter. 
+        # %20 is URL encoding for space, ge = >=, le = <=.
+        odata_filter = (
+            f"startDateTime%20ge%20{filter_start_date_str}"
+            f"%20and%20startDateTime%20le%20{filter_end_date_str}"
+        )
+        
+        # Construct the full API URL with filtering and sorting.
+        # Sorting ensures consistent pagination, which $skip-based paging relies on.
+        url = f"{tenant['api_base_url']}?$filter={odata_filter}&$orderby=startDateTime%20asc,%20eventName%20asc"
+        if self.paging == 'parallel':
+            # $count on the first page tells us how many pages to request at once.
+            url += f"&$top={self.page_size}&$skip={skip}"
+            if skip == 0:
+                url += "&$count=true"
+        if projected:
+            url += f"&$select={PROJECTED_SELECT}&$expand={PROJECTED_EXPAND}"
+        return url
+
+    def _page_request(self, tenant, url, meta):
+        headers = tenant['api_headers']
+        meta = dict(meta, tenant=tenant['id'], download_slot=tenant['api_host'])
+        if meta.get('shard'):
+            # Count outstanding pages per shard; the shard is complete when this drops to 0.
+            self.shard_pages[meta['shard']] = self.shard_pages.get(meta['shard'], 0) + 1
+        if meta.get('projected'):
+            # Let a rejected $select/$expand reach parse() so it can retry without projection.
+            meta['handle_httpstatus_list'] = [400]
+        if self.paging == 'parallel':
+            # Parallel pages are bounded by the slot concurrency; keep AutoThrottle from
+            # turning them back into one request per delay.
+            meta['autothrottle_dont_adjust_delay'] = True
+        # When an earlier run saw this page, ask the API whether it changed.
+        # A 304 answer lets us replay the stored items instead of re-downloading the page.
+        meta['page_key'] = self._page_key(tenant, meta)
+        crawl_state = getattr(self, 'crawl_state', None)
+        known_page = crawl_state.get('civicclerk_page', meta['page_key']) if crawl_state else None
+        if known_page and known_page.get('next_link') and list(known_page.get('window') or ()) != list(meta.get('window') or ()):
+            # The stored nextLink still carries the old window, so it can't be replayed.
+            known_page = None
+        if known_page and (known_page.get('etag') or known_page.get('last_modified')):
+            headers = dict(headers)
+            if known_page.get('etag'):
+                headers['If-None-Match'] = known_page['etag']
+            if known_page.get('last_modified'):
+                headers['If-Modified-Since'] = known_page['last_modified']
+            meta['handle_httpstatus_list'] = meta.get('handle_httpstatus_list', []) + [304]
+            meta['dont_cache'] = True
+        return scrapy.Request(url=url, headers=headers, callback=self.parse, errback=self._page_failed, meta=meta)
+
+    def _page_key(self, tenant, meta):
+        # The events URL holds the date window, which moves every day; a page's place in
+        # the crawl (tenant, backfill shard, offset or nextLink hop) doesn't.
+        scope = meta.get('shard') or 'window'
+        position = f"skip{meta['skip']}" if meta.get('skip') is not None else f"next{meta.get('link_depth', 0)}"
+        return f"{tenant['id']}:{scope}:{position}"
+
+    def parse(self, response):
+        shard = response.meta.get('shard')
+        try:
+            yield from self._parse_page(response)
+        except Exception:
+            # Whatever the page still held is lost, so the shard must be crawled again.
+            if shard:
+                self.failed_shards.add(shard)
+            raise
+        finally:
+            self._page_finished(shard)
+
+    def _page_failed(self, failure):
+        shard = failure.request.meta.get('shard')
+        self.logger.error(f"Request failed for {failure.request.url}: {failure.getErrorMessage()}")
+        if shard:
+            # A shard with a failed page is not checkpointed, so a resumed backfill retries it.
+            self.failed_shards.add(shard)
+        self._page_finished(shard)
+
+    def _page_dropped(self, request, spider=None):
+        # The scheduler dropped a page request (e.g. the dupefilter saw it already):
+        # neither parse() nor the errback will run, so the page is done here.
+        if request.callback == self.parse:
+            self._page_finished(request.meta.get('shard'))
+
+    def _page_finished(self, shard):
+        if not shard:
+            return
+        self.shard_pages[shard] -= 1
+        if self.shard_pages[shard] == 0 and shard in self.failed_shards:
+            self.crawler.stats.inc_value('backfill/shards_failed')
+            self.logger.warning(f"Backfill shard {shard} had failed pages; it is not checkpointed and will be retried on resume.")
+        elif self.shard_pages[shard] == 0:
+            self.checkpoint.mark_completed(shard)
+            self.crawler.stats.inc_value('backfill/shards_completed')
+            self.logger.info(f"Backfill shard {shard} completed.")
+
+    def _parse_page(self, response):
+        tenant = self.tenants[response.meta['tenant']]
+        if response.status == 400 and response.meta.get('projected'):
+            # The server rejected $select/$expand: request the same page with full event objects.
+            self.logger.warning(f"API rejected the projected query for {response.url}. Retrying without $select/$expand.")
+            self.crawler.stats.inc_value('civicclerk/projection_fallbacks')
+            meta = {key: response.meta[key] for key in ('window', 'skip', 'shard', 'link_depth') if key in response.meta}
+            meta['projected'] = False
+            url = self._events_url(tenant, meta['window'], skip=meta.get('skip', 0), projected=False)
+            yield self._page_request(tenant, url, meta)
+            return
+
+        page_count = self.page_counts[tenant['id']] = self.page_counts.get(tenant['id'], 0) + 1
+        self.logger.info("Parsing page %s of %s: %s", page_count, tenant['id'], response.url, extra={'event': 'civicclerk.page'})
+
+        crawl_state = getattr(self, 'crawl_state', None)
+        if response.status == 304:
+            # Page unchanged since the last run: replay its stored items and pagination.
+            known_page = crawl_state.get('civicclerk_page', response.meta['page_key'])
+            self.crawler.stats.inc_value('crawl_state/not_modified')
+            for file_key in known_page['files']:
+                yield MeetingDocumentItem(crawl_state.get('civicclerk_file', file_key))
+            yield from self._next_pages(tenant, response, known_page.get('next_link'),
+                                        known_page.get('count'), known_page.get('returned', 0))
+            return
+
+        # Record which files this page listed so an unchanged page can be replayed later.
+        page_file_keys = []
+        
+        # API response structure has the list of events under the 'value' key. The events
+        # are decoded one at a time, so items reach the pipelines while the rest of the page
+        # is still being parsed; 'page' collects the other fields (nextLink, count) on the way.
+        page = {}
+        for event in self._page_events(response, page):
+            # Basic data validation and extraction for each meeting event.
+            meeting_date_iso = event.get('startDateTime')
+            if not meeting_date_iso:
+                self.logger.warning(f"Event missing 'startDateTime'. Event data: {event}")
+                continue # Skip event if essential date is missing
+            # Take the YYYY-MM-DD part of the ISO timestamp (shared with the CAB spider's extraction layer).
+            meeting_date_str = iso_date(meeting_date_iso)
+            if not meeting_date_str:
+                self.logger.error(f"Could not parse date: {meeting_date_iso} for event {event.get('eventName')}")
+                continue
+
+            meeting_title = event.get('eventName', 'N/A')
+            event_id = event.get('id')
+
+            if not event_id:
+                self.logger.warning(f"Event '{meeting_title}' on {meeting_date_str} is missing an 'id'. Skipping its files.")
+                continue
+            
+            # Events can have multiple associated files.
+            published_files = event.get('publishedFiles', [])
+            if not published_files:
+                self.logger.debug("No published files for event '%s' (ID: %s) on %s.", meeting_title, event_id, meeting_date_str,
+                                  extra={'event': 'civicclerk.no_files'})
+
+            # Process each file associated with the meeting.
+            for file_info in published_files:
+                # The API provides a 'type' field (e.g., 'Agenda', 'Minutes').
+                api_file_type = file_info.get('type', '') 
+                file_type_name_lower = api_file_type.lower()
+                
+                # File ID is needed to construct the download URL.
+                file_id = file_info.get('fileId') 
+
+                if not file_id or file_id == 0: 
+                    self.logger.warning(
+                        f"File for event '{meeting_title}' (ID: {event_id}) is missing a valid 'fileId' (found: {file_id}). "
+                        f"Original API type: '{api_file_type}'. Skipping this file."
+                    )
+                    continue
+
+                # Map the API file type to the required categories.
+                # Default to 'other' and be specific about other categories.
+                category = 'other'  
+                if 'agenda' in file_type_name_lower and 'packet' in file_type_name_lower:
+                    category = 'agenda_packet'
+                elif 'agenda' in file_type_name_lower: # Check after agenda_packet
+                    category = 'agenda'
+                elif 'minutes' in file_type_name_lower:
+                    category = 'minutes'
+                
+                # Optional: Log when a file is categorized as 'other' for potential review.
+                if category == 'other' and api_file_type:
+                    self.logger.info(
+                        "File with API type '%s' for event %s, fileId %s categorized as 'other'.",
+                        api_file_type, event_id, file_id, extra={'event': 'civicclerk.other_category'}
+                    )
+
+                # Construct the direct download URL for the file.
+                # NOTE: The path component '/agenda/' seems required based on observed portal URLs,
+                # even for minutes/packets. Might need adjustment if the portal structure changes.
+                url_path_component = 'agenda'
+                                
+                file_url = f"{tenant['portal_base_url']}/event/{event_id}/files/{url_path_component}/{file_id}"
+                
+                # Yield an item matching the desired output structure for each document.
+                item = MeetingDocumentItem()
+                item['date'] = meeting_date_str
+                item['meeting_title'] = meeting_title
+                item['category'] = category
+                item['URL'] = file_url
+                item['source'] = tenant['source']
+                item['tenant'] = tenant['id'] # Which CivicClerk jurisdiction the document belongs to
+                item['download_url'] = tenant['file_stream_url'].format(file_id=file_id) # The file itself, not the portal page
+                # The same file can show up under several events, pages or spiders; the key unites them.
+                item['document_key'] = civicclerk_document_key(tenant['id'], file_id)
+                if crawl_state:
+                    file_key = f"{tenant['id']}:{event_id}:{file_id}"
+                    crawl_state.set('civicclerk_file', file_key, dict(item))
+                    page_file_keys.append(file_key)
+                yield item
+
+        if page['error']:
+            # Malformed JSON: keep the shard out of the checkpoint so a resumed backfill retries it.
+            if response.meta.get('shard'):
+                self.failed_shards.add(response.meta['shard'])
+            return
+        if not page['returned']:
+            self.logger.info("No events found on page %s for URL: %s (within the dynamically filtered date range).",
+                             page_count, response.url, extra={'event': 'civicclerk.empty_page'})
+
+        # The API provides the URL for the next page in '@odata.nextLink'
+        # and, when we asked for $count, the total number of matching events.
+        next_link = page['fields'].get('@odata.nextLink')
+        count = page['fields'].get('@odata.count')
+        if crawl_state:
+            crawl_state.set('civicclerk_page', response.meta['page_key'], {
+                'window': response.meta.get('window'),
+                'etag': response.headers.get('ETag', b'').decode('latin-1') or None,
+                'last_modified': response.headers.get('Last-Modified', b'').decode('latin-1') or None,
+                'files': page_file_keys,
+                'next_link': next_link,
+                'count': count,
+                'returned': page['returned'],
+            })
+        yield from self._next_pages(tenant, response, next_link, count, page['returned'])
+
+    def _page_events(self, response, page):
+        # Yields the events of an API page and fills 'page' with its other top-level fields
+        # ('fields'), the number of events ('returned') and whether the JSON was malformed ('error').
+        page.update(fields={}, returned=0, error=False)
+        if self.stream_json and len(response.body) >= self.stream_json_min_bytes:
+            # Large page: stream the 'value' array from the raw bytes with ijson.
+            self.crawler.stats.inc_value('civicclerk/pages_streamed')
+            try:
+                for event in iter_odata_values(response.body, page['fields']):
+                    page['returned'] += 1
+                    yield event
+            except ijson.JSONError as e:
+                # Events before the error have already been yielded; stop at the bad part.
+                self.logger.error(f"Failed to parse JSON from {response.url} after {page['returned']} events: {e}. Response body: {response.text[:500]}")
+                page['error'] = True
+            return
+        try:
+            data = json.loads(response.body)
+        except json.JSONDecodeError:
+            self.logger.error(f"Failed to parse JSON from {response.url}. Response body: {response.text[:500]}")
+            page['error'] = True
+            return
+        page['fields'].update((key, value) for key, value in data.items() if key != 'value')
+        for event in data.get('value', []):
+            page['returned'] += 1
+            yield event
+
+    def _next_pages(self, tenant, response, next_link, count, returned):
+        skip = response.meta.get('skip')
+        # Pages reached through a nextLink (skip is None) just keep following nextLinks.
+        if self.paging == 'parallel' and skip is not None:
+            if skip != 0:
+                # Pages after the first are all scheduled up front by the first page.
+                return
+            # The server honoured $count and $top: schedule every remaining page at once.
+            if count is not None and returned == min(self.page_size, count):
+                total_pages = math.ceil(count / self.page_size) if count else 1
+                if self.max_pages and total_pages > self.max_pages:
+                    total_pages = self.max_pages
+                    self._stop_at_page_limit(tenant)
+                self.logger.info(f"API reports {count} events; requesting {total_pages - 1} more pages in parallel.")
+                for page_index in range(1, total_pages):
+                    meta = {
+                        'window': response.meta['window'],
+                        'skip': page_index * self.page_size,
+                        'projected': response.meta.get('projected', False),
+                        'shard': response.meta.get('shard'),
+                    }
+                    url = self._events_url(tenant, meta['window'], skip=meta['skip'], projected=meta['projected'])
+                    yield self._page_request(tenant, url, meta)
+                return
+            # Otherwise fall back to following @odata.nextLink.
+            self.logger.info(f"API ignored $count/$top for {response.url}. Falling back to nextLink paging.")
+            self.crawler.stats.inc_value('civicclerk/nextlink_fallbacks')
+        yield from self._follow_next_link(tenant, response, next_link)
+
+    def _follow_next_link(self, tenant, response, next_link):
+        # Pagination logic: Check if we are below the max page limit and if the API provided a next link.
+        if not self.max_pages or self.page_counts[tenant['id']] < self.max_pages: 
+            if next_link:
+                self.logger.info("Following pagination link to: %s", next_link, extra={'event': 'civicclerk.next_page'})
+                # Keep the window so a rejected projection can still be retried; the
+                # nextLink carries the rest of the query itself.
+                meta = {'window': response.meta.get('window'), 'skip': None, 'projected': False,
+                        'shard': response.meta.get('shard'), 'link_depth': response.meta.get('link_depth', 0) + 1}
+                yield self._page_request(tenant, next_link, meta)
+            else:
+                self.logger.info(f"No more pages to scrape (API provided no nextLink or all data within date range fetched before {self.max_pages} pages).")
+        elif next_link:
+            # Stop scraping once the page limit is reached.
+            self.logger.info(f"Reached max_pages limit ({self.max_pages}). Stopping pagination.")
+            self._stop_at_page_limit(tenant)
+
+    def _stop_at_page_limit(self, tenant):
+        # Pages past max_pages were left out, so this run didn't see every document of the
+        # window: the Mongo pipeline must not prune the documents it missed.
+        if getattr(self, 'allow_prune', True):
+            self.logger.warning(f"max_pages ({self.max_pages}) cut {tenant['id']} short; pruning is disabled for this run.")
+        self.allow_prune = False
+        self.crawler.stats.inc_value('civicclerk/truncated_windows')
\ No newline at end of file